@@ -1,12 +1,24 @@
 import os
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+from flask import Flask, render_template, request, flash, redirect, session, g, abort, jsonify
+from flask_migrate import Migrate
 # from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy import or_
 
 from forms import UserAddForm, LoginForm, MessageForm, EditProfileForm
-from models import db, connect_db, User, Message, Follows, Likes
+from assets import Assets
+from availability import Availability
+from caching import LRUCache
+from conditional import not_modified, cache_headers
+from fragments import FragmentCache
+from instrumentation import Instrumentation
+from metrics import Metrics, MeteredQueuePool, observe_bcrypt
+from models import db, connect_db, User, UserProfile, Message, Follows, Likes, TimelineEntry
+from passwords import hasher, HasherBusy
+from snowflake import ids
+from timelines import PushTimelines, PullTimelines, HybridTimelines, reclassify, PULL_THRESHOLD
+from pagination import paginate, page_url, Page, MESSAGES_PER_PAGE, USERS_PER_PAGE, TYPEAHEAD_LIMIT
 
 CURR_USER_KEY = "curr_user"
 
@@ -21,10 +33,114 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['USER_CACHE_SIZE'] = int(os.environ.get('USER_CACHE_SIZE', 10000))
+app.config['USER_CACHE_TTL'] = int(os.environ.get('USER_CACHE_TTL', 30))
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['BCRYPT_WORKERS'] = int(os.environ.get('BCRYPT_WORKERS', os.cpu_count() or 1))
+app.config['BCRYPT_TIMEOUT'] = float(os.environ.get('BCRYPT_TIMEOUT', 10))
+if 'BCRYPT_MAX_QUEUE' in os.environ:
+    app.config['BCRYPT_MAX_QUEUE'] = int(os.environ['BCRYPT_MAX_QUEUE'])
+app.config['FRAGMENT_CACHE_SIZE'] = int(os.environ.get('FRAGMENT_CACHE_SIZE', 10000))
+app.config['TIMELINE_ENGINE'] = os.environ.get('TIMELINE_ENGINE', 'push')
+# In message ids, summed over the cached lists; roughly 50 bytes each.
+app.config['TIMELINE_CACHE_IDS'] = int(os.environ.get('TIMELINE_CACHE_IDS', 1000000))
+app.config['TIMELINE_CACHE_TTL'] = int(os.environ.get('TIMELINE_CACHE_TTL', 30))
+app.config['TIMELINE_PULL_THRESHOLD'] = int(os.environ.get('TIMELINE_PULL_THRESHOLD',
+                                                           PULL_THRESHOLD))
+app.config['SLOW_REQUEST_MS'] = float(os.environ.get('SLOW_REQUEST_MS', 500))
+app.config['SLOW_REQUEST_SAMPLE'] = float(os.environ.get('SLOW_REQUEST_SAMPLE', 0.1))
+app.config['SLOW_REQUEST_LOG'] = os.environ.get('SLOW_REQUEST_LOG')
+# Unique per writing process; without it each process claims a free one
+# from the database (see snowflake.py).
+if 'SNOWFLAKE_WORKER_ID' in os.environ:
+    app.config['SNOWFLAKE_WORKER_ID'] = int(os.environ['SNOWFLAKE_WORKER_ID'])
+# Cache-Control per endpoint (see conditional.py). Pages are per viewer, so
+# browsers may keep them but must revalidate; the timeline, profiles and
+# messages answer that with a 304 when nothing changed. Pages with forms
+# carry CSRF tokens and are never stored.
+app.config['CACHE_POLICY_DEFAULT'] = 'private, no-cache'
+app.config['CACHE_POLICIES'] = {
+    'signup': 'no-store',
+    'login': 'no-store',
+    'profile': 'no-store',
+    'messages_add': 'no-store',
+    'metrics': 'no-store',
+    'static': 'public, no-cache',
+    # Fingerprinted: a changed file gets a new URL (see assets.py).
+    'assets': 'public, max-age=31536000, immutable',
+}
+# Times how long requests wait for a DB connection; see metrics.py.
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'poolclass': MeteredQueuePool}
 # toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
 
+# Pager links (templates/_pager.html) keep the page's other arguments.
+app.jinja_env.globals['page_url'] = page_url
+hasher.init_app(app)
+ids.init_app(app)
+
+# Schema changes are Alembic migrations in migrations/: `flask db upgrade`.
+migrate = Migrate(app, db)
+
+# Query counts and DB/template/total time of each request, a Server-Timing
+# header in debug mode, and a sampled slow-request log; see
+# instrumentation.py. First, so its timings cover the other hooks.
+instrumentation = Instrumentation()
+instrumentation.init_app(app)
+
+# Profiles of recently active users, so most requests don't need a query
+# to know who's logged in. Entries are dropped whenever a route changes
+# what's cached (see `forget_users`); the TTL bounds how stale another
+# process's copy can get.
+user_cache = LRUCache(maxsize=app.config['USER_CACHE_SIZE'],
+                      ttl=app.config['USER_CACHE_TTL'])
+
+# Taken usernames/emails, loaded from the DB on first use.
+availability = Availability()
+
+# Rendered message list items; see fragments.py. Set FRAGMENT_CACHE_SIZE
+# to 0 to turn it off.
+fragment_cache = FragmentCache(
+    LRUCache(maxsize=app.config['FRAGMENT_CACHE_SIZE'])
+    if app.config['FRAGMENT_CACHE_SIZE'] else None)
+fragment_cache.init_app(app)
+
+# How home timelines are built: materialized on write ('push'), merged
+# on read from each author's recent messages, cached here ('pull'), or
+# materialized except for accounts over TIMELINE_PULL_THRESHOLD followers
+# ('hybrid'; `flask reclassify-timelines`); see timelines.py. Switching
+# from 'pull' to another engine needs the timelines rebuilt first (`flask
+# rebuild-timelines`), and from 'hybrid' to 'push', everyone switched back
+# (`flask reclassify-timelines --push-all`).
+if app.config['TIMELINE_ENGINE'] == 'pull':
+    timelines = PullTimelines(LRUCache(maxsize=app.config['TIMELINE_CACHE_IDS'],
+                                       ttl=app.config['TIMELINE_CACHE_TTL'], weigh=len))
+elif app.config['TIMELINE_ENGINE'] == 'hybrid':
+    timelines = HybridTimelines(LRUCache(maxsize=app.config['TIMELINE_CACHE_IDS'],
+                                         ttl=app.config['TIMELINE_CACHE_TTL'], weigh=len))
+else:
+    timelines = PushTimelines()
+
+# Fingerprinted copies of static/, once built with `flask build-assets`.
+assets = Assets()
+assets.init_app(app)
+
+# Prometheus metrics at /metrics; see metrics.py for multi-process servers.
+metrics = Metrics()
+metrics.init_app(app, db)
+metrics.track_cache('user_profiles', lambda: (user_cache.hits, user_cache.misses))
+if fragment_cache.storage is not None:
+    metrics.track_cache('fragments', lambda: (fragment_cache.storage.hits,
+                                              fragment_cache.storage.misses))
+# A hit is a probe answered by the Bloom filter alone.
+metrics.track_cache('availability', lambda: (availability.probes - availability.db_checks,
+                                             availability.db_checks))
+if getattr(timelines, 'storage', None) is not None:
+    metrics.track_cache('timelines', lambda: (timelines.storage.hits,
+                                              timelines.storage.misses))
+hasher.on_timing = observe_bcrypt
+
 
 ##############################################################################
 # User signup/login/logout
@@ -34,12 +150,44 @@ def add_user_to_g():
     """If we're logged in, add curr user to Flask global."""
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = load_user_profile(session[CURR_USER_KEY])
 
     else:
         g.user = None
 
 
+def load_user_profile(user_id):
+    """Get a user's profile from the cache, falling back to the DB.
+
+    Returns None if there's no such user.
+    """
+
+    fields = user_cache.get(user_id)
+    if fields is not None:
+        return UserProfile(fields)
+
+    user = User.query.get(user_id)
+    if user is None:
+        return None
+
+    user_cache.set(user_id, UserProfile.fields_of(user))
+    return UserProfile(UserProfile.fields_of(user), user)
+
+
+def forget_users(*user_ids):
+    """Drop cached profiles after changing those users."""
+
+    for user_id in user_ids:
+        user_cache.delete(user_id)
+
+
+def viewer_state():
+    """What the logged-in user's own bits of a page (nav bar, counters)
+    depend on, for validating cached pages."""
+
+    return g.user and tuple(UserProfile.fields_of(g.user).values())
+
+
 def do_login(user):
     """Log in user."""
     session[CURR_USER_KEY] = user.id
@@ -61,12 +209,22 @@ def signup():
     If form not valid, present form.
 
     If the there already is a user with that username: flash message
-    and re-present form.
+    and re-present form. That's checked before hashing the password, so
+    a taken name doesn't cost a bcrypt run.
     """
 
     form = UserAddForm()
 
     if form.validate_on_submit():
+        free = availability.check(username=form.username.data,
+                                  email=form.email.data)
+        if not free['username']:
+            flash("Username already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+        if not free['email']:
+            flash("Email already taken", 'danger')
+            return render_template('users/signup.html', form=form)
+
         try:
             user = User.signup(
                 username=form.username.data,
@@ -77,9 +235,11 @@ def signup():
             db.session.commit()
 
         except IntegrityError:
+            db.session.rollback()
             flash("Username already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        availability.add(username=user.username, email=user.email)
         do_login(user)
 
         return redirect("/")
@@ -88,6 +248,17 @@ def signup():
         return render_template('users/signup.html', form=form)
 
 
+@app.route('/signup/available')
+def signup_available():
+    """JSON: are the 'username' and/or 'email' params free to sign up with?"""
+
+    values = {field: request.args[field]
+              for field in ('username', 'email')
+              if request.args.get(field)}
+
+    return jsonify(availability.check(**values))
+
+
 @app.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
@@ -99,6 +270,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # authenticate may have upgraded the password hash
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -108,6 +281,13 @@ def login():
     return render_template('users/login.html', form=form)
 
 
+@app.errorhandler(HasherBusy)
+def hasher_busy(error):
+    """Too many password hashes queued: ask the client to retry shortly."""
+
+    return "Too many sign-ins right now, please try again.", 503, {'Retry-After': '1'}
+
+
 @app.route('/logout')
 def logout():
     """Handle logout of user."""
@@ -125,16 +305,39 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search for usernames starting
+    with it, and an 'after' param (a user id) for the next page.
     """
     search = request.args.get('q')
+    after = request.args.get('after', type=int)
+
+    users = User.search(search, after=after).limit(USERS_PER_PAGE + 1).all()
+    next_after = users[USERS_PER_PAGE - 1].id if len(users) > USERS_PER_PAGE else None
+    users = users[:USERS_PER_PAGE]
 
+    following = g.user.following_ids([user.id for user in users]) if g.user else set()
+
+    return render_template('users/index.html', users=users, following=following,
+                           search=search, next_after=next_after)
+
+
+@app.route('/users/typeahead')
+def users_typeahead():
+    """JSON list of users whose username starts with the 'q' param."""
+
+    search = request.args.get('q', '').strip()
     if not search:
-        users = User.query.all()
-    else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        return jsonify(users=[])
 
-    return render_template('users/index.html', users=users)
+    users = (User
+             .search(search)
+             .with_entities(User.id, User.username, User.image_url)
+             .limit(TYPEAHEAD_LIMIT))
+
+    return jsonify(users=[
+        dict(id=id, username=username, image_url=image_url)
+        for id, username, image_url in users
+    ])
 
 
 @app.route('/users/<int:user_id>')
@@ -143,17 +346,25 @@ def users_show(user_id):
 
     user = User.query.get_or_404(user_id)
 
+    # The listed messages can only change if a message was posted (a new,
+    # higher newest id) or deleted (a lower messages_count).
+    newest_id = (db.session
+                 .query(db.func.max(Message.id))
+                 .filter(Message.user_id == user_id)
+                 .scalar())
+    response = not_modified('users_show', user.version,
+                            *UserProfile.fields_of(user).values(), newest_id,
+                            viewer_state(), g.user and g.user.is_following(user))
+    if response:
+        return response
+
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    if(g.user):
-        return render_template('users/show.html', user=user, messages=messages, likes=g.user.likes)
-    return render_template('users/show.html', user=user, messages=messages)
+    page = paginate(Message.query.filter(Message.user_id == user_id),
+                    Message.id,
+                    older=request.args.get('older'),
+                    newer=request.args.get('newer'))
+    return render_template('users/show.html', user=user, messages=page.items, page=page)
 
 
 @app.route('/users/liked')
@@ -162,8 +373,15 @@ def show_liked_messages():
         flash("Access unauthorized.", "danger")
         return redirect("/")
         
-    liked_messages = g.user.likes
-    return render_template('/users/liked_messages.html', liked_messages=liked_messages )
+    page = paginate((Message
+                     .with_authors()
+                     .join(Likes, Likes.message_id == Message.id)
+                     .filter(Likes.user_id == g.user.id)),
+                    Message.id,
+                    older=request.args.get('older'),
+                    newer=request.args.get('newer'))
+    likes = {msg.id for msg in page.items}
+    return render_template('/users/liked_messages.html', liked_messages=page.items, page=page, likes=likes)
 
 @app.route('/users/<int:user_id>/following')
 def show_following(user_id):
@@ -174,7 +392,8 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+    following = g.user.following_ids([followed.id for followed in user.following])
+    return render_template('users/following.html', user=user, following=following)
 
 
 @app.route('/users/<int:user_id>/followers')
@@ -186,7 +405,8 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+    following = g.user.following_ids([follower.id for follower in user.followers])
+    return render_template('users/followers.html', user=user, following=following)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -198,8 +418,18 @@ def add_follow(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    if followed_user.id == g.user.id:
+        flash("You can't follow yourself.", "danger")
+        return redirect(f"/users/{g.user.id}/following")
+
+    if not g.user.is_following(followed_user):
+        db.session.add(Follows(user_being_followed_id=followed_user.id,
+                               user_following_id=g.user.id))
+        timelines.followed(g.user.id, followed_user.id)
+        User.update_counts(g.user.id, following_count=1)
+        User.update_counts(followed_user.id, followers_count=1)
+        db.session.commit()
+        forget_users(g.user.id, followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -212,9 +442,18 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    followed_user = User.query.get_or_404(follow_id)
+    removed = (Follows
+               .query
+               .filter_by(user_being_followed_id=followed_user.id,
+                          user_following_id=g.user.id)
+               .delete())
+    if removed:
+        timelines.unfollowed(g.user.id, followed_user.id)
+        User.update_counts(g.user.id, following_count=-1)
+        User.update_counts(followed_user.id, followers_count=-1)
+        db.session.commit()
+        forget_users(g.user.id, followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -248,7 +487,10 @@ def profile():
                 user.header_image_url = form.header_image_url.data
             if form.bio.data:
                 user.bio = form.bio.data
+            user.version = User.version + 1
             db.session.commit()
+            availability.add(username=user.username, email=user.email)
+            forget_users(user.id)
             return redirect(f'/users/{user.id}')
         flash("Access unauthorized.", "danger")
         return redirect('/')
@@ -265,8 +507,11 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    timelines.user_deleted(g.user.id)
+    g.user.release_counts()
+    db.session.delete(g.user.model)
     db.session.commit()
+    forget_users(g.user.id)
 
     return redirect("/signup")
 
@@ -288,20 +533,62 @@ def messages_add():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        timelines.posted(msg)
+        User.update_counts(g.user.id, messages_count=1)
         db.session.commit()
+        forget_users(g.user.id)
 
         return redirect(f"/users/{g.user.id}")
 
     return render_template('messages/new.html', form=form)
 
 
+@app.route('/messages/search')
+def messages_search():
+    """Search message text.
+
+    Takes the search words in the 'q' param. Results are newest first and
+    paged with `older`/`newer` cursors; `sort=relevance` shows only the
+    best matching page, with no further pages (ranks aren't indexed, so
+    paging by them would rank every match on every page).
+    """
+
+    search = request.args.get('q', '').strip()
+    sort = request.args.get('sort')
+    page = None
+
+    if search:
+        query, rank = Message.search(search)
+
+        if sort == 'relevance' and rank is not None:
+            messages = (query
+                        .order_by(rank.desc(), Message.id.desc())
+                        .limit(MESSAGES_PER_PAGE)
+                        .all())
+            page = Page(messages, None, None)
+        else:
+            page = paginate(query, Message.id,
+                            older=request.args.get('older'),
+                            newer=request.args.get('newer'))
+
+    return render_template('messages/search.html', search=search, sort=sort, page=page,
+                           per_page=MESSAGES_PER_PAGE)
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
+    msg = Message.with_authors().filter(Message.id == message_id).first_or_404()
+
+    response = not_modified('messages_show', msg.id, msg.user.version, viewer_state(),
+                            g.user and g.user.is_following(msg.user))
+    if response:
+        return response
+
     return render_template('messages/show.html', message=msg)
 
 
@@ -314,8 +601,13 @@ def messages_destroy(message_id):
         return redirect("/")
 
     msg = Message.query.get(message_id)
+    fragment_cache.forget(msg)
+    timelines.deleted(msg)
+    Message.release_likes(Message.id == msg.id)
+    User.update_counts(msg.user_id, messages_count=-1)
     db.session.delete(msg)
     db.session.commit()
+    forget_users(msg.user_id)
 
     return redirect(f"/users/{g.user.id}")
 
@@ -329,42 +621,50 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: 100 most recent messages of followed_users, from the
+      configured timeline engine; `older`/`newer` cursors page through
+      the rest
     """
 
-    def is_liked(user, msg):
-        if Likes.query.filter_by(user_id=user.id, message_id=msg.id).all():
-            return True
-        return False
-
     if g.user:
-        messages = (Message
-                    .query
-                    .filter(or_(Message.user_id == session[CURR_USER_KEY], 
-                    (Message.user_id.in_([user.id for user in g.user.following]))))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages, user=g.user, is_liked=is_liked)
+        # Check the page's entries (their authors' versions and like
+        # counts) before loading any messages, in case the browser
+        # already has it.
+        head = timelines.versions(g.user.id,
+                                  older=request.args.get('older'),
+                                  newer=request.args.get('newer'))
+        response = not_modified('homepage', viewer_state(),
+                                [(entry.id, entry.version, entry.like_count)
+                                 for entry in head.items])
+        if response:
+            return response
+
+        page = timelines.messages(g.user.id,
+                                  older=request.args.get('older'),
+                                  newer=request.args.get('newer'))
+
+        likes = Likes.liked_message_ids(g.user.id, [msg.id for msg in page.items])
+
+        return render_template('home.html', messages=page.items, page=page, user=g.user, likes=likes)
 
     else:
-        return render_template('home-anon.html')
+        return not_modified('home-anon') or render_template('home-anon.html')
 
 
 @app.route('/users/add_like/<int:message_id>', methods=["POST"])
 def like_message(message_id):
     """Like a message"""
 
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
     message = Message.query.get_or_404(message_id)
-    msg_user_id = message.user.id
 
-    if msg_user_id != session[CURR_USER_KEY]:
-        existing_like = Likes.query.filter_by(user_id=session[CURR_USER_KEY], message_id=message_id).one_or_none()
-        if(not existing_like):
-            like = Likes(user_id=session[CURR_USER_KEY],message_id=message_id)
-            db.session.add(like)
+    if message.user_id != g.user.id:
+        if Likes.add(g.user.id, message_id):
             db.session.commit()
+            forget_users(g.user.id)
 
     return redirect('/')
 
@@ -373,30 +673,96 @@ def like_message(message_id):
 def unlike_message(message_id):
     """Unlike a message"""
 
-    message = Message.query.get_or_404(message_id)
-    msg_user_id = message.user.id
+    if not g.user:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
 
-    if msg_user_id != session[CURR_USER_KEY]:
-        existing_like = Likes.query.filter_by(user_id=session[CURR_USER_KEY], message_id=message_id).one_or_none()
-        if(existing_like):
-            db.session.delete(existing_like)
-            db.session.commit()
+    if Likes.remove(g.user.id, message_id):
+        db.session.commit()
+        forget_users(g.user.id)
 
     return redirect('/')
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Maintenance commands and stats
+
+
+@app.route('/debug/cache-stats')
+def cache_stats():
+    """Hit/miss counters for this process's caches (debug mode only)."""
+
+    if not app.debug:
+        abort(404)
+
+    return jsonify(user_cache=user_cache.stats(),
+                   fragment_cache=fragment_cache.stats(),
+                   availability=availability.stats())
+
+
+@app.cli.command('recount')
+def recount():
+    """Recompute every user's message/follow/like counters, and every
+    message's like count."""
+
+    User.recount_all()
+    Message.recount_likes()
+    db.session.commit()
+    print("Recounted all users and messages.")
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Rebuild every materialized home timeline from the messages and
+    follows tables, e.g. before switching TIMELINE_ENGINE from 'pull'."""
+
+    TimelineEntry.rebuild()
+    # Under 'hybrid', pulled accounts' messages stay out of them.
+    if app.config['TIMELINE_ENGINE'] == 'hybrid':
+        for (user_id,) in db.session.query(User.id).filter(User.pull_delivery):
+            TimelineEntry.withdraw(user_id)
+    db.session.commit()
+    print("Rebuilt all home timelines.")
+
+
+@app.cli.command('reclassify-timelines')
+@click.option('--threshold', type=int,
+              help="followers from which accounts are pulled "
+                   "(default: TIMELINE_PULL_THRESHOLD)")
+@click.option('--push-all', is_flag=True,
+              help="switch every account back to push, e.g. before "
+                   "switching TIMELINE_ENGINE from 'hybrid' to 'push'")
+def reclassify_timelines(threshold, push_all):
+    """Switch accounts between pushed and pulled home timeline delivery by
+    follower count, for TIMELINE_ENGINE 'hybrid'. Run it periodically."""
+
+    if push_all:
+        threshold = None
+    elif app.config['TIMELINE_ENGINE'] != 'hybrid':
+        raise click.UsageError("TIMELINE_ENGINE isn't 'hybrid'; only --push-all applies.")
+    elif threshold is None:
+        threshold = app.config['TIMELINE_PULL_THRESHOLD']
+
+    to_pull, to_push = reclassify(threshold)
+    db.session.commit()
+    print(f"Switched {len(to_pull)} accounts to pull and {len(to_push)} to push.")
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint and precompress static files into static/dist/."""
+
+    manifest = assets.build()
+    for name, entry in sorted(manifest.items()):
+        sizes = ', '.join(f"{encoding} {size}" for encoding, size in entry['encodings'].items())
+        print(f"{name} -> {entry['file']} ({entry['size']} bytes{', ' + sizes if sizes else ''})")
+
+
+##############################################################################
+# HTTP caching: per-route Cache-Control, plus ETag/Last-Modified for pages
+# that answered a conditional GET (see conditional.py)
 
 @app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+def add_header(response):
+    """Add caching headers to every response."""
+
+    return cache_headers(response)
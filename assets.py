@@ -0,0 +1,247 @@
+"""Fingerprinted, precompressed static files.
+
+`flask build-assets` copies every file in static/ into static/dist/ under
+a name that includes a hash of its content (style.css becomes
+style.3f2a9c1b7d4e.css), writes gzip and, if the `brotli` package is
+installed, brotli copies of the files that compress well, and records the
+new names in static/dist/manifest.json.
+
+Templates link to files with `asset_url('stylesheets/style.css')`, or
+`'/static/...'|asset_url` for stored URLs like a user's default avatar.
+Built files are served from /assets/ and their content can never change
+under the same name, so browsers may keep them forever (see the `assets`
+entry in CACHE_POLICIES). Each request gets the smallest encoding its
+Accept-Encoding allows. Files that aren't in the manifest (no build yet,
+or uploaded later) fall back to the plain /static/ route.
+
+A build leaves the previous builds' files in place for KEEP_SUPERSEDED,
+since workers still running the old code, and cached pages, link to
+them; older ones are deleted.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import time
+
+from flask import abort, request, send_from_directory, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+BUILD_DIR = 'dist'
+MANIFEST = 'manifest.json'
+HASH_LENGTH = 12
+
+# Images are already compressed; compressing them again only wastes CPU.
+COMPRESSIBLE = {'.css', '.js', '.svg', '.ico', '.txt', '.json', '.map'}
+
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+# How long a file stays after a build stops using it, in seconds.
+KEEP_SUPERSEDED = 7 * 24 * 60 * 60
+
+CSS_URL = re.compile(r"""url\((['"]?)/static/([^'")]+)\1\)""")
+
+
+def fingerprint(name, content):
+    """`name` with a hash of `content` before its extension."""
+
+    stem, ext = os.path.splitext(name)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{ext}"
+
+
+def compress(content, encoding):
+    if encoding == 'br':
+        return brotli.compress(content, quality=11)
+    return gzip.compress(content, compresslevel=9, mtime=0)
+
+
+class Assets:
+    """Builds and serves fingerprinted copies of the static folder."""
+
+    def __init__(self, url_path='/assets'):
+        self.url_path = url_path
+        self.static_folder = None
+        self.build_folder = None
+        self.manifest = {}
+        self.encodings = {}
+
+    def init_app(self, app):
+        """Load the manifest and add the /assets route and `asset_url`."""
+
+        self.static_folder = app.static_folder
+        self.build_folder = os.path.join(app.static_folder, BUILD_DIR)
+        self.load()
+
+        app.add_url_rule(f'{self.url_path}/<path:filename>', 'assets', self.serve)
+        app.jinja_env.globals['asset_url'] = self.url
+        app.jinja_env.filters['asset_url'] = self.url
+
+    def load(self):
+        """Read the manifest written by the last build, if there's one."""
+
+        self._use(self.manifest_on_disk())
+
+    def _use(self, manifest):
+        self.manifest = manifest
+        self.encodings = {entry['file']: entry['encodings'] for entry in manifest.values()}
+
+    def url(self, filename):
+        """The URL for a file in static/, by name ('images/x.png') or by
+        its plain static URL ('/static/images/x.png').
+
+        Other URLs (e.g. a user's avatar elsewhere) are returned as is.
+        """
+
+        if not filename:
+            return filename
+
+        if filename.startswith('/static/'):
+            filename = filename[len('/static/'):]
+        elif '//' in filename or filename.startswith('/'):
+            return filename
+
+        entry = self.manifest.get(filename)
+        if entry is None:
+            return url_for('static', filename=filename)
+
+        return url_for('assets', filename=entry['file'])
+
+    def serve(self, filename):
+        """Send a built file, precompressed if the client accepts it."""
+
+        # Not fingerprinted, so it mustn't be cached like the files are.
+        if filename == MANIFEST:
+            abort(404)
+
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+        accepted = [(size, encoding)
+                    for encoding, size in self.encodings.get(filename, {}).items()
+                    if request.accept_encodings[encoding]]
+
+        if accepted:
+            encoding = min(accepted)[1]
+            response = send_from_directory(self.build_folder,
+                                           filename + dict(ENCODINGS)[encoding],
+                                           mimetype=mimetype)
+            response.headers['Content-Encoding'] = encoding
+        else:
+            response = send_from_directory(self.build_folder, filename, mimetype=mimetype)
+
+        response.vary.add('Accept-Encoding')
+        return response
+
+    def build(self, keep=KEEP_SUPERSEDED):
+        """Rebuild static/dist/ from static/; returns the new manifest.
+
+        Files only the previous build used are kept for another `keep`
+        seconds, and older leftovers deleted.
+        """
+
+        previous = self._files(self.manifest_on_disk())
+        os.makedirs(self.build_folder, exist_ok=True)
+
+        sources = []
+        for root, dirs, files in os.walk(self.static_folder):
+            dirs[:] = [d for d in dirs
+                       if os.path.join(root, d) != self.build_folder]
+            for name in files:
+                # Skip Windows download markers (e.g. "x.png:Zone.Identifier").
+                if ':' not in name and not name.startswith('.'):
+                    path = os.path.join(root, name)
+                    sources.append(os.path.relpath(path, self.static_folder))
+
+        # Stylesheets refer to other files by URL, so they're built last,
+        # once those files' fingerprinted names are known.
+        sources.sort(key=lambda name: (name.endswith('.css'), name))
+
+        manifest = {}
+        for name in sources:
+            with open(os.path.join(self.static_folder, name), 'rb') as f:
+                content = f.read()
+
+            if name.endswith('.css'):
+                content = CSS_URL.sub(
+                    lambda m: self._css_url(m, manifest),
+                    content.decode('utf-8')).encode('utf-8')
+
+            manifest[name] = self._write(fingerprint(name, content), content)
+
+        with open(os.path.join(self.build_folder, MANIFEST), 'w') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+
+        self._prune(self._files(manifest), previous, keep)
+        self._use(manifest)
+        return manifest
+
+    def manifest_on_disk(self):
+        """The manifest written by the last build, or {} if none."""
+
+        try:
+            with open(os.path.join(self.build_folder, MANIFEST)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+
+    @staticmethod
+    def _files(manifest):
+        """The files a manifest uses, compressed copies included."""
+
+        files = {MANIFEST}
+        for entry in manifest.values():
+            files.add(entry['file'])
+            files.update(entry['file'] + dict(ENCODINGS)[encoding]
+                         for encoding in entry['encodings'])
+        return files
+
+    def _prune(self, current, previous, keep):
+        """Delete built files no longer in use for more than `keep`
+        seconds. Files just superseded are touched, so their age counts
+        from now."""
+
+        now = time.time()
+        for root, dirs, files in os.walk(self.build_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, self.build_folder)
+                if filename in current:
+                    continue
+                if filename in previous:
+                    os.utime(path, (now, now))
+                elif os.path.getmtime(path) < now - keep:
+                    os.remove(path)
+
+    def _css_url(self, match, manifest):
+        quote, name = match.groups()
+        if name not in manifest:
+            return match.group(0)
+        return f"url({quote}{self.url_path}/{manifest[name]['file']}{quote})"
+
+    def _write(self, filename, content):
+        path = os.path.join(self.build_folder, filename)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+        entry = {'file': filename, 'size': len(content), 'encodings': {}}
+        if os.path.splitext(filename)[1] not in COMPRESSIBLE:
+            return entry
+
+        for encoding, suffix in ENCODINGS:
+            if encoding == 'br' and brotli is None:
+                continue
+
+            compressed = compress(content, encoding)
+            if len(compressed) < len(content):
+                with open(path + suffix, 'wb') as f:
+                    f.write(compressed)
+                entry['encodings'][encoding] = len(compressed)
+
+        return entry
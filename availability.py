@@ -0,0 +1,108 @@
+"""Username/email availability checks that rarely need the database.
+
+A Bloom filter holds every taken username and email. If a name isn't in
+the filter it's certainly free, so there's no query. If it is in the
+filter (taken, or a false positive) the unique index on the column has
+the final say.
+
+Usernames and emails taken by another process since the last rebuild
+aren't in this process's filter, so a probe can wrongly say "free". The
+unique constraints still reject the INSERT in that case, so the signup
+route keeps handling IntegrityError.
+"""
+
+from threading import Lock
+
+from bloom import BloomFilter
+from models import db, User
+
+FIELDS = ('username', 'email')
+
+# A rebuilt filter has room for this many times the values it's loaded
+# with, so new signups don't fill it (and trigger another rebuild) soon.
+HEADROOM = 2
+
+
+class Availability:
+    """Answers "is this username/email free?" for signup."""
+
+    def __init__(self, capacity=100000, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.probes = 0
+        self.db_checks = 0
+        self._filter = None
+        self._lock = Lock()
+
+    def rebuild(self):
+        """Load every taken username and email into a fresh filter."""
+
+        loaded = User.query.count() * len(FIELDS)
+        bloom = BloomFilter(self.capacity_for(loaded), self.error_rate)
+
+        rows = (db.session
+                .query(User.username, User.email)
+                .yield_per(10000))
+        for username, email in rows:
+            bloom.add(f"username:{username}")
+            bloom.add(f"email:{email}")
+
+        self._filter = bloom
+
+    def capacity_for(self, loaded):
+        """The filter size for `loaded` values: `capacity`, doubled until
+        there's HEADROOM."""
+
+        capacity = self.capacity
+        while capacity < loaded * HEADROOM:
+            capacity *= 2
+        return capacity
+
+    def _bloom(self):
+        if self._filter is None or self._filter.is_full:
+            with self._lock:
+                if self._filter is None or self._filter.is_full:
+                    self.rebuild()
+        return self._filter
+
+    def add(self, **values):
+        """Record newly taken values, e.g. `add(username='bob')`."""
+
+        bloom = self._bloom()
+        for field, value in values.items():
+            if value:
+                bloom.add(f"{field}:{value}")
+
+    def check(self, **values):
+        """Which of the given values are free?
+
+        Takes `username` and/or `email`; returns a dict mapping each
+        field given to True (free) or False (taken).
+        """
+
+        bloom = self._bloom()
+        free = {}
+
+        for field, value in values.items():
+            if field not in FIELDS:
+                raise ValueError(f"Can't check availability of {field}")
+
+            self.probes += 1
+            if f"{field}:{value}" not in bloom:
+                free[field] = True
+                continue
+
+            self.db_checks += 1
+            taken = User.query.filter(getattr(User, field) == value).exists()
+            free[field] = not db.session.query(taken).scalar()
+
+        return free
+
+    def stats(self):
+        """Probe counters, for monitoring how often the DB is skipped."""
+
+        return {
+            'probes': self.probes,
+            'db_checks': self.db_checks,
+            'size': len(self._filter) if self._filter else 0,
+        }
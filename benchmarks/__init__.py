@@ -0,0 +1,6 @@
+"""Benchmarks for Warbler.
+
+Run these from the project root as modules, e.g.
+
+    python -m benchmarks.bench_message_search --scale 100
+"""
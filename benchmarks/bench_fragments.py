@@ -0,0 +1,86 @@
+"""Time rendering a 100-message home timeline with and without the
+fragment cache.
+
+Reports the whole page and, separately, just the cached message items (the
+page also renders per-viewer like buttons, which are never cached).
+
+Uses in-memory stand-ins for the messages, so it measures template work
+only, no database:
+
+    python -m benchmarks.bench_fragments --repeat 200
+"""
+
+import argparse
+import json
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from benchmarks.common import time_calls, summarize
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--json', action='store_true',
+                        help="print results as JSON")
+    args = parser.parse_args()
+
+    from flask import g, render_template
+
+    from app import app, fragment_cache
+    from caching import LRUCache
+    from pagination import Page
+
+    viewer = SimpleNamespace(
+        id=1, username='viewer', image_url='/static/images/default-pic.png',
+        header_image_url='/static/images/warbler-hero.jpg',
+        messages_count=10, following_count=20, followers_count=30, likes_count=40,
+    )
+    authors = [
+        SimpleNamespace(id=i, username=f"author{i}", version=1,
+                        image_url=f"https://example.com/avatars/{i}.jpg")
+        for i in range(20)
+    ]
+    start = datetime(2020, 1, 1)
+    messages = [
+        SimpleNamespace(id=i, text=f"Warble number {i}, " * 5, user=authors[i % len(authors)],
+                        timestamp=start - timedelta(hours=i))
+        for i in range(args.messages)
+    ]
+    page = Page(messages, None, None)
+    likes = {msg.id for msg in messages[::3]}
+
+    def render_page():
+        render_template('home.html', messages=messages, page=page, user=viewer, likes=likes)
+
+    def render_items():
+        for msg in messages:
+            fragment_cache.message_item(msg)
+
+    results = {}
+    with app.test_request_context('/'):
+        g.user = viewer
+
+        for name, render in [('page', render_page), ('items', render_items)]:
+            fragment_cache.storage = None
+            render()
+            results[f'{name} uncached'] = summarize(time_calls(render, args.repeat))
+
+            fragment_cache.storage = LRUCache(maxsize=10000)
+            render()
+            results[f'{name} cached'] = summarize(time_calls(render, args.repeat))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for name, r in results.items():
+        print(f"{name:<15} median {r['median_ms']:>8} ms   p95 {r['p95_ms']:>8} ms")
+    for name in ('page', 'items'):
+        speedup = results[f'{name} uncached']['median_ms'] / results[f'{name} cached']['median_ms']
+        print(f"{name} speedup {speedup:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
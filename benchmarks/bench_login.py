@@ -0,0 +1,83 @@
+"""Measure /login latency and throughput at different concurrency levels.
+
+Each level runs --requests logins spread over that many client threads,
+all going through the bcrypt worker pool (BCRYPT_WORKERS), e.g.
+
+    python -m benchmarks.bench_login --rounds 12 --workers 4 --concurrency 1 4 16 64
+"""
+
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import add_database_argument, connect, reset_database, summarize
+
+PASSWORD = 'benchmark-password'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_argument(parser)
+    parser.add_argument('--rounds', type=int, default=12,
+                        help="bcrypt work factor (BCRYPT_LOG_ROUNDS)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="bcrypt pool size (BCRYPT_WORKERS), default CPU count")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8, 16])
+    parser.add_argument('--requests', type=int, default=64,
+                        help="logins per concurrency level")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--json', action='store_true',
+                        help="print results as JSON")
+    args = parser.parse_args()
+
+    app = connect(args.database_url)
+
+    from models import db, User
+    from passwords import hasher
+
+    hasher.configure(rounds=args.rounds, workers=args.workers)
+
+    reset_database()
+    pw_hash = hasher.hash(PASSWORD)
+    db.session.execute(User.__table__.insert(), [
+        dict(username=f"bench{i}", email=f"bench{i}@example.com", password=pw_hash)
+        for i in range(args.users)
+    ])
+    db.session.commit()
+
+    def login(i):
+        with app.test_client() as client:
+            start = time.perf_counter()
+            resp = client.post('/login', data=dict(username=f"bench{i % args.users}",
+                                                   password=PASSWORD))
+            elapsed = (time.perf_counter() - start) * 1000
+        assert resp.status_code == 302, resp.status_code
+        return elapsed
+
+    results = []
+    for concurrency in args.concurrency:
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            start = time.perf_counter()
+            samples = list(clients.map(login, range(args.requests)))
+            wall = time.perf_counter() - start
+
+        results.append(dict(
+            concurrency=concurrency,
+            logins_per_sec=round(args.requests / wall, 2),
+            **summarize(samples),
+        ))
+
+    if args.json:
+        print(json.dumps(dict(rounds=args.rounds, workers=hasher.workers, results=results), indent=2))
+        return
+
+    print(f"bcrypt rounds={args.rounds} workers={hasher.workers}")
+    print(f"{'concurrency':>11} {'logins/s':>9} {'median ms':>10} {'p95 ms':>10} {'max ms':>10}")
+    for r in results:
+        print(f"{r['concurrency']:>11} {r['logins_per_sec']:>9} {r['median_ms']:>10} "
+              f"{r['p95_ms']:>10} {r['max_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""Compare full-text message search with a naive ILIKE scan.
+
+Loads the generator's messages, repeated --scale times, then times the
+query behind /messages/search (tsvector @@ tsquery on the GIN index) against
+the ILIKE '%word%' scan it replaced, for a few search words:
+
+    python -m benchmarks.bench_message_search --scale 1000
+"""
+
+import argparse
+import json
+
+from benchmarks.common import (
+    add_database_argument, connect, reset_database, read_csv, scaled_messages,
+    insert_chunked, analyze, time_calls, summarize,
+)
+
+DEFAULT_TERMS = ['computer', 'night', 'character member', 'zebra']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_argument(parser)
+    parser.add_argument('--scale', type=int, default=100,
+                        help="copies of generator/messages.csv to load")
+    parser.add_argument('--repeat', type=int, default=20,
+                        help="timed runs per query")
+    parser.add_argument('--terms', nargs='+', default=DEFAULT_TERMS)
+    parser.add_argument('--json', action='store_true',
+                        help="print results as JSON")
+    args = parser.parse_args()
+
+    connect(args.database_url)
+
+    from models import db, User, Message, escape_like
+    from pagination import MESSAGES_PER_PAGE
+
+    reset_database()
+    num_users = insert_chunked(User.__table__, read_csv('users.csv'))
+    num_messages = insert_chunked(Message.__table__, scaled_messages(args.scale, num_users))
+    analyze()
+
+    def full_text(term):
+        query, _ = Message.search(term)
+        return (query
+                .order_by(Message.id.desc())
+                .limit(MESSAGES_PER_PAGE)
+                .all())
+
+    def ilike(term):
+        return (Message
+                .with_authors()
+                .filter(Message.text.ilike(f"%{escape_like(term)}%", escape='\\'))
+                .order_by(Message.id.desc())
+                .limit(MESSAGES_PER_PAGE)
+                .all())
+
+    results = []
+    for term in args.terms:
+        for name, fn in [('full_text', full_text), ('ilike', ilike)]:
+            hits = len(fn(term))
+            samples = time_calls(lambda: fn(term), args.repeat)
+            db.session.rollback()
+            results.append(dict(term=term, method=name, hits=hits, **summarize(samples)))
+
+    if args.json:
+        print(json.dumps(dict(messages=num_messages, results=results), indent=2))
+        return
+
+    print(f"{num_messages} messages")
+    print(f"{'term':<20} {'method':<10} {'hits':>5} {'median ms':>10} {'p95 ms':>10}")
+    for r in results:
+        print(f"{r['term']:<20} {r['method']:<10} {r['hits']:>5} {r['median_ms']:>10} {r['p95_ms']:>10}")
+
+
+if __name__ == '__main__':
+    main()
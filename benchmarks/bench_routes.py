@@ -0,0 +1,208 @@
+"""Time the main pages and check their SQL query budgets.
+
+Seeds a generated dataset of the given size, logs in as the user who
+follows the most people, and requests each page --repeat times through the
+Flask test client:
+
+    python -m benchmarks.bench_routes --users 2000 --messages 20000 --follows 40000 \\
+        --output results.json --baseline last-results.json
+
+Exits non-zero if a page runs more statements than its budget in
+benchmarks/route_budgets.json, or (given --baseline, an earlier --output)
+its median got more than --threshold slower. Reuse an already seeded
+database with --no-seed.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.common import add_database_argument, connect, analyze, count_statements, summarize
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BUDGETS = os.path.join(BENCH_DIR, 'route_budgets.json')
+GENERATOR = os.path.join(os.path.dirname(BENCH_DIR), 'generator', 'create_csvs.py')
+
+
+def add_dataset_arguments(parser):
+    """Options for the size of the generated dataset."""
+
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--follows', type=int, default=40000)
+    parser.add_argument('--likes', type=int, default=200,
+                        help="messages the viewer has liked")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-seed', action='store_true',
+                        help="benchmark the database as it is")
+    parser.add_argument('--no-timelines', action='store_true',
+                        help="seed without building home timelines")
+
+
+def dataset(args):
+    """Describe the dataset `args` ask for, for results files."""
+
+    return dict(users=args.users, messages=args.messages, follows=args.follows,
+                likes=args.likes, seed=args.seed, seeded=not args.no_seed,
+                timelines=not args.no_timelines)
+
+
+def seed_dataset(args):
+    """Generate CSVs of the requested size and load them."""
+
+    from seed import seed
+
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([sys.executable, GENERATOR, '--out', directory,
+                        '--users', str(args.users), '--messages', str(args.messages),
+                        '--follows', str(args.follows), '--seed', str(args.seed)],
+                       check=True)
+        seed(directory, timelines=not args.no_timelines)
+
+
+def add_likes(viewer_id, count):
+    """Have the viewer like `count` messages, for /users/liked."""
+
+    from models import db, Likes, Message
+
+    liked = db.session.query(Likes.message_id).filter(Likes.user_id == viewer_id)
+    message_ids = [id for (id,) in (db.session
+                                    .query(Message.id)
+                                    .filter(~Message.id.in_(liked),
+                                            Message.user_id != viewer_id)
+                                    .order_by(Message.id)
+                                    .limit(count))]
+    for message_id in message_ids:
+        Likes.add(viewer_id, message_id)
+    db.session.commit()
+
+
+def routes():
+    """(endpoint, URL) of each page to time, and the viewer's user id."""
+
+    from models import db, User, Message
+
+    viewer = User.query.order_by(User.following_count.desc(), User.id).first()
+    popular = User.query.order_by(User.followers_count.desc(), User.id).first()
+    message_id = (db.session
+                  .query(db.func.max(Message.id))
+                  .filter(Message.user_id == popular.id)
+                  .scalar())
+
+    return viewer.id, [
+        ('homepage', '/'),
+        ('list_users', '/users'),
+        ('users_show', f'/users/{popular.id}'),
+        ('users_followers', f'/users/{popular.id}/followers'),
+        ('show_following', f'/users/{viewer.id}/following'),
+        ('show_liked_messages', '/users/liked'),
+        ('messages_show', f'/messages/{message_id}'),
+    ]
+
+
+def time_route(app, viewer_id, url, repeat, warmup):
+    """Request `url` as the viewer; returns (statement count, timings)."""
+
+    from app import CURR_USER_KEY
+
+    samples = []
+    queries = 0
+
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = viewer_id
+
+        for i in range(warmup + repeat):
+            with count_statements() as statements:
+                start = time.perf_counter()
+                resp = client.get(url)
+                elapsed = (time.perf_counter() - start) * 1000
+
+            assert resp.status_code == 200, (url, resp.status_code)
+            if i >= warmup:
+                samples.append(elapsed)
+                queries = max(queries, len(statements))
+
+    return queries, samples
+
+
+def check(results, budgets, baseline, threshold):
+    """Messages describing every budget or regression failure."""
+
+    failures = []
+
+    for name, result in results['routes'].items():
+        budget = budgets.get(name, {}).get('max_queries')
+        if budget is not None and result['queries'] > budget:
+            failures.append(f"{name}: {result['queries']} queries, budget is {budget}")
+
+        before = (baseline or {}).get('routes', {}).get(name)
+        if before and result['median_ms'] > before['median_ms'] * (1 + threshold):
+            failures.append(f"{name}: median {result['median_ms']} ms, "
+                            f"was {before['median_ms']} ms (+{threshold:.0%} allowed)")
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_argument(parser)
+    add_dataset_arguments(parser)
+    parser.add_argument('--repeat', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--budgets', default=BUDGETS,
+                        help="JSON file of per-route query budgets")
+    parser.add_argument('--baseline', help="results JSON of an earlier run to compare with")
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help="allowed median slowdown against --baseline (0.25 = 25%%)")
+    parser.add_argument('--output', help="write results JSON here")
+    args = parser.parse_args()
+
+    app = connect(args.database_url)
+
+    if not args.no_seed:
+        seed_dataset(args)
+        analyze()
+
+    viewer_id, pages = routes()
+    if not args.no_seed:
+        add_likes(viewer_id, args.likes)
+
+    results = dict(dataset=dataset(args), routes={})
+
+    for name, url in pages:
+        queries, samples = time_route(app, viewer_id, url, args.repeat, args.warmup)
+        results['routes'][name] = dict(url=url, queries=queries, **summarize(samples))
+
+    with open(args.budgets) as f:
+        budgets = json.load(f)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    failures = check(results, budgets, baseline, args.threshold)
+    results['failures'] = failures
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    for name, r in results['routes'].items():
+        budget = budgets.get(name, {}).get('max_queries', '-')
+        print(f"{name:<20} {r['queries']:>3}/{budget:<3} queries   "
+              f"median {r['median_ms']:>8} ms   p95 {r['p95_ms']:>8} ms")
+
+    for failure in failures:
+        print(f"FAIL {failure}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""Compare the home timeline engines on a generated dataset.
+
+Seeds a dataset (see bench_routes; same options) and builds the first page
+of the home timeline of a few viewers, from the one who follows the most
+people down to a median one, with each way of building it:
+
+- push: the materialized timeline (timelines.PushTimelines)
+- pull: the merge over cached recent lists, warm (timelines.PullTimelines)
+- pull-cold: the same with an empty cache every time
+- sql: the followed users' messages by an IN over them, newest first
+- hybrid: the materialized timeline merged with the cached recent lists
+  of followed accounts with at least --pull-threshold followers
+  (timelines.HybridTimelines)
+
+    python -m benchmarks.bench_timelines --users 20000 --messages 500000 --follows 400000
+
+Each page loads its messages and authors, as the home page does. --viewers
+sets how many viewers are timed; the push and hybrid engines are skipped
+when seeding with --no-timelines. Accounts are switched to pull delivery
+for the hybrid engine only (timelines.reclassify), and back afterwards.
+"""
+
+import argparse
+import json
+from contextlib import contextmanager
+
+from benchmarks.bench_routes import add_dataset_arguments, dataset, seed_dataset
+from benchmarks.common import add_database_argument, connect, analyze, count_statements, \
+    time_calls, summarize
+
+
+def viewers(count):
+    """(user id, following count) of `count` viewers, spread from the one
+    following the most people to the median."""
+
+    from models import User
+
+    ranked = (User.query
+              .with_entities(User.id, User.following_count)
+              .order_by(User.following_count.desc(), User.id)
+              .all())
+    half = len(ranked) // 2
+    step = max(half // max(count - 1, 1), 1)
+    return [tuple(ranked[i]) for i in range(0, half + 1, step)][:count]
+
+
+def engines(timelines):
+    """name -> function building a viewer's first page; each returns the
+    page's message ids."""
+
+    from caching import LRUCache
+    from models import db, Message
+    from timelines import PushTimelines, PullTimelines, HybridTimelines
+
+    pull = PullTimelines(LRUCache(maxsize=1000000))
+    cold = PullTimelines(LRUCache(maxsize=1000000))
+    uncached = PullTimelines()
+
+    def pull_cold(viewer_id):
+        cold.storage.clear()
+        return cold.messages(viewer_id).items
+
+    def sql(viewer_id):
+        authors = uncached.authors(viewer_id)
+        ids = uncached.sql_message_ids(authors).items
+        return (Message.with_authors()
+                .filter(Message.id.in_(ids))
+                .order_by(Message.id.desc())
+                .all())
+
+    built = {}
+    if timelines:
+        built['push'] = lambda viewer_id: PushTimelines().messages(viewer_id).items
+    built['pull'] = lambda viewer_id: pull.messages(viewer_id).items
+    built['pull-cold'] = pull_cold
+    built['sql'] = sql
+    if timelines:
+        hybrid = HybridTimelines(LRUCache(maxsize=1000000))
+        built['hybrid'] = lambda viewer_id: hybrid.messages(viewer_id).items
+
+    def ended(fn):
+        # Each page in its own transaction, starting from an empty session.
+        def run(viewer_id):
+            try:
+                return [msg.id for msg in fn(viewer_id)]
+            finally:
+                db.session.rollback()
+                db.session.expunge_all()
+        return run
+
+    return {name: ended(fn) for name, fn in built.items()}
+
+
+@contextmanager
+def delivery(threshold):
+    """Pull accounts with at least `threshold` followers (None: nobody)
+    while in the block."""
+
+    from models import db
+    from timelines import reclassify
+
+    if threshold is None:
+        yield
+        return
+
+    reclassify(threshold)
+    db.session.commit()
+    analyze()
+    try:
+        yield
+    finally:
+        reclassify(None)
+        db.session.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_argument(parser)
+    add_dataset_arguments(parser)
+    parser.add_argument('--viewers', type=int, default=3)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--pull-threshold', type=int, default=1000,
+                        help="followers from which the hybrid engine pulls an account")
+    parser.add_argument('--output', help="write results JSON here")
+    args = parser.parse_args()
+
+    connect(args.database_url)
+
+    if not args.no_seed:
+        seed_dataset(args)
+        analyze()
+
+    built = engines(timelines=not args.no_timelines)
+    results = dict(dataset=dataset(args), pull_threshold=args.pull_threshold, viewers=[])
+
+    timed = viewers(args.viewers)
+    pages = {viewer_id: {} for viewer_id, following in timed}
+    timings = {viewer_id: {} for viewer_id, following in timed}
+
+    # Engine by engine, so accounts are switched to pull only once.
+    for name, fn in built.items():
+        with delivery(args.pull_threshold if name == 'hybrid' else None):
+            for viewer_id, following in timed:
+                time_calls(lambda: fn(viewer_id), args.warmup)
+                with count_statements() as statements:
+                    pages[viewer_id][name] = fn(viewer_id)
+                timings[viewer_id][name] = dict(
+                    queries=len(statements),
+                    **summarize(time_calls(lambda: fn(viewer_id), args.repeat)))
+
+    for viewer_id, following in timed:
+        # Every engine must build the same page.
+        expected = next(iter(pages[viewer_id].values()))
+        mismatched = sorted(name for name, ids in pages[viewer_id].items() if ids != expected)
+
+        results['viewers'].append(dict(user_id=viewer_id, following=following,
+                                       engines=timings[viewer_id], mismatched=mismatched))
+
+        print(f"viewer {viewer_id} (follows {following})")
+        for name, r in timings[viewer_id].items():
+            print(f"  {name:<10} {r['queries']:>3} queries   "
+                  f"median {r['median_ms']:>8} ms   p95 {r['p95_ms']:>8} ms")
+        for name in mismatched:
+            print(f"  FAIL {name}: a different page than {next(iter(pages[viewer_id]))}")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
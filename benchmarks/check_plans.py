@@ -0,0 +1,223 @@
+"""Check the query plans behind the hottest pages against a baseline.
+
+Seeds a generated dataset (see bench_routes; same options), requests the
+home page, a profile, the user list and a like through the test client,
+and runs EXPLAIN (ANALYZE, BUFFERS) on every statement they sent, with
+the same parameters. Writes are rolled back.
+
+    python -m benchmarks.check_plans --update      # record the baseline
+    python -m benchmarks.check_plans --output plans.json
+
+Fails if a statement's plan differs from benchmarks/plan_baseline.json,
+for example an Index Scan that became a Seq Scan after an index went
+missing, or if a page now sends different SQL. Sequential scans are
+listed either way. Plans depend on the data, so compare runs over the
+same dataset options.
+"""
+
+import argparse
+import difflib
+import json
+import os
+import re
+import sys
+
+from benchmarks.bench_routes import add_dataset_arguments, dataset, seed_dataset, add_likes
+from benchmarks.common import add_database_argument, connect, analyze, count_statements
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'plan_baseline.json')
+
+EXPLAINABLE = re.compile(r'\s*(SELECT|INSERT|UPDATE|DELETE|WITH)\b', re.IGNORECASE)
+
+
+def pages():
+    """(endpoint, method, URL) of each page to check, the viewer's id, and
+    the URL that undoes the like."""
+
+    from models import db, User, Message, Likes
+
+    viewer = User.query.order_by(User.following_count.desc(), User.id).first()
+    popular = User.query.order_by(User.followers_count.desc(), User.id).first()
+    liked = db.session.query(Likes.message_id).filter(Likes.user_id == viewer.id)
+    message_id = (db.session
+                  .query(db.func.max(Message.id))
+                  .filter(Message.user_id == popular.id, ~Message.id.in_(liked))
+                  .scalar())
+
+    return viewer.id, [
+        ('homepage', 'GET', '/'),
+        ('users_show', 'GET', f'/users/{popular.id}'),
+        ('list_users', 'GET', '/users'),
+        ('like_message', 'POST', f'/users/add_like/{message_id}'),
+    ], f'/users/remove_like/{message_id}'
+
+
+def capture(app, viewer_id, checked, undo_url):
+    """The statements (with parameters) each page sends."""
+
+    from app import CURR_USER_KEY
+
+    captured = {}
+
+    with app.test_client() as client:
+        with client.session_transaction() as session:
+            session[CURR_USER_KEY] = viewer_id
+
+        for endpoint, method, url in checked:
+            # Once first, so connection setup queries aren't captured.
+            if method == 'GET':
+                client.get(url)
+
+            with count_statements(with_parameters=True) as statements:
+                resp = client.open(url, method=method)
+
+            assert resp.status_code < 400, (url, resp.status_code)
+            captured[endpoint] = [(sql, params) for sql, params in statements
+                                  if EXPLAINABLE.match(sql)]
+
+        client.post(undo_url)
+
+    return captured
+
+
+def explain(sql, params):
+    """EXPLAIN (ANALYZE, BUFFERS) of one statement, as Postgres' JSON."""
+
+    from models import db
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute('EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) ' + sql, params)
+        return cursor.fetchone()[0][0]
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def plan_lines(node, depth=0):
+    """The shape of a plan, one line per node, without costs or timings."""
+
+    line = '  ' * depth + node['Node Type']
+    if 'Relation Name' in node:
+        line += f" on {node['Relation Name']}"
+    if 'Index Name' in node:
+        line += f" using {node['Index Name']}"
+
+    lines = [line]
+    for child in node.get('Plans', []):
+        lines.extend(plan_lines(child, depth + 1))
+    return lines
+
+
+def seq_scans(node):
+    """Tables the plan reads with a sequential scan."""
+
+    found = [node['Relation Name']] if node['Node Type'] == 'Seq Scan' else []
+    for child in node.get('Plans', []):
+        found.extend(seq_scans(child))
+    return found
+
+
+def summarize(sql, explained):
+    plan = explained['Plan']
+    return dict(
+        sql=' '.join(sql.split()),
+        plan=plan_lines(plan),
+        seq_scans=seq_scans(plan),
+        ms=round(explained['Execution Time'], 3),
+        buffers=plan.get('Shared Hit Blocks', 0) + plan.get('Shared Read Blocks', 0),
+    )
+
+
+def compare(results, baseline):
+    """Messages describing every difference from the baseline."""
+
+    failures = []
+
+    for endpoint, statements in results.items():
+        before = baseline.get(endpoint)
+        if before is None:
+            failures.append(f"{endpoint}: not in the baseline (rerun with --update)")
+            continue
+
+        if len(statements) != len(before):
+            failures.append(f"{endpoint}: sends {len(statements)} statements, "
+                            f"baseline has {len(before)}")
+
+        for i, (now, then) in enumerate(zip(statements, before)):
+            where = f"{endpoint} statement {i + 1}"
+            if now['sql'] != then['sql']:
+                failures.append(f"{where}: SQL changed\n  was: {then['sql']}\n  now: {now['sql']}")
+            elif now['plan'] != then['plan']:
+                new_scans = set(now['seq_scans']) - set(then['seq_scans'])
+                diff = difflib.unified_diff(then['plan'], now['plan'], 'baseline', 'now', lineterm='')
+                failures.append(f"{where}: plan changed"
+                                + ''.join(f" (new Seq Scan on {table})" for table in sorted(new_scans))
+                                + '\n' + '\n'.join(diff))
+
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_database_argument(parser)
+    add_dataset_arguments(parser)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--update', action='store_true',
+                        help="write the plans as the new baseline instead of checking")
+    parser.add_argument('--output', help="write the full EXPLAIN output here (JSON)")
+    args = parser.parse_args()
+
+    app = connect(args.database_url)
+
+    if not args.no_seed:
+        seed_dataset(args)
+        analyze()
+
+    viewer_id, checked, undo_url = pages()
+    if not args.no_seed:
+        add_likes(viewer_id, args.likes)
+        analyze()
+
+    captured = capture(app, viewer_id, checked, undo_url)
+    explained = {endpoint: [(sql, explain(sql, params)) for sql, params in statements]
+                 for endpoint, statements in captured.items()}
+    results = {endpoint: [summarize(sql, plan) for sql, plan in plans]
+               for endpoint, plans in explained.items()}
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(dict(dataset=dataset(args),
+                           plans={endpoint: [dict(sql=sql, explain=plan) for sql, plan in plans]
+                                  for endpoint, plans in explained.items()}),
+                      f, indent=2, default=str)
+
+    for endpoint, statements in results.items():
+        for i, statement in enumerate(statements, 1):
+            scans = ', '.join(statement['seq_scans']) or '-'
+            print(f"{endpoint:<14} {i}  {statement['ms']:>8} ms  {statement['buffers']:>6} buffers  "
+                  f"seq scans: {scans}")
+
+    if args.update:
+        with open(args.baseline, 'w') as f:
+            json.dump(dict(dataset=dataset(args), routes=results), f, indent=2)
+            f.write('\n')
+        print(f"wrote {args.baseline}")
+        return
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+
+    if baseline['dataset'] != dataset(args):
+        print(f"note: the baseline was recorded with {baseline['dataset']}")
+
+    failures = compare(results, baseline['routes'])
+    for failure in failures:
+        print(f"FAIL {failure}")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""Shared helpers for the benchmark scripts.
+
+Benchmarks run against their own database (`--database-url`, default
+postgresql:///warbler-bench) and drop and recreate every table in it, so
+never point them at data you care about.
+"""
+
+import csv
+import os
+import statistics
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import islice
+
+DEFAULT_DATABASE_URL = 'postgresql:///warbler-bench'
+
+GENERATOR_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'generator')
+
+CHUNK_SIZE = 10000
+
+
+def add_database_argument(parser):
+    """Add the --database-url option every benchmark takes."""
+
+    parser.add_argument(
+        '--database-url',
+        default=os.environ.get('BENCH_DATABASE_URL', DEFAULT_DATABASE_URL),
+        help="database to (re)create and benchmark against",
+    )
+
+
+def connect(database_url):
+    """Import the app pointed at `database_url` and push an app context.
+
+    This has to happen before anything else imports app.py, since it reads
+    DATABASE_URL at import time.
+    """
+
+    os.environ['DATABASE_URL'] = database_url
+
+    from app import app
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    # Benchmarks report their own timings; don't log slow requests too.
+    app.config['SLOW_REQUEST_SAMPLE'] = 0
+    app.app_context().push()
+    return app
+
+
+def reset_database():
+    """Drop and recreate every table."""
+
+    from models import db
+
+    db.drop_all()
+    db.create_all()
+
+
+def read_csv(name):
+    """Stream the rows of one of the generator's CSV files."""
+
+    with open(os.path.join(GENERATOR_DIR, name)) as f:
+        yield from csv.DictReader(f)
+
+
+def scaled_messages(scale, num_users):
+    """The generator's messages, repeated `scale` times.
+
+    Each copy is shifted back in time and spread over `num_users` authors,
+    so the scaled corpus keeps the original text distribution.
+    """
+
+    originals = [
+        (row['text'], datetime.strptime(row['timestamp'], '%Y-%m-%d %H:%M:%S.%f'), int(row['user_id']))
+        for row in read_csv('messages.csv')
+    ]
+
+    for copy in range(scale):
+        for i, (text, timestamp, user_id) in enumerate(originals):
+            yield dict(
+                text=text,
+                timestamp=timestamp - timedelta(days=copy),
+                user_id=(user_id + copy * 7 + i) % num_users + 1,
+            )
+
+
+def insert_chunked(table, rows, chunk_size=CHUNK_SIZE):
+    """Insert `rows` (dicts) into `table` in chunks; returns the row count."""
+
+    from models import db
+
+    rows = iter(rows)
+    total = 0
+
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        db.session.execute(table.insert(), chunk)
+        total += len(chunk)
+
+    db.session.commit()
+    return total
+
+
+def analyze():
+    """Refresh planner statistics after a bulk load."""
+
+    from models import db
+
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(db.text('ANALYZE'))
+        db.session.commit()
+
+
+@contextmanager
+def count_statements(with_parameters=False):
+    """Collect the SQL statements run inside the block, as a list (of
+    (statement, parameters) pairs with `with_parameters`)."""
+
+    from sqlalchemy import event
+    from models import db
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters) if with_parameters else statement)
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+def time_calls(fn, repeat):
+    """Call `fn` `repeat` times; returns the wall time of each call in ms."""
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def summarize(samples):
+    """Median / p95 / max of a list of millisecond timings."""
+
+    ordered = sorted(samples)
+    return dict(
+        median_ms=round(statistics.median(ordered), 3),
+        p95_ms=round(ordered[int(0.95 * (len(ordered) - 1))], 3),
+        max_ms=round(ordered[-1], 3),
+    )
@@ -0,0 +1,52 @@
+"""A Bloom filter: a compact set that can say "definitely not present".
+
+Membership tests never give false negatives for items that were added,
+and give false positives at roughly `error_rate` while the filter holds no
+more than `capacity` items.
+"""
+
+import math
+from hashlib import blake2b
+from threading import Lock
+
+
+class BloomFilter:
+    """Bit array plus `num_hashes` hash functions, sized for `capacity`."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.capacity = max(capacity, 1)
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.num_bits + 7) // 8)
+        self._lock = Lock()
+
+    def __len__(self):
+        return self.count
+
+    def _positions(self, item):
+        # Double hashing: k positions from two 64-bit halves of one digest.
+        digest = blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        """Add a string to the filter."""
+
+        positions = self._positions(item)
+        with self._lock:
+            for pos in positions:
+                self._bits[pos >> 3] |= 1 << (pos & 7)
+            self.count += 1
+
+    def __contains__(self, item):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(item))
+
+    @property
+    def is_full(self):
+        """Has it taken more items than it was sized for?"""
+
+        return self.count > self.capacity
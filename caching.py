@@ -0,0 +1,91 @@
+"""In-process caches for Warbler."""
+
+import time
+from collections import OrderedDict
+from threading import Lock
+
+
+class LRUCache:
+    """A thread-safe, size-bounded cache with optional expiry.
+
+    The least recently used entries are evicted once more than `maxsize`
+    are stored, and entries older than `ttl` seconds (if given) are
+    treated as missing. With `weigh`, `maxsize` bounds the total of
+    `weigh(value)` over the entries instead, e.g. `weigh=len` for a cache
+    of lists bounded by how many items they hold. Hits and misses are
+    counted so we can see how well it works.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, weigh=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigh = weigh
+        self.weight = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the value cached for `key`, or `default`."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is not None:
+                value, expires, weight = entry
+                if expires is None or expires > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                self._pop(key)
+
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Cache `value` under `key`, evicting the oldest entries if full."""
+
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        # Even an empty value costs an entry.
+        weight = max(self.weigh(value), 1) if self.weigh else 1
+
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = (value, expires, weight)
+            self.weight += weight
+
+            while self.weight > self.maxsize:
+                self._pop(next(iter(self._entries)))
+
+    def delete(self, key):
+        """Drop `key` from the cache, if it's there."""
+
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        """Drop every entry (the hit/miss counters are kept)."""
+
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
+
+    def stats(self):
+        """Hit/miss counters and current size, for monitoring."""
+
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
@@ -0,0 +1,84 @@
+"""Conditional GETs and per-route Cache-Control headers.
+
+Most pages are rendered per viewer, so browsers may keep a copy but have
+to check back before reusing it. Views that can tell cheaply whether a page
+changed call `not_modified(...)` first, with the values the page depends on:
+
+    response = not_modified('users_show', user.id, user.version, ...)
+    if response:
+        return response
+
+If the browser's copy is still current (If-None-Match, or If-Modified-Since
+when it sent no ETag) that's a 304 and the view stops there, before any
+template is rendered; otherwise the page goes out with a fresh ETag.
+
+Settings (read by `cache_headers`):
+
+- CACHE_POLICIES: Cache-Control value per endpoint name; None leaves
+  whatever the view set.
+- CACHE_POLICY_DEFAULT: Cache-Control for endpoints not listed.
+"""
+
+import hashlib
+
+from flask import current_app, g, request, session
+from werkzeug.http import is_resource_modified
+
+DEFAULT_CACHE_POLICY = 'private, no-cache'
+
+
+def make_etag(parts):
+    """An ETag value for a page that depends on `parts`."""
+
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def not_modified(*parts, last_modified=None):
+    """Return a 304 response if the client's copy of this page is current.
+
+    `parts` are the values the page is built from (ids, versions,
+    counters); `last_modified` is an optional datetime, only for pages
+    that can't change without it moving: per-viewer pages (follow state,
+    like counts) leave it out, or a client sending just If-Modified-Since
+    would get a stale 304. Returns None when
+    the page has to be rendered, in which case `cache_headers` adds the
+    validators to it.
+    """
+
+    # Pages with pending flash messages must render to show (and clear) them.
+    if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+        return None
+
+    g.etag = make_etag(parts)
+    g.last_modified = last_modified
+
+    if is_resource_modified(request.environ, etag=g.etag, last_modified=last_modified):
+        return None
+
+    return current_app.response_class(status=304)
+
+
+def cache_policy(endpoint):
+    """The Cache-Control value for `endpoint`."""
+
+    config = current_app.config
+    return config.get('CACHE_POLICIES', {}).get(
+        endpoint, config.get('CACHE_POLICY_DEFAULT', DEFAULT_CACHE_POLICY))
+
+
+def cache_headers(response):
+    """Set Cache-Control, and the validators from `not_modified` if any."""
+
+    policy = cache_policy(request.endpoint)
+    if policy:
+        response.headers['Cache-Control'] = policy
+        if 'private' in policy:
+            response.vary.add('Cookie')
+
+    etag = g.get('etag')
+    if etag and response.status_code in (200, 304):
+        response.set_etag(etag, weak=True)
+        if g.get('last_modified'):
+            response.last_modified = g.last_modified
+
+    return response
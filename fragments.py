@@ -0,0 +1,83 @@
+"""Caching of rendered message list items.
+
+A message in a list (timeline, profile, likes, search results) renders the
+same for every viewer apart from the like buttons, and only changes when
+its author edits their profile. Templates call `message_item(msg)` for the
+viewer-independent part and render the like buttons around it:
+
+    <li class="list-group-item">
+      {{ message_item(msg) }}
+      <form ...like button...></form>
+    </li>
+
+The first render of a message stores its HTML in `storage`, which can be
+any object with get/set/delete (e.g. caching.LRUCache, or a shared cache
+client); later renders reuse it. Entries are keyed by message id and the
+author's `version`, which a profile edit bumps, so edits never show stale
+avatars or usernames. With no storage configured items are just rendered.
+
+This is a plain function rather than a `{% cache %}` block tag: Jinja's
+macro and call-block machinery cost about as much per item as rendering
+the markup itself, which would eat most of what the cache saves.
+"""
+
+from markupsafe import Markup
+
+ITEM_TEMPLATE = 'messages/_item.html'
+
+
+def message_key(message):
+    """The cache key for `message`'s rendered list item."""
+
+    return f"message:{message.id}:{message.user.version}"
+
+
+class FragmentCache:
+    """Renders message list items, reusing earlier renders from `storage`."""
+
+    def __init__(self, storage=None):
+        self.storage = storage
+        self.env = None
+
+    def init_app(self, app):
+        """Make `message_item` available to the app's templates."""
+
+        self.env = app.jinja_env
+        self.env.globals['message_item'] = self.message_item
+
+    def render(self, message, link_text):
+        # A "shared" context holds just these variables, skipping the copy
+        # of every template global that `Template.render` would make.
+        template = self.env.get_template(ITEM_TEMPLATE)
+        context = template.new_context({'msg': message, 'link_text': link_text},
+                                       shared=True)
+        return Markup(''.join(template.root_render_func(context)))
+
+    def message_item(self, message, link_text='Detail'):
+        """The HTML for `message` in a list, minus the like buttons.
+
+        `link_text` labels the link to the message's own page; each label
+        is cached separately.
+        """
+
+        if self.storage is None:
+            return self.render(message, link_text)
+
+        key = message_key(message)
+        rendered = self.storage.get(key)
+
+        if rendered is None or link_text not in rendered:
+            html = self.render(message, link_text)
+            self.storage.set(key, {**(rendered or {}), link_text: html})
+            return html
+
+        return rendered[link_text]
+
+    def forget(self, message):
+        """Drop `message`'s cached HTML, e.g. once it's deleted."""
+
+        if self.storage is not None:
+            self.storage.delete(message_key(message))
+
+    def stats(self):
+        return self.storage.stats() if self.storage is not None else None
@@ -1,30 +1,66 @@
 """Generate CSVs of random data for Warbler.
 
 Students won't need to run this for the exercise; they will just use the CSV
-files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+files that this generates. Run it to make bigger (or smaller) datasets, e.g.
+for benchmarks:
+
+    python generator/create_csvs.py                       # the sample data
+    python generator/create_csvs.py --users 1000000 --messages 20000000 \\
+        --follows 50000000 --workers 8 --out /data/staging
+
+then load them with `python seed.py --dir /data/staging`.
+
+No network access is needed. Like a real social network, the data is long
+tailed: a few users have a huge share of the followers and write most of
+the messages, while most follow a handful of people and rarely post.
+
+Rows are generated in fixed-size shards, each with its own random seed
+derived from --seed, and shards are spread over --workers processes. The
+same --seed (and --end) always gives the same files, whatever the worker
+count. Each shard streams to its own part file, and the parts are joined
+at the end, so memory use doesn't grow with the row counts.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import os
+import random
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from math import gcd
+
 from faker import Faker
-from helpers import get_random_datetime
+
+from helpers import get_random_datetime, power_law_rank, scatter
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
 
 NUM_USERS = 300
 NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+NUM_FOLLOWS = 5000
+
+SHARD_ROWS = 100000
+
+# Everyone's password is "password".
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
+
+# Exponents of the power laws for who gets followed and who posts; higher
+# means more skewed towards the most popular users.
+POPULARITY_EXPONENT = 1.1
+ACTIVITY_EXPONENT = 1.0
 
-fake = Faker()
+# Shape of the number of people each user follows (a Pareto distribution;
+# lower is more skewed). Scaled so the mean matches --follows / --users.
+FOLLOWING_SHAPE = 1.5
 
-# Generate random profile image URLs to use for users
+# How many fake names and sentences each shard draws from. Calling Faker
+# for every row would be far too slow for millions of rows.
+POOL_SIZE = 2000
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +68,162 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
-
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
-    for i in range(1, 46)
+    '/static/images/warbler-hero.jpg',
+    '/static/images/signed-out-home.jpg',
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
-        ))
-
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
-
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
-
-# Generate follows.csv from random pairings of users
-
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
-
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+
+def shard_rng(seed, kind, shard):
+    """The random generator for one shard of one file."""
+
+    return random.Random(f"{seed}:{kind}:{shard}")
+
+
+def fake_pools(rng):
+    """Pools of fake usernames, sentences, paragraphs and cities."""
+
+    fake = Faker()
+    fake.seed_instance(rng.getrandbits(32))
+
+    return dict(
+        usernames=[fake.user_name() for i in range(POOL_SIZE)],
+        domains=[fake.free_email_domain() for i in range(20)],
+        sentences=[fake.sentence() for i in range(POOL_SIZE)],
+        cities=[fake.city() for i in range(POOL_SIZE // 4)],
+    )
+
+
+def id_multiplier(n, start=2654435761):
+    """A multiplier for `scatter` that works for n ids."""
+
+    multiplier = start
+    while gcd(multiplier, n) != 1:
+        multiplier += 1
+    return multiplier
+
+
+def write_users(path, shard, args):
+    rng = shard_rng(args.seed, 'users', shard)
+    pools = fake_pools(rng)
+    first = shard * SHARD_ROWS + 1
+    last = min(args.users, first + SHARD_ROWS - 1)
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for id in range(first, last + 1):
+            # The id suffix keeps usernames and emails unique.
+            username = f"{rng.choice(pools['usernames'])}{id}"
+            writer.writerow([
+                id,
+                f"{username}@{rng.choice(pools['domains'])}",
+                username,
+                rng.choice(image_urls),
+                PASSWORD,
+                rng.choice(pools['sentences']),
+                rng.choice(header_image_urls),
+                rng.choice(pools['cities']),
+            ])
+
+    return last - first + 1
+
+
+def write_messages(path, shard, args):
+    rng = shard_rng(args.seed, 'messages', shard)
+    pools = fake_pools(rng)
+    count = min(SHARD_ROWS, args.messages - shard * SHARD_ROWS)
+    multiplier = id_multiplier(args.users, start=2246822519)
+
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for i in range(count):
+            text = ' '.join(rng.sample(pools['sentences'], rng.randint(1, 4)))
+            author = power_law_rank(rng, args.users, ACTIVITY_EXPONENT)
+            writer.writerow([
+                text[:MAX_WARBLER_LENGTH],
+                get_random_datetime(now=args.end, rng=rng),
+                scatter(author, args.users, multiplier),
+            ])
+
+    return count
+
+
+def write_follows(path, shard, args):
+    """Follows of the users in this shard; each picks how many people to
+    follow, then picks them by popularity."""
+
+    rng = shard_rng(args.seed, 'follows', shard)
+    first = shard * SHARD_ROWS + 1
+    last = min(args.users, first + SHARD_ROWS - 1)
+    multiplier = id_multiplier(args.users)
+
+    # Mean of paretovariate(a) is a / (a - 1).
+    mean = args.follows / args.users
+    scale = mean * (FOLLOWING_SHAPE - 1) / FOLLOWING_SHAPE
+
+    count = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        for follower in range(first, last + 1):
+            wanted = min(args.users - 1, int(scale * rng.paretovariate(FOLLOWING_SHAPE)))
+            followed = set()
+
+            for attempt in range(wanted * 3):
+                if len(followed) == wanted:
+                    break
+                rank = power_law_rank(rng, args.users, POPULARITY_EXPONENT)
+                user_id = scatter(rank, args.users, multiplier)
+                if user_id != follower:
+                    followed.add(user_id)
+
+            for user_id in sorted(followed):
+                writer.writerow([user_id, follower])
+            count += len(followed)
+
+    return count
+
+
+def generate(pool, name, headers, write, shards, args):
+    """Write `name` from `shards` shards in parallel and join the parts."""
+
+    path = os.path.join(args.out, name)
+    parts = [f"{path}.part{shard:05d}" for shard in range(shards)]
+    counts = pool.map(write, parts, range(shards), [args] * shards)
+    total = sum(counts)
+
+    with open(path, 'w', newline='') as f:
+        csv.writer(f).writerow(headers)
+        for part in parts:
+            with open(part, newline='') as part_file:
+                shutil.copyfileobj(part_file, f)
+            os.remove(part)
+
+    print(f"{path}: {total} rows")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate users.csv, messages.csv and follows.csv for Warbler.")
+    parser.add_argument('--users', type=int, default=NUM_USERS)
+    parser.add_argument('--messages', type=int, default=NUM_MESSAGES)
+    parser.add_argument('--follows', type=int, default=NUM_FOLLOWS,
+                        help="roughly how many follows to make")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', type=datetime.fromisoformat, default=datetime(2025, 1, 1),
+                        help="messages are dated in the two years before this")
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default=os.path.dirname(os.path.abspath(__file__)))
+    args = parser.parse_args()
+
+    os.makedirs(args.out, exist_ok=True)
+    user_shards = -(-args.users // SHARD_ROWS)
+    message_shards = -(-args.messages // SHARD_ROWS)
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        generate(pool, 'users.csv', USERS_CSV_HEADERS, write_users, user_shards, args)
+        generate(pool, 'messages.csv', MESSAGES_CSV_HEADERS, write_messages, message_shards, args)
+        generate(pool, 'follows.csv', FOLLOWS_CSV_HEADERS, write_follows, user_shards, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,43 @@
 """Support functions for CSV generation."""
 
+import random
 from datetime import datetime
-from random import uniform
 
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+def get_random_datetime(year_gap=2, now=None, rng=random):
+    """Get a random datetime within the `year_gap` years before `now`.
 
-    now = datetime.now()
+    Pass a seeded `random.Random` as `rng` (and a fixed `now`) for
+    reproducible output.
+    """
+
+    now = now or datetime.now()
     then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+    random_timestamp = rng.uniform(then.timestamp(), now.timestamp())
 
     return datetime.fromtimestamp(random_timestamp)
+
+
+def power_law_rank(rng, n, exponent):
+    """A random rank in 1..n, where rank r comes up with probability
+    proportional to r ** -exponent (a Zipf-like, long-tailed choice).
+
+    Uses the inverse CDF of the continuous distribution, so it's O(1) for
+    any n.
+    """
+
+    u = rng.random()
+    if exponent == 1:
+        rank = n ** u
+    else:
+        rank = ((n ** (1 - exponent) - 1) * u + 1) ** (1 / (1 - exponent))
+
+    return min(n, max(1, int(rank)))
+
+
+def scatter(rank, n, multiplier):
+    """Map rank 1..n onto ids 1..n, one to one, so the most popular ranks
+    aren't simply the lowest ids. `multiplier` must share no factor
+    with n."""
+
+    return (rank - 1) * multiplier % n + 1
@@ -0,0 +1,198 @@
+"""Per-request timings: SQL queries, template rendering and total time.
+
+Every request counts its SQL statements and adds up the time spent in
+the database, rendering templates and in total, in `g.request_stats`:
+
+    stats = g.request_stats
+    stats.queries, stats.db_ms, stats.template_ms
+
+With SERVER_TIMING on (the default in debug mode) responses carry them
+as a Server-Timing header, which browser dev tools show next to the
+request:
+
+    Server-Timing: db;dur=12.3;desc="5 queries", tpl;dur=4.0, total;dur=20.1
+
+A sample of requests also keeps each statement with its bind parameters
+and duration. Sampled requests slower than SLOW_REQUEST_MS are logged to
+the `warbler.slow_requests` logger as one JSON object per line, with
+their slowest statements. Counting is cheap; holding on to the
+statements is what sampling keeps rare.
+
+DB time is measured around the driver's execute, so it includes the
+round trip but not building ORM objects from the rows. Template time
+includes any queries a template triggers (lazy loads).
+
+Settings (read on each request):
+
+- SERVER_TIMING: send the Server-Timing header (default: app.debug).
+- SLOW_REQUEST_MS: log sampled requests that took longer (default 500).
+- SLOW_REQUEST_SAMPLE: fraction of requests to keep statements for
+  (default 0.1; 0 turns the slow log off).
+- SLOW_REQUEST_LOG: also append the slow log to this file (read by
+  `init_app`).
+"""
+
+import json
+import logging
+import random
+import time
+
+from flask import current_app, g, has_request_context, request
+from flask.signals import before_render_template, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DEFAULT_SLOW_MS = 500
+DEFAULT_SAMPLE = 0.1
+
+# How many of a slow request's statements to log (the slowest ones), and
+# how much of each bind parameter.
+LOGGED_STATEMENTS = 20
+PARAM_LENGTH = 200
+
+logger = logging.getLogger('warbler.slow_requests')
+
+
+class RequestStats:
+    """What one request has spent so far."""
+
+    __slots__ = ('started', 'queries', 'db_ms', 'template_ms',
+                 'template_started', 'statements')
+
+    def __init__(self, traced=False):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+        self.template_started = None
+        # (ms, sql, params) of each statement, for traced requests only.
+        self.statements = [] if traced else None
+
+    @property
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+
+def current_stats():
+    """The running request's RequestStats, or None outside a request."""
+
+    if not has_request_context():
+        return None
+    return g.get('request_stats')
+
+
+def loggable(params):
+    """Bind parameters, shortened so one huge value can't flood the log."""
+
+    if isinstance(params, dict):
+        return {key: loggable(value) for key, value in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [loggable(value) for value in params[:LOGGED_STATEMENTS]]
+    if isinstance(params, str) and len(params) > PARAM_LENGTH:
+        return params[:PARAM_LENGTH] + '...'
+    if isinstance(params, bytes):
+        return f"<{len(params)} bytes>"
+    return params
+
+
+def server_timing(stats, total_ms):
+    """The Server-Timing header value for `stats`."""
+
+    return (f'db;dur={stats.db_ms:.1f};desc="{stats.queries} queries", '
+            f'tpl;dur={stats.template_ms:.1f}, '
+            f'total;dur={total_ms:.1f}')
+
+
+class Instrumentation:
+    """Times requests; see the module docstring."""
+
+    def init_app(self, app):
+        """Hook into `app`'s requests and templates, and every engine.
+
+        Call this before registering other request hooks, so the timings
+        cover them too.
+        """
+
+        app.before_request(self.start)
+        app.after_request(self.finish)
+        before_render_template.connect(self.template_started, app)
+        template_rendered.connect(self.template_finished, app)
+
+        # On Engine itself, so this works whichever engine the app ends up
+        # using; outside a request it's a no-op.
+        if not event.contains(Engine, 'before_cursor_execute', before_cursor_execute):
+            event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+
+        path = app.config.get('SLOW_REQUEST_LOG')
+        if path:
+            handler = logging.FileHandler(path)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            logger.addHandler(handler)
+
+    def start(self):
+        sample = current_app.config.get('SLOW_REQUEST_SAMPLE', DEFAULT_SAMPLE)
+        g.request_stats = RequestStats(traced=random.random() < sample)
+
+    def template_started(self, sender, template, context, **extra):
+        stats = current_stats()
+        if stats is not None:
+            stats.template_started = time.perf_counter()
+
+    def template_finished(self, sender, template, context, **extra):
+        stats = current_stats()
+        if stats is not None and stats.template_started is not None:
+            stats.template_ms += (time.perf_counter() - stats.template_started) * 1000
+            stats.template_started = None
+
+    def finish(self, response):
+        stats = current_stats()
+        if stats is None:
+            return response
+
+        config = current_app.config
+        total_ms = stats.total_ms
+
+        if config.get('SERVER_TIMING', current_app.debug):
+            response.headers['Server-Timing'] = server_timing(stats, total_ms)
+
+        if (stats.statements is not None
+                and total_ms > config.get('SLOW_REQUEST_MS', DEFAULT_SLOW_MS)):
+            self.log_slow(stats, total_ms, response)
+
+        return response
+
+    def log_slow(self, stats, total_ms, response):
+        """Log a slow request and its slowest statements."""
+
+        slowest = sorted(stats.statements, key=lambda s: s[0], reverse=True)
+        logger.warning(json.dumps(dict(
+            method=request.method,
+            path=request.full_path.rstrip('?'),
+            endpoint=request.endpoint,
+            status=response.status_code,
+            total_ms=round(total_ms, 2),
+            db_ms=round(stats.db_ms, 2),
+            template_ms=round(stats.template_ms, 2),
+            queries=stats.queries,
+            statements=[dict(ms=round(ms, 2), sql=sql, params=loggable(params))
+                        for ms, sql, params in slowest[:LOGGED_STATEMENTS]],
+        ), default=repr))
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._instrumentation_started = time.perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, '_instrumentation_started', None)
+    stats = current_stats()
+    if started is None or stats is None:
+        return
+
+    ms = (time.perf_counter() - started) * 1000
+    stats.queries += 1
+    stats.db_ms += ms
+    if stats.statements is not None:
+        stats.statements.append((ms, statement, parameters))
@@ -0,0 +1,219 @@
+"""Bulk loading of CSV files into the database.
+
+Used by seed.py for anything from the sample data to tens of millions of
+rows for staging. On PostgreSQL each file is streamed through COPY in
+chunks of `chunk_rows` rows, so memory use stays flat however big the file
+is; other databases (SQLite in development) get chunked executemany
+INSERTs instead.
+
+For speed the tables' secondary indexes and foreign keys are dropped
+before loading and recreated afterwards, building each index once instead
+of updating it row by row (see `Loader.indexes_dropped`). The foreign
+keys are checked when they're added back, so every table they point at
+must be loaded by then.
+
+The first line of each CSV names its columns. Empty fields load as NULL.
+"""
+
+import csv
+import io
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from itertools import islice
+
+from sqlalchemy import Boolean, DateTime, Integer, TypeDecorator
+
+CHUNK_ROWS = 50000
+
+
+class Loader:
+    """Loads CSV files through `connection`, a SQLAlchemy Connection.
+
+    Nothing is committed; the caller owns the transaction, so a failed
+    load can be rolled back as a whole.
+    """
+
+    def __init__(self, connection, chunk_rows=CHUNK_ROWS, report=print):
+        self.connection = connection
+        self.postgres = connection.dialect.name == 'postgresql'
+        self.chunk_rows = chunk_rows
+        self.report = report
+
+    @contextmanager
+    def indexes_dropped(self, names):
+        """Drop the secondary indexes (and on PostgreSQL, foreign keys) of
+        the `names` tables for the duration of the block, then rebuild
+        them."""
+
+        cursor = self.connection.connection.cursor()
+        if self.postgres:
+            dropped = self._drop_pg_indexes(cursor, names)
+        else:
+            dropped = self._drop_indexes(cursor, names)
+
+        yield
+
+        started = time.perf_counter()
+        for statement in dropped:
+            cursor.execute(statement)
+        self.report(f"rebuilt {len(dropped)} indexes and constraints "
+                    f"in {time.perf_counter() - started:.1f}s")
+
+    def load(self, tables):
+        """Load each `(table, path)` pair, in order.
+
+        `table` is a SQLAlchemy Table. Returns the rows loaded per table
+        name.
+        """
+
+        cursor = self.connection.connection.cursor()
+
+        counts = {}
+        for table, path in tables:
+            started = time.perf_counter()
+            if self.postgres:
+                counts[table.name] = self._copy(cursor, table, path)
+            else:
+                counts[table.name] = self._insert(cursor, table, path)
+            self._report_rate(table.name, counts[table.name], started)
+
+        if self.postgres:
+            self._reset_sequences(cursor, [table for table, path in tables])
+
+        return counts
+
+    def _report_rate(self, name, rows, started, prefix=''):
+        elapsed = time.perf_counter() - started
+        rate = rows / elapsed if elapsed else 0
+        self.report(f"{prefix}{name}: {rows} rows in {elapsed:.1f}s ({rate:,.0f} rows/s)")
+
+    def _chunks(self, path):
+        """The CSV's column names, and its rows in lists of `chunk_rows`."""
+
+        f = open(path, newline='')
+        reader = csv.reader(f)
+        columns = next(reader)
+
+        def chunks():
+            with f:
+                while True:
+                    chunk = list(islice(reader, self.chunk_rows))
+                    if not chunk:
+                        return
+                    yield chunk
+
+        return columns, chunks()
+
+    def _copy(self, cursor, table, path):
+        columns, chunks = self._chunks(path)
+        statement = (f"COPY {table.name} ({', '.join(columns)}) "
+                     f"FROM STDIN WITH (FORMAT csv)")
+
+        total = 0
+        started = time.perf_counter()
+        for chunk in chunks:
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(chunk)
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+
+            total += len(chunk)
+            if len(chunk) == self.chunk_rows:
+                self._report_rate(table.name, total, started, prefix='  ')
+
+        return total
+
+    def _insert(self, cursor, table, path):
+        columns, chunks = self._chunks(path)
+        convert = [self._converter(table.c[column].type) for column in columns]
+        placeholders = ', '.join('?' * len(columns))
+        statement = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({placeholders})"
+
+        total = 0
+        for chunk in chunks:
+            cursor.executemany(statement, [
+                [fn(value) if value != '' else None for fn, value in zip(convert, row)]
+                for row in chunk
+            ])
+            total += len(chunk)
+
+        return total
+
+    @staticmethod
+    def _converter(column_type):
+        # Variants (e.g. models.MessageId) and other decorated types
+        # convert like the type they wrap.
+        while isinstance(column_type, TypeDecorator):
+            column_type = column_type.impl
+
+        if isinstance(column_type, Boolean):
+            return lambda value: value.lower() in ('t', 'true', '1')
+        if isinstance(column_type, Integer):
+            return int
+        if isinstance(column_type, DateTime):
+            # Stored the way SQLAlchemy writes datetimes to SQLite.
+            return lambda value: datetime.fromisoformat(value).strftime('%Y-%m-%d %H:%M:%S.%f')
+        return str
+
+    def _drop_pg_indexes(self, cursor, names):
+        """Drop secondary indexes and foreign keys on the `names` tables.
+
+        Returns the statements that recreate them. Primary keys and unique
+        constraints stay, so bad data still fails the load.
+        """
+
+        cursor.execute("""
+            SELECT c.conrelid::regclass::text, c.conname, pg_get_constraintdef(c.oid)
+              FROM pg_constraint c
+             WHERE c.contype = 'f' AND c.conrelid::regclass::text = ANY(%s)
+        """, (names,))
+        foreign_keys = cursor.fetchall()
+
+        cursor.execute("""
+            SELECT i.relname, pg_get_indexdef(i.oid)
+              FROM pg_index x
+              JOIN pg_class i ON i.oid = x.indexrelid
+             WHERE x.indrelid::regclass::text = ANY(%s)
+               AND NOT EXISTS (SELECT 1 FROM pg_constraint c WHERE c.conindid = x.indexrelid)
+        """, (names,))
+        indexes = cursor.fetchall()
+
+        for table, name, definition in foreign_keys:
+            cursor.execute(f'ALTER TABLE {table} DROP CONSTRAINT "{name}"')
+        for name, definition in indexes:
+            cursor.execute(f'DROP INDEX "{name}"')
+
+        return ([definition for name, definition in indexes] +
+                [f'ALTER TABLE {table} ADD CONSTRAINT "{name}" {definition}'
+                 for table, name, definition in foreign_keys])
+
+    def _drop_indexes(self, cursor, names):
+        """Drop the secondary indexes on the `names` tables (SQLite);
+        returns the statements that recreate them."""
+
+        recreate = []
+        for name in names:
+            cursor.execute("SELECT name, sql FROM sqlite_master "
+                           "WHERE type = 'index' AND tbl_name = ? AND sql IS NOT NULL",
+                           (name,))
+            for index, sql in cursor.fetchall():
+                if not sql.upper().startswith('CREATE UNIQUE'):
+                    cursor.execute(f'DROP INDEX "{index}"')
+                    recreate.append(sql)
+
+        return recreate
+
+    def _reset_sequences(self, cursor, tables):
+        """Point serial id sequences past the loaded ids, in case the CSVs
+        had ids of their own."""
+
+        for table in tables:
+            if 'id' not in table.c:
+                continue
+
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table.name,))
+            sequence = cursor.fetchone()[0]
+            if sequence:
+                cursor.execute(f"SELECT setval(%s, COALESCE(MAX(id), 0) + 1, false) "
+                               f"FROM {table.name}", (sequence,))
@@ -0,0 +1,188 @@
+"""Prometheus metrics, served at /metrics in the text exposition format.
+
+Covers, labelled by endpoint name (`homepage`, `users_show`, ...) rather
+than URL so there's one series per route, not per user:
+
+- warbler_request_duration_seconds: request latency histogram, plus
+  per-request DB time and statement counts (from instrumentation.py).
+- warbler_requests_total / warbler_request_errors_total: responses by
+  status code, and 5xx responses.
+- warbler_db_pool_*: connection checkouts, time spent getting a
+  connection (waiting when the pool is exhausted), and connections
+  checked out and in overflow.
+- warbler_cache_hits_total / warbler_cache_misses_total: per cache, for
+  hit ratios (hits / (hits + misses) in PromQL).
+- warbler_bcrypt_*: time queued for and spent hashing, and timeouts.
+
+Under a multi-process server (gunicorn, uWSGI) each worker has its own
+counters. Set PROMETHEUS_MULTIPROC_DIR to an empty directory, the same for
+every worker, before the app starts: workers then keep their values in
+mmap'd files there, and /metrics adds up all of them whichever worker
+answers. Clear the directory on each deploy and, with gunicorn, mark
+exited workers dead in gunicorn.conf.py:
+
+    from prometheus_client import multiprocess
+
+    def child_exit(server, worker):
+        multiprocess.mark_process_dead(worker.pid)
+
+Without it, metrics cover just the process that serves /metrics.
+"""
+
+import os
+import threading
+import time
+
+from flask import request
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram,
+                               REGISTRY, CONTENT_TYPE_LATEST, generate_latest)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.pool import Pool, QueuePool
+
+from instrumentation import current_stats
+
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+
+# Statement counts per request; the bucket past 50 is where N+1 queries
+# show up.
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, float('inf'))
+
+# bcrypt at cost 12 takes ~0.25s; queueing can add whole seconds.
+BCRYPT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+REQUEST_DURATION = Histogram(
+    'warbler_request_duration_seconds', "Time to handle a request", ['endpoint'])
+REQUEST_DB_DURATION = Histogram(
+    'warbler_request_db_seconds', "Time a request spent running SQL", ['endpoint'])
+REQUEST_QUERIES = Histogram(
+    'warbler_request_queries', "SQL statements run by a request", ['endpoint'],
+    buckets=QUERY_BUCKETS)
+REQUESTS = Counter(
+    'warbler_requests_total', "Responses sent", ['endpoint', 'status'])
+REQUEST_ERRORS = Counter(
+    'warbler_request_errors_total', "Responses with a 5xx status", ['endpoint'])
+
+POOL_CHECKOUTS = Counter(
+    'warbler_db_pool_checkouts_total', "Connections checked out of the pool")
+POOL_CONNECT = Histogram(
+    'warbler_db_pool_connect_seconds',
+    "Time to get a pooled connection, including waiting for one to be free")
+POOL_CHECKED_OUT = Gauge(
+    'warbler_db_pool_checked_out', "Connections in use", multiprocess_mode='livesum')
+POOL_OVERFLOW = Gauge(
+    'warbler_db_pool_overflow', "Connections open beyond pool_size", multiprocess_mode='livesum')
+
+CACHE_HITS = Counter('warbler_cache_hits_total', "Cache hits", ['cache'])
+CACHE_MISSES = Counter('warbler_cache_misses_total', "Cache misses", ['cache'])
+
+BCRYPT_WAIT = Histogram(
+    'warbler_bcrypt_wait_seconds', "Time a hash waited for a bcrypt worker", ['operation'],
+    buckets=BCRYPT_BUCKETS)
+BCRYPT_DURATION = Histogram(
+    'warbler_bcrypt_seconds', "Time to hash or check a password", ['operation'],
+    buckets=BCRYPT_BUCKETS)
+BCRYPT_TIMEOUTS = Counter(
+    'warbler_bcrypt_timeouts_total',
+    "Hashes given up with HasherBusy: queue full, or past BCRYPT_TIMEOUT", ['operation'])
+
+
+class MeteredQueuePool(QueuePool):
+    """A QueuePool that times how long getting a connection takes.
+
+    Use it with SQLALCHEMY_ENGINE_OPTIONS = {'poolclass': MeteredQueuePool}.
+    """
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            POOL_CONNECT.observe(time.perf_counter() - started)
+
+
+def count_checkout(dbapi_connection, connection_record, connection_proxy):
+    POOL_CHECKOUTS.inc()
+
+
+def observe_bcrypt(operation, waited, ran):
+    """`PasswordHasher.on_timing` callback."""
+
+    BCRYPT_WAIT.labels(operation).observe(waited)
+    if ran is None:
+        BCRYPT_TIMEOUTS.labels(operation).inc()
+    else:
+        BCRYPT_DURATION.labels(operation).observe(ran)
+
+
+class Metrics:
+    """Collects request, pool and cache metrics for an app, and serves
+    them at /metrics."""
+
+    def __init__(self):
+        # name -> (function returning (hits, misses), last values counted)
+        self._caches = {}
+        self._lock = threading.Lock()
+        self.db = None
+
+    def init_app(self, app, db=None):
+        """Record `app`'s requests, and the pool of `db` (a Flask-SQLAlchemy
+        instance) if it's a QueuePool."""
+
+        self.db = db
+        app.after_request(self.record)
+        app.add_url_rule('/metrics', 'metrics', self.view)
+
+        if not event.contains(Pool, 'checkout', count_checkout):
+            event.listen(Pool, 'checkout', count_checkout)
+
+    def track_cache(self, name, counts):
+        """Report a cache's hits and misses; `counts()` returns this
+        process's running totals as (hits, misses)."""
+
+        self._caches[name] = (counts, (0, 0))
+
+    def record(self, response):
+        endpoint = request.endpoint or 'unmatched'
+        status = response.status_code
+
+        REQUESTS.labels(endpoint, status).inc()
+        if status >= 500:
+            REQUEST_ERRORS.labels(endpoint).inc()
+
+        stats = current_stats()
+        if stats is not None:
+            REQUEST_DURATION.labels(endpoint).observe(stats.total_ms / 1000)
+            REQUEST_DB_DURATION.labels(endpoint).observe(stats.db_ms / 1000)
+            REQUEST_QUERIES.labels(endpoint).observe(stats.queries)
+
+        self.sync()
+        return response
+
+    def sync(self):
+        """Copy pool sizes and new cache hits/misses into the metrics."""
+
+        pool = self.db.engine.pool if self.db is not None else None
+        if isinstance(pool, QueuePool):
+            POOL_CHECKED_OUT.set(pool.checkedout())
+            POOL_OVERFLOW.set(max(pool.overflow(), 0))
+
+        with self._lock:
+            for name, (counts, (hits_before, misses_before)) in self._caches.items():
+                hits, misses = counts()
+                CACHE_HITS.labels(name).inc(max(hits - hits_before, 0))
+                CACHE_MISSES.labels(name).inc(max(misses - misses_before, 0))
+                self._caches[name] = (counts, (hits, misses))
+
+    def view(self):
+        """The metrics of every worker, in Prometheus' text format."""
+
+        self.sync()
+
+        if MULTIPROC_DIR:
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+        else:
+            registry = REGISTRY
+
+        return generate_latest(registry), 200, {'Content-Type': CONTENT_TYPE_LATEST}
@@ -0,0 +1,60 @@
+"""Baseline: the original users, messages, follows and likes tables
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 09:00:00.000000
+
+The schema as db.create_all() first made it, before timelines, counters
+or search. A database created back then already has these tables; mark
+it with `flask db stamp 0001` instead of upgrading to it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'users',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('email', sa.Text(), nullable=False, unique=True),
+        sa.Column('username', sa.Text(), nullable=False, unique=True),
+        sa.Column('image_url', sa.Text()),
+        sa.Column('header_image_url', sa.Text()),
+        sa.Column('bio', sa.Text()),
+        sa.Column('location', sa.Text()),
+        sa.Column('password', sa.Text(), nullable=False),
+    )
+    op.create_table(
+        'follows',
+        sa.Column('user_being_followed_id', sa.Integer(),
+                  sa.ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+        sa.Column('user_following_id', sa.Integer(),
+                  sa.ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+    )
+    op.create_table(
+        'messages',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('text', sa.String(140), nullable=False),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('user_id', sa.Integer(),
+                  sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+    )
+    op.create_table(
+        'likes',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='cascade')),
+        sa.Column('message_id', sa.Integer(),
+                  sa.ForeignKey('messages.id', ondelete='cascade'), unique=True),
+    )
+
+
+def downgrade():
+    for table in ['likes', 'messages', 'follows', 'users']:
+        op.drop_table(table)
@@ -0,0 +1,47 @@
+"""Home timelines materialized on write
+
+Revision ID: 0001a
+Revises: 0001
+Create Date: 2026-10-18 09:10:00.000000
+
+- timeline: one row per message in a user's home page, keyed by
+  (owner_id, timestamp, message_id), with the author alongside.
+- Filled in from messages and follows: each user's own messages and
+  those of everyone they follow.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001a'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'timeline',
+        sa.Column('owner_id', sa.Integer(),
+                  sa.ForeignKey('users.id', ondelete='cascade'), primary_key=True),
+        sa.Column('timestamp', sa.DateTime(), primary_key=True),
+        sa.Column('message_id', sa.Integer(),
+                  sa.ForeignKey('messages.id', ondelete='cascade'), primary_key=True),
+        sa.Column('author_id', sa.Integer(),
+                  sa.ForeignKey('users.id', ondelete='cascade'), nullable=False),
+    )
+    op.execute('''
+        INSERT INTO timeline (owner_id, "timestamp", message_id, author_id)
+        SELECT user_id, "timestamp", id, user_id FROM messages
+        UNION ALL
+        SELECT follows.user_following_id, messages."timestamp", messages.id, messages.user_id
+        FROM follows JOIN messages ON messages.user_id = follows.user_being_followed_id
+        WHERE follows.user_following_id <> messages.user_id
+    ''')
+    op.create_index('ix_timeline_message_id', 'timeline', ['message_id'])
+    op.create_index('ix_timeline_owner_id_author_id', 'timeline', ['owner_id', 'author_id'])
+
+
+def downgrade():
+    op.drop_table('timeline')
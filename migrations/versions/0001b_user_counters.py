@@ -0,0 +1,44 @@
+"""Denormalized per-user counts
+
+Revision ID: 0001b
+Revises: 0001a
+Create Date: 2026-10-18 09:20:00.000000
+
+- users gains messages_count, following_count, followers_count and
+  likes_count, counted from the messages, follows and likes tables.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001b'
+down_revision = '0001a'
+branch_labels = None
+depends_on = None
+
+COUNTERS = [
+    ('messages_count', 'messages', 'user_id'),
+    ('following_count', 'follows', 'user_following_id'),
+    ('followers_count', 'follows', 'user_being_followed_id'),
+    ('likes_count', 'likes', 'user_id'),
+]
+
+
+def upgrade():
+    for counter, table, user_id in COUNTERS:
+        op.add_column('users', sa.Column(counter, sa.Integer(), nullable=False,
+                                         server_default='0'))
+
+    for counter, table, user_id in COUNTERS:
+        op.execute(f'''
+            UPDATE users SET {counter} = counts.n
+            FROM (SELECT {user_id} AS user_id, count(*) AS n
+                  FROM {table} GROUP BY {user_id}) AS counts
+            WHERE users.id = counts.user_id
+        ''')
+
+
+def downgrade():
+    for counter, table, user_id in reversed(COUNTERS):
+        op.drop_column('users', counter)
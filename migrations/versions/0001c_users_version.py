@@ -0,0 +1,26 @@
+"""Profile versions for cache keys
+
+Revision ID: 0001c
+Revises: 0001b
+Create Date: 2026-10-18 09:30:00.000000
+
+- users gains version, 1 for everyone, bumped on every profile edit.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001c'
+down_revision = '0001b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('version', sa.Integer(), nullable=False,
+                                     server_default='1'))
+
+
+def downgrade():
+    op.drop_column('users', 'version')
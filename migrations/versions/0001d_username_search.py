@@ -0,0 +1,26 @@
+"""Index for username search
+
+Revision ID: 0001d
+Revises: 0001c
+Create Date: 2026-10-18 09:40:00.000000
+
+- users (lower(username) COLLATE "C", id): prefix search on usernames,
+  ordered by the same key, from the index.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0001d'
+down_revision = '0001c'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE INDEX ix_users_username_search '
+               'ON users (lower(username) COLLATE "C", id)')
+
+
+def downgrade():
+    op.drop_index('ix_users_username_search', 'users')
@@ -0,0 +1,42 @@
+"""Full-text search of messages
+
+Revision ID: 0001e
+Revises: 0001d
+Create Date: 2026-10-18 09:50:00.000000
+
+- messages gains search_vector, kept up to date from text by a trigger
+  and filled in for existing messages, with a GIN index on it.
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import TSVECTOR
+
+
+# revision identifiers, used by Alembic.
+revision = '0001e'
+down_revision = '0001d'
+branch_labels = None
+depends_on = None
+
+# models.SEARCH_CONFIG when this was written; don't follow later changes.
+SEARCH_CONFIG = 'english'
+
+
+def upgrade():
+    op.add_column('messages', sa.Column('search_vector', TSVECTOR()))
+    op.execute(f'''
+        CREATE TRIGGER messages_search_vector_update
+        BEFORE INSERT OR UPDATE OF text ON messages
+        FOR EACH ROW EXECUTE PROCEDURE
+        tsvector_update_trigger(search_vector, 'pg_catalog.{SEARCH_CONFIG}', text)
+    ''')
+    op.execute(f"UPDATE messages SET search_vector = "
+               f"to_tsvector('pg_catalog.{SEARCH_CONFIG}', text)")
+    op.create_index('ix_messages_search_vector', 'messages', ['search_vector'],
+                    postgresql_using='gin')
+
+
+def downgrade():
+    op.drop_index('ix_messages_search_vector', 'messages')
+    op.execute('DROP TRIGGER messages_search_vector_update ON messages')
+    op.drop_column('messages', 'search_vector')
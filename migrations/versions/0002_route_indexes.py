@@ -0,0 +1,53 @@
+"""Indexes for the routes' access patterns
+
+Revision ID: 0002
+Revises: 0001e
+Create Date: 2026-10-18 10:00:00.000000
+
+- messages (user_id, timestamp, id): a profile's messages, newest first
+  and paged by (timestamp, id), and a user's recent messages when
+  following them.
+- follows (user_following_id, user_being_followed_id): who a user
+  follows, and which of a page of users they follow, from the index
+  alone. The primary key only serves "who follows X".
+- likes (user_id, message_id), unique: a user's likes and which of a page
+  of messages they've liked, from the index alone. Replaces the unique
+  constraint on message_id, which let only one user like each message.
+- likes (message_id): deleting a message and its likes.
+
+The indexes are built CONCURRENTLY, outside a transaction, so writes to
+these tables carry on while they build. If one fails it's left INVALID;
+drop it and rerun the upgrade.
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001e'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ('ix_messages_user_id_timestamp_id', 'messages', ['user_id', 'timestamp', 'id'], False),
+    ('ix_follows_user_following_id', 'follows', ['user_following_id', 'user_being_followed_id'], False),
+    ('ix_likes_user_id_message_id', 'likes', ['user_id', 'message_id'], True),
+    ('ix_likes_message_id', 'likes', ['message_id'], False),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns, unique in INDEXES:
+            op.create_index(name, table, columns, unique=unique,
+                            postgresql_concurrently=True)
+
+    op.drop_constraint('likes_message_id_key', 'likes', type_='unique')
+
+
+def downgrade():
+    # Fails if any message has been liked by more than one user.
+    op.create_unique_constraint('likes_message_id_key', 'likes', ['message_id'])
+
+    for name, table, columns, unique in reversed(INDEXES):
+        op.drop_index(name, table)
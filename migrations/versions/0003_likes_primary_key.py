@@ -0,0 +1,54 @@
+"""Key likes by (user_id, message_id) and count likes per message
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 11:00:00.000000
+
+- likes loses its surrogate id. The unique (user_id, message_id) index
+  from 0002 becomes the primary key as it is, without a rebuild. Rows
+  with a NULL user or message (never valid, but the columns allowed
+  them) are deleted first.
+- messages gains like_count, filled in from likes.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('DELETE FROM likes WHERE user_id IS NULL OR message_id IS NULL')
+    op.drop_constraint('likes_pkey', 'likes', type_='primary')
+    op.drop_column('likes', 'id')
+    op.alter_column('likes', 'user_id', nullable=False)
+    op.alter_column('likes', 'message_id', nullable=False)
+    op.execute('ALTER TABLE likes ADD CONSTRAINT likes_pkey '
+               'PRIMARY KEY USING INDEX ix_likes_user_id_message_id')
+
+    op.add_column('messages', sa.Column('like_count', sa.Integer(), nullable=False,
+                                        server_default='0'))
+    op.execute('''
+        UPDATE messages SET like_count = counts.n
+        FROM (SELECT message_id, count(*) AS n FROM likes GROUP BY message_id) AS counts
+        WHERE messages.id = counts.message_id
+    ''')
+
+
+def downgrade():
+    op.drop_column('messages', 'like_count')
+
+    op.drop_constraint('likes_pkey', 'likes', type_='primary')
+    op.create_index('ix_likes_user_id_message_id', 'likes', ['user_id', 'message_id'],
+                    unique=True)
+    op.alter_column('likes', 'user_id', nullable=True)
+    op.alter_column('likes', 'message_id', nullable=True)
+    op.add_column('likes', sa.Column('id', sa.Integer(), autoincrement=True))
+    op.execute("CREATE SEQUENCE likes_id_seq AS integer OWNED BY likes.id")
+    op.execute("UPDATE likes SET id = nextval('likes_id_seq')")
+    op.execute("ALTER TABLE likes ALTER COLUMN id SET DEFAULT nextval('likes_id_seq')")
+    op.create_primary_key('likes_pkey', 'likes', ['id'])
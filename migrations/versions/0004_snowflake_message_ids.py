@@ -0,0 +1,171 @@
+"""Time-ordered message ids; timelines keyed by message id
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:00:00.000000
+
+- messages.id (and the columns pointing at it) become bigint Snowflake
+  ids (see snowflake.py). The app makes them; rows inserted without one
+  get theirs from the messages_assign_id trigger, and messages_id_seq
+  becomes bigint to match. Existing messages are renumbered from their
+  timestamps, so id order is time order, and likes and timelines
+  follow. Where more than 4096 messages share a millisecond, the rest
+  take the following milliseconds' ids.
+- messages.timestamp defaults to the current UTC time in the database
+  too.
+- timeline drops its timestamp column: its primary key becomes
+  (owner_id, message_id), which is newest first by itself.
+- messages (user_id, id) replaces (user_id, timestamp, id) for profiles.
+
+Every message gets a new id, so links to messages by their old ids stop
+working. The tables are rewritten while locked; plan for downtime on a
+big database.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+# As in models.py, with snowflake.py's EPOCH_MS, bit widths and
+# DATABASE_WORKER written out.
+CREATE_FUNCTIONS = """
+    CREATE OR REPLACE FUNCTION message_id_at(created timestamp) RETURNS bigint
+    LANGUAGE sql VOLATILE AS $$
+        SELECT ((floor(extract(epoch FROM created) * 1000)::bigint - 1262304000000)
+                << 22)
+               | (1023 << 12)
+               | (nextval('messages_id_seq') & 4095)
+    $$;
+
+    CREATE OR REPLACE FUNCTION messages_assign_id() RETURNS trigger
+    LANGUAGE plpgsql AS $$
+    DECLARE
+        created timestamp := NEW."timestamp";
+    BEGIN
+        IF NEW.id IS NULL THEN
+            -- The sequence bits wrap every 4096 ids, so more
+            -- than that in one millisecond repeat; move on to the next
+            -- millisecond until the id is free.
+            LOOP
+                NEW.id := message_id_at(created);
+                EXIT WHEN NOT EXISTS (SELECT 1 FROM messages WHERE id = NEW.id);
+                created := created + interval '1 millisecond';
+            END LOOP;
+        END IF;
+        RETURN NEW;
+    END
+    $$;
+"""
+
+MESSAGE_FOREIGN_KEYS = [
+    ('likes_message_id_fkey', 'likes'),
+    ('timeline_message_id_fkey', 'timeline'),
+]
+
+
+def renumber(select):
+    """Renumber every message by `select`, a query of (old_id, new_id),
+    in likes and timelines too."""
+
+    op.execute(f"CREATE TEMPORARY TABLE renumbered AS {select}")
+    for table, column in [('messages', 'id'), ('likes', 'message_id'),
+                          ('timeline', 'message_id')]:
+        op.execute(f"""
+            UPDATE {table} SET {column} = renumbered.new_id
+            FROM renumbered WHERE {table}.{column} = renumbered.old_id
+        """)
+    op.execute("DROP TABLE renumbered")
+
+
+# Ids from timestamps, numbering the messages of each millisecond in
+# (timestamp, id) order. A slot is a millisecond times 4096 plus the
+# sequence; each message takes its millisecond's first slot, or the one
+# after the previous message's if that's later, so a millisecond with
+# more than 4096 messages carries over into the next ones.
+SNOWFLAKE_IDS = """
+    WITH ordered AS (
+        SELECT id,
+               floor(extract(epoch FROM "timestamp") * 1000)::bigint * 4096 AS slot,
+               row_number() OVER (ORDER BY "timestamp", id) AS n
+        FROM messages
+    ), slotted AS (
+        SELECT id, n + max(slot - n) OVER (ORDER BY n) AS slot
+        FROM ordered
+    )
+    SELECT id AS old_id,
+           (((slot >> 12) - 1262304000000) << 22) | (1023 << 12) | (slot & 4095) AS new_id
+    FROM slotted
+"""
+
+
+def upgrade():
+    for name, table in MESSAGE_FOREIGN_KEYS:
+        op.drop_constraint(name, table, type_='foreignkey')
+
+    op.alter_column('messages', 'id', type_=sa.BigInteger(), server_default=None)
+    op.alter_column('likes', 'message_id', type_=sa.BigInteger())
+    op.alter_column('timeline', 'message_id', type_=sa.BigInteger())
+    op.execute('ALTER SEQUENCE messages_id_seq AS bigint OWNED BY NONE')
+
+    op.execute(CREATE_FUNCTIONS)
+    # Old ids are all far below new ones, so the updates never collide.
+    renumber(SNOWFLAKE_IDS)
+    op.execute('''
+        CREATE TRIGGER messages_assign_id
+        BEFORE INSERT ON messages
+        FOR EACH ROW EXECUTE PROCEDURE messages_assign_id()
+    ''')
+    op.alter_column('messages', 'timestamp', server_default=sa.text("timezone('utc', now())"))
+
+    op.drop_constraint('timeline_pkey', 'timeline', type_='primary')
+    op.drop_column('timeline', 'timestamp')
+    op.create_primary_key('timeline_pkey', 'timeline', ['owner_id', 'message_id'])
+
+    op.drop_index('ix_messages_user_id_timestamp_id', 'messages')
+    op.create_index('ix_messages_user_id_id', 'messages', ['user_id', 'id'])
+
+    for name, table in MESSAGE_FOREIGN_KEYS:
+        op.create_foreign_key(name, table, 'messages', ['message_id'], ['id'],
+                              ondelete='cascade')
+
+
+def downgrade():
+    for name, table in MESSAGE_FOREIGN_KEYS:
+        op.drop_constraint(name, table, type_='foreignkey')
+
+    op.drop_index('ix_messages_user_id_id', 'messages')
+    op.create_index('ix_messages_user_id_timestamp_id', 'messages',
+                    ['user_id', 'timestamp', 'id'])
+
+    op.add_column('timeline', sa.Column('timestamp', sa.DateTime()))
+    op.execute('''
+        UPDATE timeline SET "timestamp" = messages."timestamp"
+        FROM messages WHERE messages.id = timeline.message_id
+    ''')
+    op.alter_column('timeline', 'timestamp', nullable=False)
+    op.drop_constraint('timeline_pkey', 'timeline', type_='primary')
+    op.create_primary_key('timeline_pkey', 'timeline', ['owner_id', 'timestamp', 'message_id'])
+
+    op.alter_column('messages', 'timestamp', server_default=None)
+    op.execute('DROP TRIGGER messages_assign_id ON messages')
+    op.execute('DROP FUNCTION messages_assign_id()')
+    op.execute('DROP FUNCTION message_id_at(timestamp)')
+
+    # Back to serial ids, in the new ids' (time) order; new ids are far
+    # above the row count, so again nothing collides.
+    renumber('SELECT id AS old_id, row_number() OVER (ORDER BY id) AS new_id FROM messages')
+    op.alter_column('messages', 'id', type_=sa.Integer())
+    op.alter_column('likes', 'message_id', type_=sa.Integer())
+    op.alter_column('timeline', 'message_id', type_=sa.Integer())
+    op.execute("SELECT setval('messages_id_seq', COALESCE(MAX(id), 0) + 1, false) FROM messages")
+    op.execute('ALTER SEQUENCE messages_id_seq AS integer OWNED BY messages.id')
+    op.alter_column('messages', 'id', server_default=sa.text("nextval('messages_id_seq'::regclass)"))
+
+    for name, table in MESSAGE_FOREIGN_KEYS:
+        op.create_foreign_key(name, table, 'messages', ['message_id'], ['id'],
+                              ondelete='cascade')
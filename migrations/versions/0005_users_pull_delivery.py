@@ -0,0 +1,35 @@
+"""Pull delivery for accounts with many followers
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 13:00:00.000000
+
+- users gains pull_delivery, false for everyone, so nothing changes
+  until `flask reclassify-timelines` runs under the hybrid timeline
+  engine.
+- A partial index on users (id) where pull_delivery, for the few
+  accounts that have it.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('pull_delivery', sa.Boolean(), nullable=False,
+                                     server_default=sa.false()))
+    op.create_index('ix_users_pull_delivery', 'users', ['id'],
+                    postgresql_where=sa.text('pull_delivery'))
+
+
+def downgrade():
+    # Pulled accounts' messages aren't in their followers' timelines; run
+    # `flask reclassify-timelines --push-all` first to put them back.
+    op.drop_index('ix_users_pull_delivery', 'users')
+    op.drop_column('users', 'pull_delivery')
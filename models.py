@@ -2,12 +2,48 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.dialects.postgresql import TSVECTOR
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+
+from passwords import hasher
+from snowflake import ids, EPOCH_MS, WORKER_BITS, SEQUENCE_BITS, MAX_SEQUENCE, DATABASE_WORKER
 
-bcrypt = Bcrypt()
 db = SQLAlchemy()
 
+# How many of a user's recent messages get copied into a new follower's
+# timeline; matches how many messages the home page shows.
+TIMELINE_BACKFILL = 100
+
+# Text search configuration used to index and query message text.
+SEARCH_CONFIG = 'english'
+
+# Message ids are 64-bit Snowflake ids (see snowflake.py). On SQLite an
+# INTEGER primary key is already 64 bits.
+MessageId = db.BigInteger().with_variant(db.Integer(), 'sqlite')
+
+
+class bytewise(FunctionElement):
+    """A string expression compared byte by byte: COLLATE "C" on
+    PostgreSQL. SQLite has no "C" collation, but compares bytewise
+    already."""
+
+    type = db.String()
+    name = 'bytewise'
+    inherit_cache = True
+
+
+@compiles(bytewise)
+def _compile_bytewise(element, compiler, **kw):
+    return compiler.process(element.clauses, **kw)
+
+
+@compiles(bytewise, 'postgresql')
+def _compile_bytewise_postgresql(element, compiler, **kw):
+    return f'{compiler.process(element.clauses, **kw)} COLLATE "C"'
+
 
 class Follows(db.Model):
     """Connection of a follower <-> followed_user."""
@@ -26,28 +62,311 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key finds a user's followers; this finds who they
+    # follow, without visiting the table.
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id', 'user_following_id', 'user_being_followed_id'),
+    )
 
-class Likes(db.Model):
-    """Mapping user likes to warbles."""
+    @classmethod
+    def exists(cls, follower_id, followed_id):
+        """Does `follower_id` follow `followed_id`? A primary key lookup."""
 
-    __tablename__ = 'likes' 
+        query = cls.query.filter_by(user_being_followed_id=followed_id,
+                                    user_following_id=follower_id)
+        return db.session.query(query.exists()).scalar()
 
-    id = db.Column(
+    @classmethod
+    def followed_among(cls, follower_id, user_ids):
+        """The subset of `user_ids` that `follower_id` follows."""
+
+        if not user_ids:
+            return set()
+
+        rows = (db.session
+                .query(cls.user_being_followed_id)
+                .filter(cls.user_following_id == follower_id,
+                        cls.user_being_followed_id.in_(user_ids)))
+        return {user_id for (user_id,) in rows}
+
+
+class TimelineEntry(db.Model):
+    """A message delivered to a user's home timeline.
+
+    The home page is materialized on write: whenever a message is posted
+    it's copied into the timeline of its author and of everyone following
+    the author, so reading the home page is one range scan over
+    (owner_id, message_id) instead of an IN over all followed users.
+    Message ids are time-ordered (see snowflake.py), so that's newest
+    first.
+    """
+
+    __tablename__ = 'timeline'
+
+    owner_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        MessageId,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
         db.Integer,
-        primary_key=True
+        db.ForeignKey('users.id', ondelete='cascade'),
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_message_id', 'message_id'),
+        db.Index('ix_timeline_owner_id_author_id', 'owner_id', 'author_id'),
     )
 
+    @classmethod
+    def messages_for(cls, owner_id):
+        """Query for the messages in `owner_id`'s timeline, newest first."""
+
+        return (Message
+                .with_authors()
+                .join(cls, cls.message_id == Message.id)
+                .filter(cls.owner_id == owner_id)
+                .order_by(cls.message_id.desc()))
+
+    @classmethod
+    def versions_for(cls, owner_id):
+        """Query (id, author version, like count) rows for
+        `owner_id`'s timeline, newest first.
+
+        Everything a rendered timeline page depends on besides the viewer,
+        without loading the messages; used to answer conditional GETs.
+        """
+
+        return (db.session
+                .query(cls.message_id.label('id'), User.version, Message.like_count)
+                .join(User, User.id == cls.author_id)
+                .join(Message, Message.id == cls.message_id)
+                .filter(cls.owner_id == owner_id)
+                .order_by(cls.message_id.desc()))
+
+    @classmethod
+    def deliver(cls, message):
+        """Copy `message` into the timelines of its author and followers.
+
+        The message must already be flushed so it has an id.
+        """
+
+        author = db.select([
+            db.literal(message.user_id),
+            db.literal(message.id),
+            db.literal(message.user_id),
+        ])
+        followers = db.select([
+            Follows.user_following_id,
+            db.literal(message.id),
+            db.literal(message.user_id),
+        ]).where(Follows.user_being_followed_id == message.user_id,
+                 # A self-follow would deliver it to the author twice.
+                 Follows.user_following_id != message.user_id)
+
+        db.session.execute(cls.__table__.insert().from_select(
+            ['owner_id', 'message_id', 'author_id'],
+            db.union_all(author, followers),
+        ))
+
+    @classmethod
+    def backfill(cls, owner_id, author_id, limit=TIMELINE_BACKFILL):
+        """Copy the `limit` newest messages of `author_id` into `owner_id`'s
+        timeline, e.g. right after `owner_id` follows them."""
+
+        if owner_id == author_id:
+            return
+
+        recent = (db.select([
+            db.literal(owner_id),
+            Message.id,
+            Message.user_id,
+        ])
+            .where(Message.user_id == author_id)
+            .order_by(Message.id.desc())
+            .limit(limit))
+
+        db.session.execute(cls.__table__.insert().from_select(
+            ['owner_id', 'message_id', 'author_id'],
+            recent,
+        ))
+
+    @classmethod
+    def retract(cls, owner_id, author_id):
+        """Remove everything `author_id` wrote from `owner_id`'s timeline."""
+
+        if owner_id == author_id:
+            return
+
+        (cls.query
+         .filter_by(owner_id=owner_id, author_id=author_id)
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def withdraw(cls, author_id):
+        """Remove everything `author_id` wrote from every timeline it was
+        delivered to: their followers' and their own."""
+
+        owners = (db.session
+                  .query(Follows.user_following_id)
+                  .filter(Follows.user_being_followed_id == author_id)
+                  .union(db.session.query(db.literal(author_id))))
+
+        (cls.query
+         .filter(cls.author_id == author_id, cls.owner_id.in_(owners))
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def redeliver(cls, author_id, limit=TIMELINE_BACKFILL):
+        """Copy the `limit` newest messages of `author_id` into their own
+        and their followers' timelines, skipping any already there."""
+
+        recent = (db.select([Message.id, Message.user_id])
+                  .where(Message.user_id == author_id)
+                  .order_by(Message.id.desc())
+                  .limit(limit)
+                  .alias())
+        owners = db.union(
+            db.select([Follows.user_following_id.label('owner_id')])
+            .where(Follows.user_being_followed_id == author_id),
+            db.select([db.literal(author_id).label('owner_id')]),
+        ).alias()
+
+        db.session.execute(
+            insert_ignoring_conflicts(cls.__table__)
+            .from_select(['owner_id', 'message_id', 'author_id'],
+                         db.select([owners.c.owner_id, recent.c.id, recent.c.user_id]))
+        )
+
+    @classmethod
+    def remove_message(cls, message_id):
+        """Remove a message from every timeline it was delivered to."""
+
+        cls.query.filter_by(message_id=message_id).delete(synchronize_session=False)
+
+    @classmethod
+    def remove_user(cls, user_id):
+        """Remove a user's own timeline and their messages from everyone
+        else's."""
+
+        (cls.query
+         .filter(db.or_(cls.owner_id == user_id, cls.author_id == user_id))
+         .delete(synchronize_session=False))
+
+    @classmethod
+    def rebuild(cls):
+        """Rebuild every timeline from the messages and follows tables.
+
+        Used after bulk loads (see seed.py) that bypass the routes.
+        """
+
+        cls.query.delete(synchronize_session=False)
+
+        own = db.select([
+            Message.user_id,
+            Message.id,
+            Message.user_id,
+        ])
+        followed = db.select([
+            Follows.user_following_id,
+            Message.id,
+            Message.user_id,
+        ]).where(Follows.user_being_followed_id == Message.user_id,
+                 Follows.user_following_id != Message.user_id)
+
+        db.session.execute(cls.__table__.insert().from_select(
+            ['owner_id', 'message_id', 'author_id'],
+            db.union_all(own, followed),
+        ))
+
+
+class Likes(db.Model):
+    """Mapping user likes to warbles: one row per user and message they
+    like, keyed by both."""
+
+    __tablename__ = 'likes' 
+
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
-        db.Integer,
+        MessageId,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
     )
 
+    __table_args__ = (
+        db.Index('ix_likes_message_id', 'message_id'),
+    )
+
+    @classmethod
+    def add(cls, user_id, message_id):
+        """Record that `user_id` likes `message_id`, and count it.
+
+        One INSERT ... ON CONFLICT DO NOTHING, so liking twice (or two
+        requests racing) leaves one row, and the counters only move for
+        the request that inserted it. Returns whether this was a new like.
+        """
+
+        added = db.session.execute(
+            insert_ignoring_conflicts(cls.__table__)
+            .values(user_id=user_id, message_id=message_id)
+        ).rowcount == 1
+
+        if added:
+            cls.count(user_id, message_id, 1)
+        return added
+
+    @classmethod
+    def remove(cls, user_id, message_id):
+        """Undo `add`; returns whether there was a like to remove."""
+
+        removed = db.session.execute(
+            cls.__table__.delete()
+            .where(cls.user_id == user_id)
+            .where(cls.message_id == message_id)
+        ).rowcount == 1
+
+        if removed:
+            cls.count(user_id, message_id, -1)
+        return removed
+
+    @classmethod
+    def count(cls, user_id, message_id, delta):
+        User.update_counts(user_id, likes_count=delta)
+        (Message.query
+         .filter(Message.id == message_id)
+         .update({Message.like_count: Message.like_count + delta},
+                 synchronize_session=False))
+
+    @classmethod
+    def liked_message_ids(cls, user_id, message_ids):
+        """Which of `message_ids` has `user_id` liked?
+
+        Returns a set, so a whole page of messages costs one query and
+        templates can check `msg.id in likes`.
+        """
+
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(cls.message_id)
+                .filter(cls.user_id == user_id,
+                        cls.message_id.in_(message_ids)))
+        return {message_id for (message_id,) in rows}
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,6 +413,58 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Denormalized counts shown on profiles and the home page. They're kept
+    # up to date by the routes that post, follow and like (see
+    # `update_counts`); `recount_all` rebuilds them from scratch.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped whenever the profile is edited, so anything cached from the
+    # old profile (like rendered messages showing the old avatar) misses.
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default='1',
+    )
+
+    # Under the hybrid timeline engine, whether this user's messages are
+    # merged into their followers' timelines on read instead of copied
+    # into them on write; set for accounts with many followers by
+    # timelines.reclassify.
+    pull_delivery = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default=db.false(),
+    )
+
     messages = db.relationship('Message', cascade="all, delete-orphan")
 
     followers = db.relationship(
@@ -115,19 +486,129 @@ class User(db.Model):
         secondary="likes"
     )
 
+    __table_args__ = (
+        # The few accounts with pull delivery, to find which of them a
+        # user follows.
+        db.Index('ix_users_pull_delivery', 'id',
+                 postgresql_where=db.text('pull_delivery')),
+    )
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return Follows.exists(other_user.id, self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+
+        return Follows.exists(self.id, other_user.id)
+
+    def following_ids(self, user_ids):
+        """Which of `user_ids` is this user following?
+
+        Returns a set, so a list page can look up the follow state of
+        every user it shows with one query.
+        """
+
+        return Follows.followed_among(self.id, user_ids)
+
+    @classmethod
+    def update_counts(cls, user_ids, **deltas):
+        """Add `deltas` to the counter columns of `user_ids` (one id or a
+        query/list of ids), e.g. `User.update_counts(5, followers_count=1)`.
+
+        Done as a single UPDATE ... SET col = col + delta, so concurrent
+        requests don't lose each other's increments.
+        """
+
+        if isinstance(user_ids, int):
+            criterion = cls.id == user_ids
+        else:
+            criterion = cls.id.in_(user_ids)
+
+        values = {getattr(cls, name): getattr(cls, name) + delta
+                  for name, delta in deltas.items()}
+        cls.query.filter(criterion).update(values, synchronize_session=False)
+
+    def release_counts(self):
+        """Take this user out of everyone else's counters; call this before
+        deleting the user."""
+
+        User.update_counts(
+            db.session.query(Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == self.id),
+            followers_count=-1)
+        User.update_counts(
+            db.session.query(Follows.user_following_id)
+            .filter(Follows.user_being_followed_id == self.id),
+            following_count=-1)
+        Message.release_likes(Message.user_id == self.id)
+        (Message.query
+         .filter(Message.id.in_(db.session.query(Likes.message_id)
+                                .filter(Likes.user_id == self.id)))
+         .update({Message.like_count: Message.like_count - 1},
+                 synchronize_session=False))
+
+    @classmethod
+    def recount_all(cls):
+        """Recompute every user's counters from the underlying tables.
+
+        Each table is grouped once and joined to users (UPDATE ... FROM),
+        rather than counted per user, so this stays linear in the size of
+        the data after bulk loads.
+        """
+
+        cls.query.update({
+            cls.messages_count: 0,
+            cls.following_count: 0,
+            cls.followers_count: 0,
+            cls.likes_count: 0,
+        }, synchronize_session=False)
+
+        for counter, user_id in [
+            (cls.messages_count, Message.user_id),
+            (cls.following_count, Follows.user_following_id),
+            (cls.followers_count, Follows.user_being_followed_id),
+            (cls.likes_count, Likes.user_id),
+        ]:
+            counts = (db.select([user_id.label('user_id'), db.func.count().label('n')])
+                      .group_by(user_id)
+                      .alias())
+            db.session.execute(cls.__table__.update()
+                               .where(cls.id == counts.c.user_id)
+                               .values({counter.key: counts.c.n}))
+
+    @classmethod
+    def search_key(cls):
+        """What user search matches and sorts on: the lowercased username,
+        byte-ordered so that a prefix LIKE can use a plain btree index."""
+
+        return bytewise(db.func.lower(cls.username))
+
+    @classmethod
+    def search(cls, term=None, after=None):
+        """Query users whose username starts with `term` (ignoring case),
+        in username order, beginning after the user with id `after`.
+
+        Both the prefix match and the "after" cursor are range scans on
+        ix_users_username_search, so callers should just add a LIMIT.
+        """
+
+        key = cls.search_key()
+        query = cls.query.order_by(key, cls.id)
+
+        if term:
+            query = query.filter(key.like(f"{escape_like(term.lower())}%", escape='\\'))
+
+        if after is not None:
+            anchor = db.session.query(key, cls.id).filter(cls.id == after).first()
+            if anchor:
+                query = query.filter(db.tuple_(key, cls.id) > db.tuple_(*anchor))
+
+        return query
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -136,7 +617,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -157,26 +638,94 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the user's hash was made with an old work factor it's replaced
+        with one at the current factor; the caller should commit.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
 
 
+db.Index('ix_users_username_search', User.search_key(), User.id)
+
+
+class UserProfile:
+    """The lightweight part of a User that most pages need: identity,
+    avatar and counters.
+
+    Plain data, so it can be cached between requests (see
+    `add_user_to_g` in app.py). Anything else, e.g. `.following` or
+    `.bio`, loads the full User row the first time it's used.
+    """
+
+    FIELDS = (
+        'id',
+        'username',
+        'image_url',
+        'header_image_url',
+        'messages_count',
+        'following_count',
+        'followers_count',
+        'likes_count',
+    )
+
+    def __init__(self, fields, model=None):
+        self.__dict__.update(fields)
+        self._model = model
+
+    def __repr__(self):
+        return f"<UserProfile #{self.id}: {self.username}>"
+
+    def __getattr__(self, name):
+        return getattr(self.model, name)
+
+    @classmethod
+    def fields_of(cls, user):
+        """The cacheable fields of `user`, as a dict."""
+
+        return {name: getattr(user, name) for name in cls.FIELDS}
+
+    @property
+    def model(self):
+        """The full User row, loaded on first use."""
+
+        if self._model is None:
+            self._model = User.query.get(self.id)
+        return self._model
+
+    def is_following(self, other_user):
+        """Is this user following `other_user`?"""
+
+        return Follows.exists(self.id, other_user.id)
+
+    def following_ids(self, user_ids):
+        """Which of `user_ids` is this user following?"""
+
+        return Follows.followed_among(self.id, user_ids)
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
 
+    # Time-ordered, so the newest messages have the highest ids; made in
+    # Python without a round trip (see `new_id`). Rows inserted without
+    # one get theirs from a trigger (see below).
     id = db.Column(
-        db.Integer,
+        MessageId,
         primary_key=True,
+        autoincrement=False,
+        default=lambda context: Message.new_id(context.get_current_parameters()),
     )
 
     text = db.Column(
@@ -187,7 +736,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -196,8 +745,178 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # How many users like this message, kept up to date by Likes.add and
+    # Likes.remove so lists can show it without counting.
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Full-text index of `text`. On PostgreSQL a trigger fills this in on
+    # every insert/update (see below), so it never needs setting by hand;
+    # elsewhere it stays NULL and search falls back to LIKE.
+    search_vector = db.deferred(db.Column(
+        TSVECTOR().with_variant(db.Text(), 'sqlite'),
+    ))
+
     user = db.relationship('User')
 
+    __table_args__ = (
+        db.Index('ix_messages_search_vector', 'search_vector',
+                 postgresql_using='gin'),
+        # A user's messages newest first, paged by id.
+        db.Index('ix_messages_user_id_id', 'user_id', 'id'),
+    )
+
+    @staticmethod
+    def new_id(values):
+        """The id for a new message with these column `values`: one for
+        now, or for its timestamp if it was given one, so ids and
+        timestamps sort the same way."""
+
+        timestamp = values.get('timestamp')
+        return ids.id_at(timestamp) if timestamp else ids.next_id()
+
+    @classmethod
+    def release_likes(cls, criterion):
+        """Decrement the likes_count of everyone who liked a message
+        matching `criterion`; call this before deleting those messages."""
+
+        liked = (db.select([db.func.count()])
+                 .select_from(Likes.__table__.join(cls.__table__))
+                 .where(Likes.user_id == User.id)
+                 .where(criterion)
+                 .as_scalar())
+        likers = (db.session.query(Likes.user_id)
+                  .join(cls, cls.id == Likes.message_id)
+                  .filter(criterion))
+
+        (User.query
+         .filter(User.id.in_(likers))
+         .update({User.likes_count: User.likes_count - liked},
+                 synchronize_session=False))
+
+    @classmethod
+    def recount_likes(cls):
+        """Recompute every message's like_count from the likes table."""
+
+        cls.query.update({cls.like_count: 0}, synchronize_session=False)
+
+        counts = (db.select([Likes.message_id, db.func.count().label('n')])
+                  .group_by(Likes.message_id)
+                  .alias())
+        db.session.execute(cls.__table__.update()
+                           .where(cls.id == counts.c.message_id)
+                           .values(like_count=counts.c.n))
+
+    @classmethod
+    def search(cls, terms):
+        """Query messages matching the words in `terms`, with authors.
+
+        Returns (query, rank): `rank` is a relevance expression callers
+        can order by; it's None when the database has no full-text index.
+        """
+
+        query = cls.with_authors()
+
+        if db.engine.dialect.name != 'postgresql':
+            pattern = f"%{escape_like(terms)}%"
+            return query.filter(cls.text.ilike(pattern, escape='\\')), None
+
+        tsquery = db.func.plainto_tsquery(SEARCH_CONFIG, terms)
+        rank = db.func.ts_rank(cls.search_vector, tsquery)
+        return query.filter(cls.search_vector.op('@@')(tsquery)), rank
+
+    @classmethod
+    def with_authors(cls):
+        """Query messages along with the author columns a message list
+        renders (id, username, avatar and version), fetched in the same
+        statement.
+
+        Saves a lazy load of `msg.user` per row on timelines.
+        """
+
+        return (cls.query
+                .join(cls.user)
+                .options(db.contains_eager(cls.user)
+                         .load_only('id', 'username', 'image_url', 'version')))
+
+
+
+# Numbers the sequence bits of ids the database assigns.
+message_id_sequence = db.Sequence('messages_id_seq', metadata=db.metadata)
+
+# The same ids as snowflake.py makes, for rows inserted without an id
+# (COPY in seed.py, hand-written SQL), under the worker id set aside for
+# the database; and those rows' timestamps default to now.
+db.event.listen(
+    Message.__table__,
+    'after_create',
+    db.DDL(f"""
+        CREATE OR REPLACE FUNCTION message_id_at(created timestamp) RETURNS bigint
+        LANGUAGE sql VOLATILE AS $$
+            SELECT ((floor(extract(epoch FROM created) * 1000)::bigint - {EPOCH_MS})
+                    << {WORKER_BITS + SEQUENCE_BITS})
+                   | ({DATABASE_WORKER} << {SEQUENCE_BITS})
+                   | (nextval('messages_id_seq') & {MAX_SEQUENCE})
+        $$;
+
+        CREATE OR REPLACE FUNCTION messages_assign_id() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            created timestamp := NEW."timestamp";
+        BEGIN
+            IF NEW.id IS NULL THEN
+                -- The sequence bits wrap every {MAX_SEQUENCE + 1} ids, so more
+                -- than that in one millisecond repeat; move on to the next
+                -- millisecond until the id is free.
+                LOOP
+                    NEW.id := message_id_at(created);
+                    EXIT WHEN NOT EXISTS (SELECT 1 FROM messages WHERE id = NEW.id);
+                    created := created + interval '1 millisecond';
+                END LOOP;
+            END IF;
+            RETURN NEW;
+        END
+        $$;
+
+        ALTER TABLE messages ALTER COLUMN "timestamp" SET DEFAULT timezone('utc', now());
+
+        CREATE TRIGGER messages_assign_id
+        BEFORE INSERT ON messages
+        FOR EACH ROW EXECUTE PROCEDURE messages_assign_id();
+    """).execute_if(dialect='postgresql'),
+)
+
+db.event.listen(
+    Message.__table__,
+    'after_create',
+    db.DDL(f"""
+        CREATE TRIGGER messages_search_vector_update
+        BEFORE INSERT OR UPDATE OF text ON messages
+        FOR EACH ROW EXECUTE PROCEDURE
+        tsvector_update_trigger(search_vector, 'pg_catalog.{SEARCH_CONFIG}', text)
+    """).execute_if(dialect='postgresql'),
+)
+
+
+def insert_ignoring_conflicts(table):
+    """An INSERT into `table` that skips rows clashing with a unique key
+    (ON CONFLICT DO NOTHING), on PostgreSQL or SQLite."""
+
+    dialect = sqlite if db.engine.dialect.name == 'sqlite' else postgresql
+    return dialect.insert(table).on_conflict_do_nothing()
+
+
+def escape_like(text):
+    """Escape LIKE wildcards in user input."""
+
+    return (text
+            .replace('\\', '\\\\')
+            .replace('%', '\\%')
+            .replace('_', '\\_'))
 
 
 def connect_db(app):
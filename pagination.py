@@ -0,0 +1,107 @@
+"""Keyset (cursor) pagination for message feeds.
+
+Pages are addressed by the id of the message at their edge rather than by
+an OFFSET, so fetching the 500th page costs the same index range scan as
+fetching the first. Message ids are time-ordered (see snowflake.py), so
+the id alone orders a feed newest first.
+"""
+
+from collections import namedtuple
+
+from flask import request, url_for
+
+MESSAGES_PER_PAGE = 100
+USERS_PER_PAGE = 48
+TYPEAHEAD_LIMIT = 10
+
+Page = namedtuple('Page', ['items', 'older', 'newer'])
+
+
+def encode_cursor(id):
+    """Turn a message's id into a URL-safe cursor string."""
+
+    return str(id)
+
+
+def decode_cursor(cursor):
+    """Parse a cursor made by `encode_cursor`.
+
+    Returns None for a missing or malformed cursor (including the
+    (timestamp, id) cursors pages used to have), which callers treat as
+    "start from the newest message".
+    """
+
+    if not cursor:
+        return None
+
+    try:
+        return int(cursor)
+    except ValueError:
+        return None
+
+
+def page_url(**cursor):
+    """The current page's URL with another cursor, e.g.
+    `page_url(older=page.older)`; its other query arguments (a search
+    term, a sort) are kept."""
+
+    args = request.args.to_dict(flat=False)
+    args.pop('older', None)
+    args.pop('newer', None)
+    args.update(cursor)
+    return url_for(request.endpoint, **(request.view_args or {}), **args)
+
+
+def empty_page(older_than=None, newer_than=None):
+    """A page past one end of a feed, reached with a stale or made-up
+    cursor. It still links back, to the page on the cursor's other side."""
+
+    if older_than is not None:
+        return Page([], None, encode_cursor(older_than - 1))
+    if newer_than is not None:
+        return Page([], encode_cursor(newer_than + 1), None)
+    return Page([], None, None)
+
+
+def paginate(query, id_col, older=None, newer=None, per_page=MESSAGES_PER_PAGE):
+    """Fetch one page of messages from `query`, newest first.
+
+    `older` and `newer` are cursors from a previous page; pass at most one.
+    The query's own ordering is replaced by `id_col`, which should be
+    backed by an index.
+    """
+
+    query = query.order_by(None)
+    newer_than = decode_cursor(newer)
+    older_than = decode_cursor(older)
+
+    if newer_than is not None:
+        items = (query
+                 .filter(id_col > newer_than)
+                 .order_by(id_col.asc())
+                 .limit(per_page + 1)
+                 .all())
+        has_newer = len(items) > per_page
+        items = items[:per_page][::-1]
+        has_older = True
+
+    else:
+        if older_than is not None:
+            query = query.filter(id_col < older_than)
+
+        items = (query
+                 .order_by(id_col.desc())
+                 .limit(per_page + 1)
+                 .all())
+        has_older = len(items) > per_page
+        items = items[:per_page]
+        has_newer = older_than is not None
+
+    if not items:
+        return empty_page(older_than, newer_than)
+
+    return Page(
+        items,
+        encode_cursor(items[-1].id) if has_older else None,
+        encode_cursor(items[0].id) if has_newer else None,
+    )
@@ -0,0 +1,140 @@
+"""Password hashing for Warbler.
+
+bcrypt is slow on purpose, and each hash ties up a CPU core for the whole
+time it runs. Hashes and checks go through a small, bounded thread pool,
+which bcrypt can run in parallel because it releases the GIL, so a burst
+of logins can't oversubscribe the CPU and starve every other request.
+
+The request thread still blocks while its hash waits and runs. To shed
+load rather than pile up blocked threads, a hash is refused outright
+(`HasherBusy`) when BCRYPT_MAX_QUEUE are already waiting for a worker.
+A hash that times out keeps its worker until bcrypt returns (it can't
+be interrupted), and counts as queued until then.
+
+Settings (read by `init_app`):
+
+- BCRYPT_LOG_ROUNDS: work factor for new hashes (default 12). Passwords
+  hashed at a different cost are rehashed the next time they're checked
+  successfully (see `User.authenticate`).
+- BCRYPT_WORKERS: how many hashes can run at once (default: CPU count).
+- BCRYPT_MAX_QUEUE: how many hashes can wait for a worker before more
+  are refused with `HasherBusy` (default: 4 per worker).
+- BCRYPT_TIMEOUT: seconds to wait for a hash, queueing included, before
+  giving up with `HasherBusy` (default: wait forever).
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from threading import Lock
+
+from flask_bcrypt import Bcrypt
+
+DEFAULT_LOG_ROUNDS = 12
+
+# Default BCRYPT_MAX_QUEUE, per worker.
+QUEUE_PER_WORKER = 4
+
+
+class HasherBusy(Exception):
+    """Too many hashes were queued already, or every hashing worker stayed
+    busy for longer than BCRYPT_TIMEOUT."""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded pool of worker threads."""
+
+    def __init__(self, rounds=DEFAULT_LOG_ROUNDS, workers=None, timeout=None, max_queue=None):
+        self.bcrypt = Bcrypt()
+        self.pending = 0
+        self._lock = Lock()
+        # Called as on_timing('hash' or 'check', seconds queued, seconds
+        # hashing) after each operation; seconds hashing is None if it
+        # gave up with HasherBusy. See metrics.py.
+        self.on_timing = None
+        self.configure(rounds, workers, timeout, max_queue)
+
+    def init_app(self, app):
+        """Configure from the app's BCRYPT_* settings."""
+
+        self.configure(
+            rounds=app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_LOG_ROUNDS),
+            workers=app.config.get('BCRYPT_WORKERS'),
+            timeout=app.config.get('BCRYPT_TIMEOUT'),
+            max_queue=app.config.get('BCRYPT_MAX_QUEUE'),
+        )
+
+    def configure(self, rounds, workers=None, timeout=None, max_queue=None):
+        """Set the work factor, pool size, queue limit and wait timeout."""
+
+        if getattr(self, '_executor', None):
+            self._executor.shutdown(wait=False)
+
+        self.rounds = rounds
+        self.workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_queue = QUEUE_PER_WORKER * self.workers if max_queue is None else max_queue
+        self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix='bcrypt')
+
+    def _run(self, operation, fn, *args):
+        submitted = time.perf_counter()
+        times = []
+
+        def timed():
+            times.append(time.perf_counter())
+            try:
+                return fn(*args)
+            finally:
+                times.append(time.perf_counter())
+
+        with self._lock:
+            if self.pending >= self.workers + self.max_queue:
+                self._report(operation, 0, None)
+                raise HasherBusy()
+            self.pending += 1
+
+        future = self._executor.submit(timed)
+        future.add_done_callback(self._finished)
+        try:
+            result = future.result(timeout=self.timeout)
+        except TimeoutError:
+            future.cancel()
+            self._report(operation, time.perf_counter() - submitted, None)
+            raise HasherBusy()
+
+        self._report(operation, times[0] - submitted, times[1] - times[0])
+        return result
+
+    def _finished(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def _report(self, operation, waited, ran):
+        if self.on_timing is not None:
+            self.on_timing(operation, waited, ran)
+
+    def hash(self, password):
+        """Hash `password` at the configured work factor."""
+
+        return self._run('hash', self.bcrypt.generate_password_hash,
+                         password, self.rounds).decode('UTF-8')
+
+    def check(self, pw_hash, password):
+        """Does `password` match `pw_hash`?"""
+
+        return self._run('check', self.bcrypt.check_password_hash, pw_hash, password)
+
+    def needs_rehash(self, pw_hash):
+        """Was `pw_hash` made with a different work factor than we use now?
+
+        bcrypt hashes look like $2b$12$..., where 12 is the cost.
+        """
+
+        try:
+            return int(pw_hash.split('$')[2]) != self.rounds
+        except (IndexError, ValueError):
+            return True
+
+
+hasher = PasswordHasher()
@@ -1,20 +1,66 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
 
-from csv import DictReader
-from app import db
-from models import User, Message, Follows
+    python seed.py                                   # the sample data in generator/
+    python seed.py --dir /data/staging --chunk-rows 200000
 
+Drops and recreates every table first, then loads everything in one
+transaction. See loader.py for how the CSVs are loaded. The new schema is
+stamped as up to date with the migrations.
+"""
 
-db.drop_all()
-db.create_all()
+import argparse
+import os
+import time
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+from flask_migrate import stamp
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+from app import app, db
+from loader import Loader, CHUNK_ROWS
+from models import User, Message, Follows, TimelineEntry
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
 
-db.session.commit()
+def seed(directory, chunk_rows=CHUNK_ROWS, timelines=True):
+    """Reset the database and load the CSVs in `directory`.
+
+    With `timelines=False` home timelines are left empty; fanning out
+    every message to every follower can be far bigger than the data.
+    """
+
+    db.drop_all()
+    db.create_all()
+
+    loader = Loader(db.session.connection(), chunk_rows=chunk_rows)
+
+    with loader.indexes_dropped(['users', 'messages', 'follows', 'timeline']):
+        loader.load([
+            (User.__table__, os.path.join(directory, 'users.csv')),
+            (Message.__table__, os.path.join(directory, 'messages.csv')),
+            (Follows.__table__, os.path.join(directory, 'follows.csv')),
+        ])
+
+        started = time.perf_counter()
+        if timelines:
+            TimelineEntry.rebuild()
+        User.recount_all()
+        print(f"built timelines and counters in {time.perf_counter() - started:.1f}s")
+
+    db.session.commit()
+    stamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reset the database and load CSV data into it.")
+    parser.add_argument('--dir', default='generator',
+                        help="folder with users.csv, messages.csv and follows.csv")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS,
+                        help="rows sent to the database at a time")
+    parser.add_argument('--no-timelines', action='store_true',
+                        help="don't build home timelines (for huge datasets)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        seed(args.dir, args.chunk_rows, timelines=not args.no_timelines)
+
+
+if __name__ == '__main__':
+    main()
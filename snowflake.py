@@ -0,0 +1,204 @@
+"""Time-ordered 64-bit ids ("Snowflake" ids) for messages.
+
+An id is made, from the high bits down, of:
+
+- 41 bits: milliseconds since EPOCH (good until 2079),
+- 10 bits: the worker (process) that made it,
+- 12 bits: a sequence number within that millisecond.
+
+So ids sort by creation time, and each process can make up to 4096 a
+millisecond without asking the database for anything. Ordering or paging
+by id is ordering by time, which is why timelines and cursors use the id
+alone.
+
+Worker ids must be unique among the processes writing at the same time.
+Unless SNOWFLAKE_WORKER_ID is set (read by `init_app`), each process
+claims the lowest id no other process holds with a PostgreSQL advisory
+lock, so processes on every host sharing the database get different ids.
+DATABASE_WORKER is kept for the ids PostgreSQL assigns to rows inserted
+without one (bulk loads, hand-written SQL; see models.py).
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import NullPool
+
+EPOCH = datetime(2010, 1, 1)
+# EPOCH in milliseconds since the Unix epoch.
+EPOCH_MS = (EPOCH - datetime(1970, 1, 1)) // timedelta(milliseconds=1)
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+DATABASE_WORKER = MAX_WORKER
+
+# Worker ids are claimed with PostgreSQL's two-key advisory locks: this,
+# and the worker id.
+WORKER_LOCK_SPACE = 0x736e6f77
+
+
+def millis(timestamp):
+    """Milliseconds from EPOCH to `timestamp` (a naive UTC datetime)."""
+
+    return (timestamp - EPOCH) // timedelta(milliseconds=1)
+
+
+def timestamp_of(id):
+    """When `id` was made, to the millisecond."""
+
+    return EPOCH + timedelta(milliseconds=id >> (WORKER_BITS + SEQUENCE_BITS))
+
+
+def compose(ms, worker_id, sequence):
+    return (ms << (WORKER_BITS + SEQUENCE_BITS)) | (worker_id << SEQUENCE_BITS) | sequence
+
+
+def claim_worker_id(url):
+    """Claim the lowest worker id no other process holds, by taking an
+    advisory lock on it in the PostgreSQL database at `url`.
+
+    Returns the id and the connection holding the lock. The id is free
+    again once the connection closes, as it does when the process exits;
+    restart the app along with the database, which drops it too.
+    """
+
+    # Its own connection, outside the app's pool, and not left idle in a
+    # transaction for the life of the process.
+    engine = create_engine(url, poolclass=NullPool, isolation_level='AUTOCOMMIT')
+    connection = engine.connect()
+    worker_id = connection.execute(text("""
+        SELECT worker FROM generate_series(0, :last) AS worker
+        WHERE pg_try_advisory_lock(:space, worker)
+        LIMIT 1
+    """), {'last': DATABASE_WORKER - 1, 'space': WORKER_LOCK_SPACE}).scalar()
+
+    if worker_id is None:
+        connection.close()
+        raise RuntimeError(f"all {DATABASE_WORKER} worker ids are taken")
+
+    return worker_id, connection
+
+
+class SnowflakeIds:
+    """Makes unique, increasing ids for one process at a time."""
+
+    def __init__(self, worker_id=None, clock=time.time, claim=None):
+        self.clock = clock
+        self._lock = threading.Lock()
+        # Claims by pid. A forked child keeps its parent's connection
+        # without closing it, which would release the parent's id.
+        self._claims = {}
+        self.configure(worker_id, claim)
+
+    def init_app(self, app):
+        """Configure from the app's SNOWFLAKE_WORKER_ID setting, or else
+        claim worker ids from the app's database."""
+
+        worker_id = app.config.get('SNOWFLAKE_WORKER_ID')
+        if worker_id is not None:
+            self.configure(worker_id)
+            return
+
+        url = app.config['SQLALCHEMY_DATABASE_URI']
+        if make_url(url).get_backend_name() != 'postgresql':
+            raise RuntimeError("set SNOWFLAKE_WORKER_ID: worker ids can only "
+                               "be claimed from PostgreSQL")
+        self.configure(claim=lambda: claim_worker_id(url))
+
+    def configure(self, worker_id=None, claim=None):
+        """Use `worker_id`, or else call `claim` in each process for a
+        worker id and the connection holding it (see `claim_worker_id`).
+        With neither, making an id raises RuntimeError."""
+
+        if worker_id is not None and not 0 <= worker_id < DATABASE_WORKER:
+            raise ValueError(f"worker id must be from 0 to {DATABASE_WORKER - 1}")
+
+        with self._lock:
+            held = self._claims.pop(os.getpid(), None)
+            if held is not None:
+                held.close()
+
+            self._configured = worker_id
+            self._claim = claim
+            self._pid = None
+
+    @property
+    def worker_id(self):
+        with self._lock:
+            self._check_fork()
+            return self._worker_id
+
+    def next_id(self):
+        """A new id, greater than every id this process made before."""
+
+        with self._lock:
+            self._check_fork()
+            # If the clock steps back, carry on from the last millisecond
+            # used rather than risk repeating an id.
+            return self._next(max(self._now(), self._last))
+
+    def id_at(self, timestamp):
+        """An id that sorts at `timestamp` instead of now, for rows that
+        carry their own time (imports, tests).
+
+        Ids for times before the last one this process used come from a
+        separate counter, so they're unique unless the process makes more
+        than 4096 of them, or makes one for a millisecond it already made
+        ids in.
+        """
+
+        ms = millis(timestamp)
+
+        with self._lock:
+            self._check_fork()
+            if ms >= self._last:
+                return self._next(ms)
+
+            self._backdated = (self._backdated + 1) & MAX_SEQUENCE
+            return compose(ms, self._worker_id, self._backdated)
+
+    def _next(self, ms):
+        if ms == self._last:
+            self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+            if self._sequence == 0:
+                # 4096 ids this millisecond: borrow the next one. The
+                # clock catches up, as when it steps back.
+                ms += 1
+        else:
+            self._sequence = 0
+
+        self._last = ms
+        return compose(ms, self._worker_id, self._sequence)
+
+    def _check_fork(self):
+        """Start afresh in a new process (e.g. a forked server worker),
+        which must not reuse the parent's claimed worker id."""
+
+        pid = os.getpid()
+        if pid == self._pid:
+            return
+
+        if self._configured is not None:
+            self._worker_id = self._configured
+        elif self._claim is not None:
+            self._worker_id, self._claims[pid] = self._claim()
+        else:
+            raise RuntimeError("no worker id: set SNOWFLAKE_WORKER_ID or call init_app")
+
+        self._pid = pid
+        self._last = -1
+        self._sequence = 0
+        self._backdated = 0
+
+    def _now(self):
+        return int(self.clock() * 1000) - EPOCH_MS
+
+
+ids = SnowflakeIds()
@@ -0,0 +1,109 @@
+"""Static asset build tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_assets.py
+
+
+import gzip
+import os
+import tempfile
+from unittest import TestCase
+
+from flask import Flask
+
+from assets import Assets
+
+
+class AssetsTestCase(TestCase):
+    """Test fingerprinting, compressing and serving static files."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        static = self.tmp.name
+        os.makedirs(os.path.join(static, 'images'))
+        os.makedirs(os.path.join(static, 'stylesheets'))
+
+        with open(os.path.join(static, 'images', 'bg.png'), 'wb') as f:
+            f.write(b'\x89PNG not really')
+        with open(os.path.join(static, 'images', 'bg.png:Zone.Identifier'), 'w') as f:
+            f.write('[ZoneTransfer]')
+        with open(os.path.join(static, 'stylesheets', 'style.css'), 'w') as f:
+            f.write('body { background: url("/static/images/bg.png"); }\n' * 50)
+
+        self.app = Flask(__name__, static_folder=static, static_url_path='/static')
+        self.assets = Assets()
+        self.assets.init_app(self.app)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_unbuilt(self):
+        """falls back to the static route before a build"""
+
+        with self.app.test_request_context():
+            self.assertEqual(self.assets.url('stylesheets/style.css'),
+                             '/static/stylesheets/style.css')
+            self.assertEqual(self.assets.url('https://example.com/me.png'),
+                             'https://example.com/me.png')
+
+    def test_build(self):
+        """fingerprints files and rewrites stylesheet URLs"""
+
+        manifest = self.assets.build()
+
+        self.assertEqual(set(manifest), {'images/bg.png', 'stylesheets/style.css'})
+        self.assertEqual(manifest['images/bg.png']['encodings'], {})
+        self.assertIn('gzip', manifest['stylesheets/style.css']['encodings'])
+
+        image = manifest['images/bg.png']['file']
+        self.assertRegex(image, r'^images/bg\.[0-9a-f]{12}\.png$')
+
+        css = os.path.join(self.assets.build_folder, manifest['stylesheets/style.css']['file'])
+        with open(css) as f:
+            self.assertIn(f'url("/assets/{image}")', f.read())
+
+        with self.app.test_request_context():
+            self.assertEqual(self.assets.url('/static/images/bg.png'), f'/assets/{image}')
+
+    def test_serve(self):
+        """serves the smallest accepted encoding"""
+
+        manifest = self.assets.build()
+        url = f"/assets/{manifest['stylesheets/style.css']['file']}"
+
+        with self.app.test_client() as client:
+            resp = client.get(url, headers={'Accept-Encoding': 'gzip'})
+            self.assertEqual(resp.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(resp.mimetype, 'text/css')
+            self.assertIn('Accept-Encoding', resp.headers['Vary'])
+            self.assertIn(b'background', gzip.decompress(resp.get_data()))
+
+            resp = client.get(url, headers={'Accept-Encoding': 'identity'})
+            self.assertNotIn('Content-Encoding', resp.headers)
+            self.assertIn(b'background', resp.get_data())
+
+    def test_rebuild_keeps_superseded(self):
+        """a rebuild keeps the previous build's files for a while"""
+
+        css = os.path.join(self.app.static_folder, 'stylesheets', 'style.css')
+        old = self.assets.build()['stylesheets/style.css']['file']
+
+        with open(css, 'a') as f:
+            f.write('p { color: red; }\n')
+        new = self.assets.build(keep=0)['stylesheets/style.css']['file']
+        self.assertNotEqual(old, new)
+
+        with self.app.test_client() as client:
+            self.assertEqual(client.get(f'/assets/{old}').status_code, 200)
+            self.assertEqual(client.get('/assets/manifest.json').status_code, 404)
+
+        # One more build, and the file two builds back has been unused
+        # for longer than `keep`.
+        with open(css, 'a') as f:
+            f.write('p { color: blue; }\n')
+        self.assets.build(keep=0)
+
+        self.assertFalse(os.path.exists(os.path.join(self.assets.build_folder, old)))
+        self.assertFalse(os.path.exists(os.path.join(self.assets.build_folder, old + '.gz')))
+        self.assertTrue(os.path.exists(os.path.join(self.assets.build_folder, new)))
@@ -0,0 +1,36 @@
+"""Bloom filter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_bloom.py
+
+
+from unittest import TestCase
+
+from bloom import BloomFilter
+
+
+class BloomFilterTestCase(TestCase):
+    """Test the Bloom filter."""
+
+    def test_membership(self):
+        """added items are always found"""
+
+        bloom = BloomFilter(capacity=1000)
+        names = [f"user{i}" for i in range(1000)]
+        for name in names:
+            bloom.add(name)
+
+        self.assertTrue(all(name in bloom for name in names))
+        self.assertEqual(len(bloom), 1000)
+        self.assertFalse(bloom.is_full)
+
+    def test_false_positive_rate(self):
+        """unseen items are rarely reported present"""
+
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"user{i}")
+
+        false_positives = sum(f"other{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
@@ -0,0 +1,88 @@
+"""Cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_caching.py
+
+
+from unittest import TestCase
+from unittest.mock import patch
+
+from caching import LRUCache
+
+
+class LRUCacheTestCase(TestCase):
+    """Test the in-process LRU cache."""
+
+    def test_get_set(self):
+        """stores values and counts hits and misses"""
+
+        cache = LRUCache(maxsize=2)
+
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+
+        self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1, 'size': 1, 'maxsize': 2})
+
+    def test_eviction(self):
+        """evicts the least recently used entry when full"""
+
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_ttl(self):
+        """entries older than the ttl are misses"""
+
+        cache = LRUCache(ttl=10)
+
+        with patch('caching.time.monotonic', return_value=100):
+            cache.set('a', 1)
+
+        with patch('caching.time.monotonic', return_value=105):
+            self.assertEqual(cache.get('a'), 1)
+
+        with patch('caching.time.monotonic', return_value=111):
+            self.assertIsNone(cache.get('a'))
+
+        self.assertEqual(len(cache), 0)
+
+    def test_delete(self):
+        """delete and clear drop entries"""
+
+        cache = LRUCache()
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        cache.delete('a')
+        cache.delete('missing')
+        self.assertIsNone(cache.get('a'))
+
+        cache.clear()
+        self.assertIsNone(cache.get('b'))
+
+    def test_weigh(self):
+        """with weigh, maxsize bounds the entries' total weight"""
+
+        cache = LRUCache(maxsize=5, weigh=len)
+        cache.set('a', [1, 2])
+        cache.set('b', [3, 4, 5])
+        self.assertEqual(cache.weight, 5)
+
+        cache.set('a', [1, 2, 3])
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.weight, 3)
+
+        cache.set('c', [])
+        self.assertEqual(cache.weight, 4)
+
+        cache.delete('a')
+        self.assertEqual((len(cache), cache.weight), (1, 1))
@@ -0,0 +1,84 @@
+"""Fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+import os
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from caching import LRUCache
+from fragments import FragmentCache
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test caching of rendered message list items."""
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+
+        self.fragments = FragmentCache(LRUCache())
+        self.fragments.env = app.jinja_env
+
+        self.author = SimpleNamespace(id=1, username='author', version=1,
+                                      image_url='/static/images/default-pic.png')
+        self.msg = SimpleNamespace(id=7, text='hello <world>', user=self.author,
+                                   timestamp=datetime(2020, 1, 2))
+
+    def tearDown(self):
+        self.context.pop()
+
+    def test_renders_and_escapes(self):
+        """renders the item, escaping the message text"""
+
+        html = self.fragments.message_item(self.msg)
+
+        self.assertIn('href="/messages/7" class="message-link">Detail</a>', html)
+        self.assertIn('@author', html)
+        self.assertIn('hello &lt;world&gt;', html)
+        self.assertIn('02 January 2020', html)
+
+    def test_reuses_render(self):
+        """renders each message once per link text"""
+
+        first = self.fragments.message_item(self.msg)
+        self.msg.text = 'changed'
+
+        self.assertEqual(self.fragments.message_item(self.msg), first)
+        self.assertIn('>More</a>', self.fragments.message_item(self.msg, 'More'))
+        self.assertEqual(len(self.fragments.storage), 1)
+
+    def test_author_version(self):
+        """a new author version renders afresh"""
+
+        self.fragments.message_item(self.msg)
+        self.author.username = 'renamed'
+        self.author.version = 2
+
+        self.assertIn('@renamed', self.fragments.message_item(self.msg))
+
+    def test_forget(self):
+        """forgetting a message drops its cached render"""
+
+        self.fragments.message_item(self.msg)
+        self.fragments.forget(self.msg)
+
+        self.assertEqual(len(self.fragments.storage), 0)
+
+    def test_no_storage(self):
+        """renders every time without storage"""
+
+        fragments = FragmentCache()
+        fragments.env = app.jinja_env
+
+        fragments.message_item(self.msg)
+        self.msg.text = 'changed'
+
+        self.assertIn('<p>changed</p>', fragments.message_item(self.msg))
@@ -0,0 +1,97 @@
+"""Request instrumentation tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_instrumentation.py
+
+
+import json
+import os
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+from instrumentation import loggable, PARAM_LENGTH
+from models import db, User
+
+db.create_all()
+
+
+class InstrumentationTestCase(TestCase):
+    """Test Server-Timing headers and the slow-request log."""
+
+    def setUp(self):
+        User.query.delete()
+        User.signup(username='timed', email='timed@test.com',
+                    password='HASHED_PASSWORD', image_url='')
+        db.session.commit()
+
+        self.config = dict(app.config)
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config.clear()
+        app.config.update(self.config)
+
+    def test_server_timing(self):
+        """reports query count and timings when SERVER_TIMING is on"""
+
+        app.config['SERVER_TIMING'] = True
+        resp = self.client.get('/users')
+
+        timing = resp.headers['Server-Timing']
+        self.assertRegex(timing, r'^db;dur=[\d.]+;desc="[1-9]\d* queries", '
+                                 r'tpl;dur=[\d.]+, total;dur=[\d.]+$')
+
+        app.config['SERVER_TIMING'] = False
+        self.assertNotIn('Server-Timing', self.client.get('/users').headers)
+
+    def test_slow_log(self):
+        """logs sampled slow requests with their SQL and parameters"""
+
+        app.config['SLOW_REQUEST_MS'] = 0
+        app.config['SLOW_REQUEST_SAMPLE'] = 1
+
+        with self.assertLogs('warbler.slow_requests') as logs:
+            self.client.get('/users?q=timed')
+
+        entry = json.loads(logs.records[0].getMessage())
+        self.assertEqual(entry['endpoint'], 'list_users')
+        self.assertEqual(entry['path'], '/users?q=timed')
+        self.assertEqual(entry['status'], 200)
+        self.assertEqual(entry['queries'], len(entry['statements']))
+        self.assertTrue(any('timed' in json.dumps(s['params']) for s in entry['statements']))
+        self.assertTrue(all('SELECT' in s['sql'] for s in entry['statements']))
+
+    def test_slow_log_unsampled(self):
+        """doesn't log requests that weren't sampled, or fast ones"""
+
+        app.config['SLOW_REQUEST_MS'] = 0
+        app.config['SLOW_REQUEST_SAMPLE'] = 0
+        app.config['SERVER_TIMING'] = True
+
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('warbler.slow_requests'):
+                resp = self.client.get('/users')
+
+        # Unsampled requests are still counted.
+        self.assertNotIn('desc="0 queries"', resp.headers['Server-Timing'])
+
+        app.config['SLOW_REQUEST_MS'] = 60000
+        app.config['SLOW_REQUEST_SAMPLE'] = 1
+
+        with self.assertRaises(AssertionError):
+            with self.assertLogs('warbler.slow_requests'):
+                self.client.get('/users')
+
+    def test_loggable(self):
+        """shortens long parameter values"""
+
+        params = loggable({'text': 'x' * 1000, 'id': 1, 'data': b'\0' * 10})
+
+        self.assertEqual(len(params['text']), PARAM_LENGTH + 3)
+        self.assertEqual(params['id'], 1)
+        self.assertEqual(params['data'], '<10 bytes>')
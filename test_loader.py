@@ -0,0 +1,85 @@
+"""CSV loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import os
+import tempfile
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import (BigInteger, Boolean, Column, DateTime, ForeignKey, Index, Integer,
+                        MetaData, Table, Text, create_engine, inspect, select)
+
+from loader import Loader
+
+
+class LoaderTestCase(TestCase):
+    """Test chunked loading (the SQLite path; COPY is used on PostgreSQL)."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+        self.engine = create_engine('sqlite://')
+        metadata = MetaData()
+        self.authors = Table('authors', metadata,
+                             Column('id', Integer, primary_key=True),
+                             Column('name', Text, nullable=False),
+                             Column('bio', Text))
+        self.posts = Table('posts', metadata,
+                           Column('id', Integer, primary_key=True),
+                           Column('author_id', Integer, ForeignKey('authors.id')),
+                           Column('timestamp', DateTime),
+                           Index('ix_posts_author_id', 'author_id'))
+        metadata.create_all(self.engine)
+
+        self.write('authors.csv', 'name,bio\nann,"likes, commas"\nbob,\ncat,hi\n')
+        self.write('posts.csv', 'author_id,timestamp\n1,2020-01-02 03:04:05.123456\n'
+                                '3,2020-01-03 00:00:00\n')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def write(self, name, content):
+        with open(os.path.join(self.tmp.name, name), 'w') as f:
+            f.write(content)
+
+    def test_load(self):
+        """loads every row in chunks and rebuilds the indexes"""
+
+        reports = []
+
+        with self.engine.begin() as connection:
+            loader = Loader(connection, chunk_rows=2, report=reports.append)
+            with loader.indexes_dropped(['authors', 'posts']):
+                self.assertEqual(inspect(connection).get_indexes('posts'), [])
+                counts = loader.load([
+                    (self.authors, os.path.join(self.tmp.name, 'authors.csv')),
+                    (self.posts, os.path.join(self.tmp.name, 'posts.csv')),
+                ])
+
+        self.assertEqual(counts, {'authors': 3, 'posts': 2})
+        self.assertTrue(any('rows/s' in report for report in reports))
+        self.assertEqual([index['name'] for index in inspect(self.engine).get_indexes('posts')],
+                         ['ix_posts_author_id'])
+
+        with self.engine.connect() as connection:
+            authors = connection.execute(
+                select([self.authors.c.name, self.authors.c.bio]).order_by(self.authors.c.id)).fetchall()
+            posts = connection.execute(
+                select([self.posts.c.timestamp]).order_by(self.posts.c.id)).fetchall()
+
+        self.assertEqual([tuple(row) for row in authors],
+                         [('ann', 'likes, commas'), ('bob', None), ('cat', 'hi')])
+        self.assertEqual(posts[0][0], datetime(2020, 1, 2, 3, 4, 5, 123456))
+
+    def test_converters(self):
+        """values are converted by column type, variants included"""
+
+        variant = BigInteger().with_variant(Integer(), 'sqlite')
+        self.assertEqual(Loader._converter(variant)('1323440485175390208'), 1323440485175390208)
+        self.assertEqual(Loader._converter(Boolean())('f'), False)
+        self.assertEqual(Loader._converter(Boolean())('t'), True)
+        self.assertEqual(Loader._converter(Text())('7'), '7')
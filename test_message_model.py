@@ -6,9 +6,11 @@
 
 
 import os
+from datetime import datetime, timedelta
 from unittest import TestCase
 
 from models import db, User, Message, Follows
+from snowflake import timestamp_of, MAX_SEQUENCE
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -73,4 +75,66 @@ class MessageModelTestCase(TestCase):
     def test_user(self):
         """checks the user property works"""
 
-        self.assertEqual(self.m1.user, self.u1)
\ No newline at end of file
+        self.assertEqual(self.m1.user, self.u1)
+
+    def test_with_authors(self):
+        """checks with_authors loads the author alongside the message"""
+
+        m1_id = self.m1.id
+        db.session.expunge_all()
+        msg = Message.with_authors().filter(Message.id == m1_id).one()
+
+        #the author is already loaded, no lazy load needed
+        self.assertIn('user', msg.__dict__)
+        self.assertEqual(msg.user.username, "testuser1")
+
+    def test_ids_and_timestamps(self):
+        """checks each message gets its own time and a later id"""
+
+        m = Message(text="Blessed Trinity", user_id=self.u1.id)
+        db.session.add(m)
+        db.session.commit()
+
+        self.assertGreater(m.timestamp, self.m1.timestamp)
+        self.assertGreater(m.id, self.m1.id)
+
+        #a message given a time gets an id that sorts at that time
+        old = Message(text="Blessed Trinity", user_id=self.u1.id,
+                      timestamp=datetime(2020, 1, 1))
+        db.session.add(old)
+        db.session.commit()
+
+        self.assertLess(old.id, self.m1.id)
+        self.assertEqual(timestamp_of(old.id), datetime(2020, 1, 1))
+
+    def test_database_ids(self):
+        """checks the database numbers and times messages inserted without"""
+
+        db.session.execute(
+            db.text("INSERT INTO messages (text, user_id, timestamp) VALUES ('old', :id, :at)"),
+            dict(id=self.u1.id, at=datetime(2020, 1, 1)))
+        db.session.execute(
+            db.text("INSERT INTO messages (text, user_id) VALUES ('new', :id)"),
+            dict(id=self.u1.id))
+        db.session.commit()
+
+        old, new = (Message.query
+                    .filter(Message.id != self.m1.id)
+                    .order_by(Message.id))
+
+        self.assertEqual(timestamp_of(old.id), datetime(2020, 1, 1))
+        self.assertGreater(new.id, self.m1.id)
+        self.assertLess(abs(new.timestamp - datetime.utcnow()), timedelta(minutes=1))
+
+    def test_database_ids_same_millisecond(self):
+        """more messages in a millisecond than the sequence bits hold
+        still get distinct ids"""
+
+        db.session.execute(
+            db.text("INSERT INTO messages (text, user_id, timestamp) "
+                    "SELECT 'x', :id, :at FROM generate_series(1, :n)"),
+            dict(id=self.u1.id, at=datetime(2020, 1, 1), n=MAX_SEQUENCE + 100))
+        db.session.commit()
+
+        ids = [id for (id,) in db.session.query(Message.id).filter_by(text='x')]
+        self.assertEqual(len(set(ids)), MAX_SEQUENCE + 100)
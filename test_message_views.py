@@ -8,7 +8,7 @@
 import os
 from unittest import TestCase
 
-from models import db, connect_db, Message, User
+from models import db, connect_db, Message, User, Follows, TimelineEntry
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -135,6 +135,39 @@ class MessageViewTestCase(TestCase):
             self.assertIn("Delete", html)
             self.assertIn("Blessed Trinity", html)
 
+    def test_messages_show_not_modified(self):
+        """Is a conditional GET of a message answered with 304 until its author changes?"""
+
+        msg_id = self.msg1.id
+        u1_id = self.u1.id
+
+        with app.test_client() as c:
+            resp = c.get(f'/messages/{msg_id}')
+            etag = resp.headers['ETag']
+            # The page depends on more than the message's timestamp
+            self.assertNotIn('Last-Modified', resp.headers)
+            resp = c.get(f'/messages/{msg_id}',
+                         headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+            self.assertEqual(resp.status_code, 200)
+
+            resp = c.get(f'/messages/{msg_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+
+            "-Logging in changes the page"
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u1_id
+
+            resp = c.get(f'/messages/{msg_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            etag = resp.headers['ETag']
+
+            "-So does the author editing their profile"
+            User.query.filter_by(id=u1_id).update({'version': User.version + 1})
+            db.session.commit()
+
+            resp = c.get(f'/messages/{msg_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+
     def test_messages_destroy(self):
         """Can delete message?"""
         with app.test_client() as c:
@@ -171,5 +204,65 @@ class MessageViewTestCase(TestCase):
 
             self.assertEqual(resp.status_code, 200)
             self.assertEqual(len(Message.query.all()), 0)
-           
 
+    def test_messages_add_fans_out(self):
+        """Does a new message reach the author's and followers' timelines?"""
+
+        u1_id = self.u1.id
+        u2 = User.query.filter_by(username='test2').first()
+        u2_id = u2.id
+        db.session.add(Follows(user_being_followed_id=u1_id, user_following_id=u2_id))
+        db.session.commit()
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u1_id
+
+            c.post("/messages/new", data={"text": "Fan me out"})
+
+        msg = Message.query.filter_by(text="Fan me out").first()
+        owners = {entry.owner_id for entry in TimelineEntry.query.filter_by(message_id=msg.id)}
+        self.assertEqual(owners, {u1_id, u2_id})
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u1_id
+
+            c.post(f"/messages/{msg.id}/delete")
+
+        self.assertEqual(TimelineEntry.query.filter_by(message_id=msg.id).count(), 0)
+
+    def test_messages_search(self):
+        """Can search message text?"""
+
+        with app.test_client() as c:
+            resp = c.get('/messages/search?q=trinity')
+            html = resp.get_data(as_text=True)
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Blessed Trinity", html)
+            self.assertNotIn("Trust in God", html)
+
+            "Words are matched by stem, and ranked search works too"
+            resp = c.get('/messages/search?q=blessing&sort=relevance')
+            self.assertIn("Blessed Trinity", resp.get_data(as_text=True))
+
+            resp = c.get('/messages/search?q=nothing+like+this')
+            self.assertIn("no warbles found", resp.get_data(as_text=True))
+
+            "A cursor past the end links back, keeping the search and its sort"
+            resp = c.get('/messages/search?q=trinity&sort=recent&older=1')
+            html = resp.get_data(as_text=True)
+            self.assertIn("no warbles found", html)
+            self.assertIn('href="/messages/search?q=trinity&amp;sort=recent&amp;newer=0"', html)
+
+        "Deleted messages drop out of the index"
+        msg1_id = self.msg1.id
+        u1_id = self.u1.id
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = u1_id
+
+            c.post(f'/messages/{msg1_id}/delete')
+            resp = c.get('/messages/search?q=trinity')
+            self.assertNotIn("Blessed Trinity", resp.get_data(as_text=True))
@@ -0,0 +1,116 @@
+"""Prometheus metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_metrics.py
+
+
+import os
+import subprocess
+import sys
+import tempfile
+from unittest import TestCase
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from prometheus_client import REGISTRY, CollectorRegistry, multiprocess
+
+from app import app, user_cache
+from metrics import observe_bcrypt
+from models import db, User
+from passwords import PasswordHasher
+
+db.create_all()
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+class MetricsTestCase(TestCase):
+    """Test the /metrics endpoint and what it collects."""
+
+    def setUp(self):
+        User.query.delete()
+        db.session.commit()
+
+        app.config['TESTING'] = True
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_requests(self):
+        """counts requests and times them by endpoint name"""
+
+        requests = sample('warbler_requests_total', endpoint='users_show', status='404')
+        timed = sample('warbler_request_duration_seconds_count', endpoint='users_show')
+
+        self.client.get('/users/987654')
+        self.client.get('/users/987655')
+        self.client.get('/no/such/page')
+
+        self.assertEqual(sample('warbler_requests_total', endpoint='users_show', status='404'),
+                         requests + 2)
+        self.assertEqual(sample('warbler_request_duration_seconds_count', endpoint='users_show'),
+                         timed + 2)
+        self.assertGreater(sample('warbler_request_queries_sum', endpoint='users_show'), 0)
+        self.assertGreater(sample('warbler_requests_total', endpoint='unmatched', status='404'), 0)
+
+    def test_exposition(self):
+        """serves every metric in the text format"""
+
+        self.client.get('/users')
+        resp = self.client.get('/metrics')
+        text = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.content_type.startswith('text/plain'))
+        self.assertIn('no-store', resp.headers['Cache-Control'])
+        self.assertIn('warbler_request_duration_seconds_bucket{endpoint="list_users",le="0.005"}', text)
+        self.assertIn('warbler_db_pool_checkouts_total', text)
+        self.assertIn('warbler_db_pool_connect_seconds_count', text)
+        self.assertIn('warbler_db_pool_checked_out', text)
+
+    def test_caches(self):
+        """counts cache hits and misses since the last request"""
+
+        hits = sample('warbler_cache_hits_total', cache='user_profiles')
+        misses = sample('warbler_cache_misses_total', cache='user_profiles')
+
+        user_cache.get('nobody')
+        user_cache.set('somebody', {})
+        user_cache.get('somebody')
+        self.client.get('/metrics')
+
+        self.assertEqual(sample('warbler_cache_hits_total', cache='user_profiles'), hits + 1)
+        self.assertEqual(sample('warbler_cache_misses_total', cache='user_profiles'), misses + 1)
+
+    def test_bcrypt(self):
+        """times hashes and checks"""
+
+        hasher = PasswordHasher(rounds=4, workers=1)
+        hasher.on_timing = observe_bcrypt
+        checks = sample('warbler_bcrypt_seconds_count', operation='check')
+
+        pw_hash = hasher.hash('secret')
+        hasher.check(pw_hash, 'secret')
+
+        self.assertEqual(sample('warbler_bcrypt_seconds_count', operation='check'), checks + 1)
+        self.assertGreater(sample('warbler_bcrypt_wait_seconds_count', operation='hash'), 0)
+
+    def test_multiprocess(self):
+        """adds up the values of every process sharing the directory"""
+
+        with tempfile.TemporaryDirectory() as directory:
+            env = dict(os.environ, PROMETHEUS_MULTIPROC_DIR=directory)
+            for i in range(2):
+                subprocess.run([sys.executable, '-c',
+                                "import metrics; metrics.REQUESTS.labels('homepage', 200).inc(3)"],
+                               env=env, check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+
+            registry = CollectorRegistry()
+            multiprocess.MultiProcessCollector(registry, path=directory)
+
+            self.assertEqual(registry.get_sample_value(
+                'warbler_requests_total', {'endpoint': 'homepage', 'status': '200'}), 6)
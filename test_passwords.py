@@ -0,0 +1,67 @@
+"""Password hasher tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+from unittest import TestCase
+
+from passwords import PasswordHasher, HasherBusy
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test hashing through the bounded worker pool."""
+
+    def setUp(self):
+        self.hasher = PasswordHasher(rounds=4, workers=2)
+
+    def test_hash_and_check(self):
+        """hashes at the configured cost and checks passwords"""
+
+        pw_hash = self.hasher.hash('secret')
+
+        self.assertTrue(pw_hash.startswith('$2b$04$'))
+        self.assertTrue(self.hasher.check(pw_hash, 'secret'))
+        self.assertFalse(self.hasher.check(pw_hash, 'wrong'))
+
+    def test_empty_password(self):
+        """errors from bcrypt come back to the caller"""
+
+        with self.assertRaises(ValueError):
+            self.hasher.hash(None)
+
+    def test_needs_rehash(self):
+        """flags hashes made at a different cost"""
+
+        pw_hash = self.hasher.hash('secret')
+        self.assertFalse(self.hasher.needs_rehash(pw_hash))
+
+        self.hasher.configure(rounds=5)
+        self.assertTrue(self.hasher.needs_rehash(pw_hash))
+        self.assertTrue(self.hasher.needs_rehash('not a bcrypt hash'))
+
+    def test_busy(self):
+        """gives up with HasherBusy when the pool can't keep up"""
+
+        slow = PasswordHasher(rounds=14, workers=1, timeout=0.01)
+
+        with self.assertRaises(HasherBusy):
+            slow.hash('secret')
+
+    def test_queue_full(self):
+        """refuses new hashes while too many are queued, until they finish"""
+
+        slow = PasswordHasher(rounds=12, workers=1, timeout=0.01, max_queue=0)
+
+        # Times out, but keeps the only worker busy...
+        with self.assertRaises(HasherBusy):
+            slow.hash('secret')
+        self.assertEqual(slow.pending, 1)
+
+        # ...so this one isn't even queued
+        with self.assertRaises(HasherBusy):
+            slow.check('$2b$04$' + 'x' * 53, 'secret')
+
+        slow._executor.shutdown(wait=True)
+        self.assertEqual(slow.pending, 0)
@@ -0,0 +1,110 @@
+"""Snowflake id tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_snowflake.py
+
+
+from datetime import datetime
+from unittest import TestCase
+
+from flask import Flask
+
+from snowflake import (SnowflakeIds, claim_worker_id, timestamp_of, DATABASE_WORKER,
+                       MAX_SEQUENCE, SEQUENCE_BITS)
+
+DATABASE_URL = "postgresql:///warbler-test"
+
+
+class Clock:
+    """A clock tests can set, in Unix seconds."""
+
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class SnowflakeIdsTestCase(TestCase):
+    """Test making time-ordered ids."""
+
+    def setUp(self):
+        self.clock = Clock(datetime(2020, 1, 2, 3, 4, 5).timestamp())
+        self.ids = SnowflakeIds(worker_id=7, clock=self.clock)
+
+    def test_next_id(self):
+        """ids increase, and carry the time and the worker"""
+
+        made = [self.ids.next_id() for i in range(3)]
+        self.clock.now += 0.001
+        made.append(self.ids.next_id())
+
+        self.assertEqual(made, sorted(set(made)))
+        self.assertEqual(timestamp_of(made[0]), datetime.utcfromtimestamp(self.clock.now - 0.001))
+        self.assertEqual((made[0] >> SEQUENCE_BITS) & DATABASE_WORKER, 7)
+        self.assertEqual([id & MAX_SEQUENCE for id in made], [0, 1, 2, 0])
+
+    def test_clock_steps_back(self):
+        """ids keep increasing when the clock goes backwards"""
+
+        first = self.ids.next_id()
+        self.clock.now -= 5
+        self.assertGreater(self.ids.next_id(), first)
+
+    def test_sequence_overflow(self):
+        """more than 4096 ids in a millisecond borrow the next one"""
+
+        made = [self.ids.next_id() for i in range(MAX_SEQUENCE + 2)]
+
+        self.assertEqual(len(set(made)), len(made))
+        self.assertEqual(made, sorted(made))
+        self.assertEqual(made[-1] & MAX_SEQUENCE, 0)
+
+    def test_id_at(self):
+        """ids for a given time sort at that time"""
+
+        now = self.ids.next_id()
+        earlier = self.ids.id_at(datetime(2019, 1, 1))
+        later = self.ids.id_at(datetime(2021, 1, 1))
+
+        self.assertLess(earlier, now)
+        self.assertGreater(later, now)
+        self.assertEqual(timestamp_of(earlier), datetime(2019, 1, 1))
+        self.assertGreater(self.ids.next_id(), later)
+
+    def test_worker_id(self):
+        """worker ids are required, and can't be the database's"""
+
+        with self.assertRaises(RuntimeError):
+            SnowflakeIds().next_id()
+
+        with self.assertRaises(ValueError):
+            SnowflakeIds(worker_id=DATABASE_WORKER)
+
+    def test_claim_worker_id(self):
+        """processes claim different worker ids, free again once released"""
+
+        claim = lambda: claim_worker_id(DATABASE_URL)
+        first = SnowflakeIds(claim=claim)
+        second = SnowflakeIds(claim=claim)
+
+        worker_id = first.worker_id
+        self.assertLess(worker_id, DATABASE_WORKER)
+        self.assertNotEqual(second.worker_id, worker_id)
+
+        first.configure(worker_id=7)
+        self.assertEqual(SnowflakeIds(claim=claim).worker_id, worker_id)
+
+    def test_init_app(self):
+        """without SNOWFLAKE_WORKER_ID, only PostgreSQL can hand out ids"""
+
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+        with self.assertRaises(RuntimeError):
+            SnowflakeIds().init_app(app)
+
+        app.config['SNOWFLAKE_WORKER_ID'] = 7
+        ids = SnowflakeIds()
+        ids.init_app(app)
+        self.assertEqual(ids.worker_id, 7)
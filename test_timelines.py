@@ -0,0 +1,226 @@
+"""Timeline engine tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timelines.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Follows, TimelineEntry
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY, user_cache
+from benchmarks.common import count_statements
+from caching import LRUCache
+from timelines import PushTimelines, PullTimelines, HybridTimelines, reclassify
+
+app.config['TESTING'] = True
+app.config['WTF_CSRF_ENABLED'] = False
+
+db.create_all()
+
+
+class TimelinesTestCase(TestCase):
+    """Test the timeline engines agree."""
+
+    def setUp(self):
+        """Add a viewer following three authors who've posted a lot."""
+
+        User.query.delete()
+        Message.query.delete()
+        Follows.query.delete()
+        TimelineEntry.query.delete()
+        db.session.commit()
+        user_cache.clear()
+
+        users = [User(email=f"test{i}@test.com", username=f"testuser{i}",
+                      password="HASHED_PASSWORD") for i in range(5)]
+        db.session.add_all(users)
+        db.session.commit()
+        viewer, *authors, stranger = users
+
+        start = datetime(2020, 1, 1)
+        for i in range(60):
+            # Authors post at different rates, and the stranger's
+            # messages must never show up.
+            author = authors[0] if i % 2 else authors[i % 3]
+            db.session.add(Message(text=f"warble {i}", user_id=author.id,
+                                   timestamp=start + timedelta(minutes=i)))
+            db.session.add(Message(text=f"stranger {i}", user_id=stranger.id,
+                                   timestamp=start + timedelta(minutes=i)))
+        db.session.add(Message(text="my own", user_id=viewer.id,
+                               timestamp=start + timedelta(minutes=30, seconds=1)))
+        db.session.add_all([Follows(user_being_followed_id=author.id,
+                                    user_following_id=viewer.id) for author in authors])
+        db.session.commit()
+        TimelineEntry.rebuild()
+        db.session.commit()
+
+        self.viewer_id = viewer.id
+        self.author_id = authors[0].id
+
+    def pages(self, engine, per_page=7, **cursor):
+        """Every page from the given cursor on, as lists of ids."""
+
+        key = 'newer' if 'newer' in cursor else 'older'
+        pages = []
+        while True:
+            page = engine.messages(self.viewer_id, per_page=per_page, **cursor)
+            pages.append([msg.id for msg in page.items])
+            if not getattr(page, key):
+                return pages
+            cursor = {key: getattr(page, key)}
+
+    def test_pull_matches_push(self):
+        """merged pages are the same as the materialized timeline's"""
+
+        push = self.pages(PushTimelines())
+        self.assertEqual(sum(len(page) for page in push), 61)
+
+        for engine in [PullTimelines(),
+                       PullTimelines(LRUCache()),
+                       # Lists shorter than a page: most pages fall back to SQL.
+                       PullTimelines(LRUCache(), recent_size=5)]:
+            self.assertEqual(self.pages(engine), push)
+            self.assertEqual(self.pages(engine), push)
+
+            # and back again from the last page
+            last = engine.messages(self.viewer_id, per_page=7,
+                                   older=str(push[-1][0] + 1))
+            newer = self.pages(engine, newer=last.newer)
+            self.assertEqual(newer, push[-2::-1])
+
+            # past the end, a page still links back
+            past = engine.messages(self.viewer_id, per_page=7, older=str(push[-1][-1]))
+            self.assertEqual((past.items, past.older), ([], None))
+            oldest = [id for page in push for id in page][-7:]
+            self.assertEqual(self.pages(engine, newer=past.newer)[0], oldest)
+
+    def test_cached_reads(self):
+        """a warm page only queries for its messages"""
+
+        engine = PullTimelines(LRUCache())
+        engine.versions(self.viewer_id)
+
+        with count_statements() as statements:
+            page = engine.versions(self.viewer_id, per_page=3)
+
+        self.assertEqual(len(statements), 1)
+        self.assertEqual([row.id for row in page.items],
+                         [row.id for row in PushTimelines().versions(self.viewer_id, per_page=3).items])
+
+    def test_routes_update_pull_timelines(self):
+        """posting, unfollowing and deleting reach a cached pull timeline"""
+
+        engine = PullTimelines(LRUCache())
+
+        with patch('app.timelines', engine), app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = self.viewer_id
+
+            self.assertIn('warble 59', client.get('/').get_data(as_text=True))
+
+            client.post('/messages/new', data={'text': 'brand new'})
+            self.assertIn('brand new', client.get('/').get_data(as_text=True))
+
+            client.post(f'/users/stop-following/{self.author_id}')
+            html = client.get('/').get_data(as_text=True)
+            self.assertNotIn('warble 59', html)
+            self.assertIn('warble 58', html)
+
+            msg = Message.query.filter_by(text='brand new').one()
+            client.post(f'/messages/{msg.id}/delete')
+            self.assertNotIn('brand new', client.get('/').get_data(as_text=True))
+
+    def pull_author(self):
+        """Give the busiest author enough followers to be pulled."""
+
+        User.query.filter_by(id=self.author_id).update({'followers_count': 5})
+        self.assertEqual(reclassify(threshold=2), ([self.author_id], []))
+        db.session.commit()
+
+    def test_reclassify(self):
+        """switched accounts' messages leave and rejoin timelines"""
+
+        delivered = TimelineEntry.query.filter_by(author_id=self.author_id).count()
+        self.pull_author()
+        self.assertEqual(TimelineEntry.query.filter_by(author_id=self.author_id).count(), 0)
+
+        # Not yet under 90% of the threshold
+        self.assertEqual(reclassify(threshold=5), ([], []))
+        self.assertEqual(reclassify(threshold=6), ([], [self.author_id]))
+        db.session.commit()
+        self.assertEqual(TimelineEntry.query.filter_by(author_id=self.author_id).count(),
+                         delivered)
+
+        self.pull_author()
+        self.assertEqual(reclassify(threshold=None), ([], [self.author_id]))
+
+    def test_hybrid_matches_push(self):
+        """timelines merged with pulled accounts' messages are the same"""
+
+        push = self.pages(PushTimelines())
+        self.pull_author()
+
+        for engine in [HybridTimelines(),
+                       HybridTimelines(LRUCache()),
+                       HybridTimelines(LRUCache(), recent_size=5)]:
+            self.assertEqual(self.pages(engine), push)
+
+            last = engine.messages(self.viewer_id, per_page=7,
+                                   older=str(push[-1][0] + 1))
+            self.assertEqual(self.pages(engine, newer=last.newer), push[-2::-1])
+
+        # A message still in a timeline while its author is pulled shows once.
+        TimelineEntry.redeliver(self.author_id)
+        self.assertEqual(self.pages(HybridTimelines(LRUCache())), push)
+
+    def test_routes_update_hybrid_timelines(self):
+        """posts by pulled and pushed accounts reach a hybrid timeline"""
+
+        self.pull_author()
+        engine = HybridTimelines(LRUCache())
+
+        with patch('app.timelines', engine), app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = self.author_id
+
+            client.post('/messages/new', data={'text': 'pulled post'})
+            self.assertEqual(TimelineEntry.query.filter_by(author_id=self.author_id).count(), 0)
+
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = self.viewer_id
+
+            client.post('/messages/new', data={'text': 'pushed post'})
+            html = client.get('/').get_data(as_text=True)
+            self.assertIn('pulled post', html)
+            self.assertIn('pushed post', html)
+
+            client.post(f'/users/stop-following/{self.author_id}')
+            html = client.get('/').get_data(as_text=True)
+            self.assertNotIn('pulled post', html)
+            self.assertIn('pushed post', html)
+
+            client.post(f'/users/follow/{self.author_id}')
+            self.assertIn('pulled post', client.get('/').get_data(as_text=True))
+
+    def test_self_follow(self):
+        """a user following themselves gets their messages once"""
+
+        db.session.add(Follows(user_being_followed_id=self.viewer_id,
+                               user_following_id=self.viewer_id))
+        msg = Message(text="to myself", user_id=self.viewer_id)
+        db.session.add(msg)
+        db.session.flush()
+        TimelineEntry.deliver(msg)
+        db.session.commit()
+
+        TimelineEntry.rebuild()
+        db.session.commit()
+        self.assertEqual(TimelineEntry.query.filter_by(owner_id=self.viewer_id,
+                                                       author_id=self.viewer_id).count(), 2)
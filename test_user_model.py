@@ -9,7 +9,11 @@ import os
 from unittest import TestCase
 
 from models import db, User, Message, Follows, Likes
+from passwords import hasher
 from flask_bcrypt import Bcrypt
+from sqlalchemy import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 
 os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
 bcrypt = Bcrypt()
@@ -161,4 +165,139 @@ class UserModelTestCase(TestCase):
         db.session.commit()
 
         #u2 should have one liked message now
-        self.assertEqual(len(self.u2.likes), 1)
\ No newline at end of file
+        self.assertEqual(len(self.u2.likes), 1)
+
+    def test_likes_per_user(self):
+        """checks many users can like a message, each only once"""
+        message = Message(user_id=self.u1.id, text="blessed virgin mary")
+        db.session.add(message)
+        db.session.commit()
+
+        db.session.add(Likes(user_id=self.u1.id, message_id=message.id))
+        db.session.add(Likes(user_id=self.u2.id, message_id=message.id))
+        db.session.commit()
+
+        db.session.add(Likes(user_id=self.u2.id, message_id=message.id))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+    def test_likes_add_remove(self):
+        """checks Likes.add and Likes.remove count each like once"""
+        message = Message(user_id=self.u1.id, text="blessed virgin mary")
+        db.session.add(message)
+        db.session.commit()
+
+        self.assertTrue(Likes.add(self.u2.id, message.id))
+        self.assertFalse(Likes.add(self.u2.id, message.id))
+        db.session.commit()
+
+        self.assertEqual(Likes.query.filter_by(message_id=message.id).count(), 1)
+        self.assertEqual(message.like_count, 1)
+        self.assertEqual(self.u2.likes_count, 1)
+
+        self.assertTrue(Likes.remove(self.u2.id, message.id))
+        self.assertFalse(Likes.remove(self.u2.id, message.id))
+        db.session.commit()
+
+        self.assertEqual(message.like_count, 0)
+        self.assertEqual(self.u2.likes_count, 0)
+
+        #recounting agrees with the counters
+        Likes.add(self.u1.id, message.id)
+        Message.query.update({Message.like_count: 5})
+        Message.recount_likes()
+        db.session.commit()
+        self.assertEqual(message.like_count, 1)
+
+    def test_recount_all(self):
+        """checks recount_all rebuilds the denormalized counters"""
+
+        message = Message(user_id=self.u1.id, text="blessed virgin mary")
+        db.session.add(message)
+        db.session.add(Follows(user_being_followed_id=self.u1.id, user_following_id=self.u2.id))
+        db.session.commit()
+        db.session.add(Likes(user_id=self.u2.id, message_id=message.id))
+        db.session.commit()
+
+        #rows added directly don't touch the counters
+        self.assertEqual(self.u1.messages_count, 0)
+
+        User.recount_all()
+        db.session.commit()
+
+        self.assertEqual(self.u1.messages_count, 1)
+        self.assertEqual(self.u1.followers_count, 1)
+        self.assertEqual(self.u1.following_count, 0)
+        self.assertEqual(self.u2.following_count, 1)
+        self.assertEqual(self.u2.likes_count, 1)
+
+    def test_update_counts(self):
+        """checks update_counts adds to the counters in the database"""
+
+        User.update_counts(self.u1.id, followers_count=2, likes_count=1)
+        User.update_counts([self.u1.id, self.u2.id], followers_count=-1)
+        db.session.commit()
+
+        self.assertEqual(self.u1.followers_count, 1)
+        self.assertEqual(self.u1.likes_count, 1)
+        self.assertEqual(self.u2.followers_count, -1)
+
+    def test_following_ids(self):
+        """checks following_ids reports follow state for a batch of users"""
+
+        u3 = User(email="test3@test.com", username="testuser3", password="HASHED_PASSWORD")
+        db.session.add(u3)
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_ids([self.u2.id, u3.id]), set())
+        self.assertEqual(self.u1.following_ids([]), set())
+
+        db.session.add(Follows(user_being_followed_id=u3.id, user_following_id=self.u1.id))
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_ids([self.u2.id, u3.id]), {u3.id})
+
+    def test_search(self):
+        """checks search matches username prefixes, ignoring case"""
+
+        u3 = User(email="test3@test.com", username="Other_user", password="HASHED_PASSWORD")
+        db.session.add(u3)
+        db.session.commit()
+
+        self.assertEqual([u.username for u in User.search('TESTUSER')], ['testuser1', 'testuser2'])
+        self.assertEqual([u.username for u in User.search('other_')], ['Other_user'])
+        self.assertEqual(User.search('user').all(), [])
+
+        #wildcards in the search term are matched literally
+        self.assertEqual(User.search('test%').all(), [])
+        self.assertEqual(User.search('other%').all(), [])
+
+        #paging picks up after the given user
+        self.assertEqual([u.username for u in User.search('test', after=self.u1.id)], ['testuser2'])
+
+    def test_search_key_sqlite(self):
+        """checks the search key only collates on PostgreSQL"""
+
+        key = User.search_key()
+        self.assertEqual(str(key.compile(dialect=postgresql.dialect())),
+                         'lower(users.username) COLLATE "C"')
+        self.assertEqual(str(key.compile(dialect=sqlite.dialect())), 'lower(users.username)')
+
+        engine = create_engine('sqlite://')
+        db.metadata.create_all(engine)
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute(User.search('a').statement).all(), [])
+
+    def test_authenticate_rehashes(self):
+        """checks authenticate upgrades hashes made at an old work factor"""
+
+        self.u1.password = bcrypt.generate_password_hash('HASHED_PASSWORD', 4).decode('UTF-8')
+        db.session.commit()
+
+        user = User.authenticate('testuser1', 'HASHED_PASSWORD')
+        db.session.commit()
+
+        self.assertEqual(user, self.u1)
+        self.assertTrue(self.u1.password.startswith(f"$2b${hasher.rounds:02}$"))
+        self.assertTrue(User.authenticate('testuser1', 'HASHED_PASSWORD'))
@@ -1,12 +1,14 @@
 from unittest import TestCase
-from models import db, User, Message, Follows, Likes
+from unittest.mock import patch
+from models import db, User, Message, Follows, Likes, TimelineEntry
 import os
 
 
 
 os.environ['DATABASE_URL'] = 'postgresql:///warbler-test'
 
-from app import app, CURR_USER_KEY
+from app import app, CURR_USER_KEY, user_cache, availability
+from benchmarks.common import count_statements
 app.config['TESTING'] = True
 app.config['DEBUG'] = True
 app.config['WTF_CSRF_ENABLED'] = False
@@ -62,6 +64,19 @@ class UserViewsTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn('@test1', html)
 
+        "-Logged in, follow buttons reflect who test1 follows"
+        u1_id = self.u1.id
+        u2_id = self.u2.id
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = u1_id
+
+            resp = client.get('/users')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn(f'/users/stop-following/{u2_id}', html)
+            self.assertNotIn(f'/users/follow/{u2_id}', html)
+
     def test_users_show(self):
         """Test GET /users/<int:user_id> route"""
 
@@ -178,6 +193,16 @@ class UserViewsTestCase(TestCase):
             user = User.query.filter_by(username='test1').first()
             self.assertEqual(len(user.following), 2)
 
+        "-Following yourself"
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = self.u1.id
+
+            resp = client.post(f'/users/follow/{self.u1.id}', follow_redirects=True)
+            self.assertIn("You can&#39;t follow yourself.", resp.get_data(as_text=True))
+            self.assertFalse(Follows.query.filter_by(user_being_followed_id=self.u1.id,
+                                                     user_following_id=self.u1.id).count())
+
     def test_stop_following(self):
         """Test POST /users/stop-following/<int:follow_id>"""
 
@@ -279,3 +304,358 @@ class UserViewsTestCase(TestCase):
 
     
 
+
+
+    def test_homepage_timeline(self):
+        """Test GET / reads followed users' messages from the timeline"""
+
+        u1_id = self.u1.id
+        u3 = User.query.filter_by(username='test3').first()
+        u3_id = u3.id
+        msg = Message(text="Ave Maria", user_id=u3_id)
+        db.session.add(msg)
+        db.session.commit()
+
+        "-Not following yet"
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = u1_id
+
+            resp = client.get('/')
+            self.assertNotIn('Ave Maria', resp.get_data(as_text=True))
+
+            "-Following backfills the timeline"
+            client.post(f'/users/follow/{u3_id}')
+            resp = client.get('/')
+            self.assertIn('Ave Maria', resp.get_data(as_text=True))
+
+            "-Unfollowing retracts it"
+            client.post(f'/users/stop-following/{u3_id}')
+            resp = client.get('/')
+            self.assertNotIn('Ave Maria', resp.get_data(as_text=True))
+
+    def test_homepage_not_modified(self):
+        """Test GET / answers a conditional GET with 304 until the timeline changes"""
+
+        u1_id = self.u1.id
+        u2_id = self.u2.id
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = u1_id
+
+            resp = client.get('/')
+            etag = resp.headers['ETag']
+            self.assertEqual(resp.headers['Cache-Control'], 'private, no-cache')
+
+            resp = client.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+            self.assertEqual(resp.get_data(), b'')
+
+            msg = Message(text="Ave Maria", user_id=u2_id)
+            db.session.add(msg)
+            db.session.flush()
+            TimelineEntry.deliver(msg)
+            db.session.commit()
+
+            resp = client.get('/', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Ave Maria', resp.get_data(as_text=True))
+            self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_users_show_not_modified(self):
+        """Test GET /users/<int:user_id> revalidates against profile and follow state"""
+
+        u1_id = self.u1.id
+        u3_id = User.query.filter_by(username='test3').first().id
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = u1_id
+
+            etag = client.get(f'/users/{u3_id}').headers['ETag']
+            resp = client.get(f'/users/{u3_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 304)
+
+            client.post(f'/users/follow/{u3_id}')
+            resp = client.get(f'/users/{u3_id}', headers={'If-None-Match': etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn('Unfollow', resp.get_data(as_text=True))
+
+    def test_users_show_pagination(self):
+        """Test GET /users/<int:user_id> pages with older/newer cursors"""
+
+        from datetime import datetime, timedelta
+        from pagination import MESSAGES_PER_PAGE
+
+        u1_id = self.u1.id
+        start = datetime(2020, 1, 1)
+        for i in range(MESSAGES_PER_PAGE + 5):
+            db.session.add(Message(text=f"warble {i}", user_id=u1_id,
+                                   timestamp=start + timedelta(minutes=i)))
+        db.session.commit()
+
+        with app.test_client() as client:
+            resp = client.get(f'/users/{u1_id}')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn(f'<p>warble {MESSAGES_PER_PAGE + 4}</p>', html)
+            self.assertNotIn('<p>warble 3</p>', html)
+            self.assertIn('?older=', html)
+            self.assertNotIn('?newer=', html)
+
+            older = html.split('?older=')[1].split('"')[0]
+            resp = client.get(f'/users/{u1_id}?older={older}')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn('<p>warble 3</p>', html)
+            self.assertNotIn(f'<p>warble {MESSAGES_PER_PAGE + 4}</p>', html)
+            self.assertNotIn('?older=', html)
+            self.assertIn('?newer=', html)
+
+            newer = html.split('?newer=')[1].split('"')[0]
+            resp = client.get(f'/users/{u1_id}?newer={newer}')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn(f'<p>warble {MESSAGES_PER_PAGE + 4}</p>', html)
+            self.assertNotIn('<p>warble 3</p>', html)
+
+    def test_homepage_query_count(self):
+        """Test GET / costs the same number of queries however many
+        messages (and authors) are on the page"""
+
+        u1_id = self.u1.id
+        u2_id = self.u2.id
+        liked = Message.query.filter_by(text="Mary").first()
+        liked_id = liked.id
+        TimelineEntry.deliver(liked)
+        db.session.commit()
+
+        def render_home():
+            user_cache.clear()
+            with app.test_client() as client:
+                with client.session_transaction() as change_session:
+                    change_session[CURR_USER_KEY] = u1_id
+
+                with count_statements() as statements:
+                    resp = client.get('/')
+
+            self.assertEqual(resp.status_code, 200)
+            return resp.get_data(as_text=True), len(statements)
+
+        html, few = render_home()
+        self.assertIn(f'/users/remove_like/{liked_id}', html)
+
+        for i in range(10):
+            author = User(username=f"author{i}", email=f"author{i}@test.com",
+                          password="HASHED_PASSWORD")
+            db.session.add(author)
+            db.session.flush()
+            db.session.add(Follows(user_being_followed_id=author.id, user_following_id=u1_id))
+            msg = Message(text=f"warble {i}", user_id=author.id)
+            db.session.add(msg)
+            db.session.flush()
+            TimelineEntry.deliver(msg)
+        db.session.commit()
+
+        html, many = render_home()
+        self.assertIn('warble 9', html)
+        self.assertIn('@author9', html)
+        self.assertEqual(few, many)
+
+    def test_counters(self):
+        """Test the follow, like, post and delete routes keep counters"""
+
+        u1_id = self.u1.id
+        u3 = User.query.filter_by(username='test3').first()
+        u3_id = u3.id
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = u3_id
+
+            client.post(f'/users/follow/{u1_id}')
+            client.post('/messages/new', data={'text': 'counted'})
+
+        msg = Message.query.filter_by(text='counted').first()
+        msg_id = msg.id
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = u1_id
+
+            client.post(f'/users/add_like/{msg_id}')
+
+        u1 = User.query.get(u1_id)
+        u3 = User.query.get(u3_id)
+        self.assertEqual((u1.followers_count, u1.likes_count), (1, 1))
+        self.assertEqual((u3.following_count, u3.messages_count), (1, 1))
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = u3_id
+
+            client.post(f'/messages/{msg_id}/delete')
+            client.post(f'/users/stop-following/{u1_id}')
+
+        u1 = User.query.get(u1_id)
+        u3 = User.query.get(u3_id)
+        self.assertEqual((u1.followers_count, u1.likes_count), (0, 0))
+        self.assertEqual((u3.following_count, u3.messages_count), (0, 0))
+
+    def test_like_message_logged_out(self):
+        """Test liking or unliking needs a logged-in user"""
+
+        msg_id = Message.query.filter_by(text="Mary").first().id
+        likes = Likes.query.filter_by(message_id=msg_id).count()
+
+        with app.test_client() as client:
+            for action in ('add_like', 'remove_like'):
+                resp = client.post(f'/users/{action}/{msg_id}', follow_redirects=True)
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn("Access unauthorized", resp.get_data(as_text=True))
+
+        self.assertEqual(Likes.query.filter_by(message_id=msg_id).count(), likes)
+
+    def test_like_message_idempotent(self):
+        """Test liking or unliking twice counts once"""
+
+        u3_id = User.query.filter_by(username='test3').first().id
+        msg_id = Message.query.filter_by(text="Mary").first().id
+
+        def counts():
+            db.session.expire_all()
+            return (Likes.query.filter_by(message_id=msg_id).count(),
+                    Message.query.get(msg_id).like_count,
+                    User.query.get(u3_id).likes_count)
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = u3_id
+
+            client.post(f'/users/add_like/{msg_id}')
+            client.post(f'/users/add_like/{msg_id}')
+            # u1 already liked it in setUp, straight into the table.
+            self.assertEqual(counts(), (2, 1, 1))
+
+            client.post(f'/users/remove_like/{msg_id}')
+            client.post(f'/users/remove_like/{msg_id}')
+            self.assertEqual(counts(), (1, 0, 0))
+
+    def test_user_cache(self):
+        """Test the logged-in user's profile is cached between requests and
+        forgotten when it changes"""
+
+        u1_id = self.u1.id
+        user_cache.clear()
+
+        with app.test_client() as client:
+            with client.session_transaction() as change_session:
+                change_session[CURR_USER_KEY] = u1_id
+
+            with count_statements() as cold:
+                client.get('/users')
+            hits = user_cache.hits
+
+            with count_statements() as warm:
+                client.get('/users')
+
+            self.assertEqual(user_cache.hits, hits + 1)
+            self.assertEqual(len(warm), len(cold) - 1)
+
+            client.post('/users/profile', data={'username': 'renamed', 'password': 'HASHED_PASSWORD',
+                                                'email': 'test1@test.com'})
+            self.assertIsNone(user_cache.get(u1_id))
+
+            resp = client.get('/users')
+            self.assertIn('alt="renamed"', resp.get_data(as_text=True))
+
+    def test_list_users_search(self):
+        """Test GET /users?q= pages through matching users"""
+
+        from pagination import USERS_PER_PAGE
+
+        for i in range(USERS_PER_PAGE):
+            db.session.add(User(username=f"zz{i:03}", email=f"zz{i}@test.com", password="HASHED_PASSWORD"))
+        db.session.commit()
+
+        with app.test_client() as client:
+            resp = client.get('/users?q=ZZ')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn('@zz000', html)
+            self.assertIn(f'@zz{USERS_PER_PAGE - 1:03}', html)
+            self.assertNotIn('@test1', html)
+            self.assertNotIn('More</a>', html)
+
+            resp = client.get('/users')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn('@test1', html)
+            self.assertNotIn(f'@zz{USERS_PER_PAGE - 1:03}', html)
+            self.assertIn('More</a>', html)
+
+            after = html.split('after=')[1].split('"')[0]
+            resp = client.get(f'/users?after={after}')
+            html = resp.get_data(as_text=True)
+
+            self.assertIn(f'@zz{USERS_PER_PAGE - 1:03}', html)
+            self.assertNotIn('@test1', html)
+
+    def test_users_typeahead(self):
+        """Test GET /users/typeahead returns matching users as JSON"""
+
+        with app.test_client() as client:
+            resp = client.get('/users/typeahead?q=Test')
+
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual([u['username'] for u in resp.json['users']], ['test1', 'test2', 'test3'])
+
+            resp = client.get('/users/typeahead?q=')
+            self.assertEqual(resp.json, {'users': []})
+
+    def test_signup_taken(self):
+        """Test POST /signup rejects taken names before hashing"""
+
+        availability.rebuild()
+
+        with app.test_client() as client:
+            with patch('models.hasher.hash') as hash_password:
+                resp = client.post('/signup', data={'username': 'test1', 'email': 'new@test.com',
+                                                    'password': 'HASHED_PASSWORD'})
+                self.assertIn('Username already taken', resp.get_data(as_text=True))
+
+                resp = client.post('/signup', data={'username': 'newuser', 'email': 'test2@test.com',
+                                                    'password': 'HASHED_PASSWORD'})
+                self.assertIn('Email already taken', resp.get_data(as_text=True))
+
+            hash_password.assert_not_called()
+
+            resp = client.post('/signup', data={'username': 'newuser', 'email': 'new@test.com',
+                                                'password': 'HASHED_PASSWORD'})
+            self.assertEqual(resp.status_code, 302)
+
+    def test_signup_available(self):
+        """Test GET /signup/available reports free usernames and emails"""
+
+        availability.rebuild()
+        db_checks = availability.db_checks
+
+        with app.test_client() as client:
+            resp = client.get('/signup/available?username=test1&email=free@test.com')
+            self.assertEqual(resp.json, {'username': False, 'email': True})
+
+            resp = client.get('/signup/available?username=nobody-has-this')
+            self.assertEqual(resp.json, {'username': True})
+
+        #only the taken username needed the database
+        self.assertEqual(availability.db_checks, db_checks + 1)
+
+    def test_availability_capacity(self):
+        """Rebuilt filters leave room for new signups"""
+
+        self.assertEqual(availability.capacity_for(0), availability.capacity)
+        # 60k users: 120k values
+        capacity = availability.capacity_for(120000)
+        self.assertGreaterEqual(capacity, 240000)
+        self.assertEqual(capacity, availability.capacity * 4)
@@ -0,0 +1,422 @@
+"""Home timeline engines.
+
+The home page shows the newest messages of everyone the viewer follows,
+plus their own. There are three ways to build it, chosen per deployment
+with TIMELINE_ENGINE:
+
+- 'push' (the default): `PushTimelines` copies each message into its
+  author's followers' timelines when it's posted (`TimelineEntry`), so a
+  read is one range scan. Posting costs a write per follower.
+- 'pull': `PullTimelines` builds the page when it's read, merging each
+  followed author's recent message ids. Posting writes nothing extra,
+  but every read merges every followed author.
+- 'hybrid': `HybridTimelines` pushes most accounts' messages, and merges
+  in those of accounts with many followers on read (`User.pull_delivery`,
+  set by `reclassify`).
+
+All have the same interface. `versions` and `messages` read a page, and
+the routes tell the engine about writes, in the transaction, before
+committing: `posted`, `deleted`, `followed`, `unfollowed` and
+`user_deleted`.
+"""
+
+import heapq
+from itertools import dropwhile, islice, takewhile
+
+from models import db, User, Message, Follows, TimelineEntry
+from pagination import Page, paginate, decode_cursor, encode_cursor, empty_page, \
+    MESSAGES_PER_PAGE
+
+# How many of an author's newest message ids PullTimelines keeps. Twice a
+# page, so the first two pages usually merge from the cache alone.
+RECENT_SIZE = 2 * MESSAGES_PER_PAGE
+
+# Followers from which `reclassify` switches an account to pull delivery.
+PULL_THRESHOLD = 10000
+
+# Accounts only go back to push once under this share of the threshold,
+# so one hovering around it doesn't have its followers' timelines
+# rewritten on every run.
+PUSH_BACK_SHARE = 0.9
+
+
+class PushTimelines:
+    """Home timelines materialized on write; see `TimelineEntry`."""
+
+    def versions(self, owner_id, older=None, newer=None, per_page=MESSAGES_PER_PAGE):
+        """A page of (id, author version, like count) rows: what the
+        rendered page depends on, for conditional GETs."""
+
+        return paginate(TimelineEntry.versions_for(owner_id), TimelineEntry.message_id,
+                        older=older, newer=newer, per_page=per_page)
+
+    def messages(self, owner_id, older=None, newer=None, per_page=MESSAGES_PER_PAGE):
+        """A page of messages, with their authors loaded."""
+
+        return paginate(TimelineEntry.messages_for(owner_id), TimelineEntry.message_id,
+                        older=older, newer=newer, per_page=per_page)
+
+    def posted(self, message):
+        TimelineEntry.deliver(message)
+
+    def deleted(self, message):
+        TimelineEntry.remove_message(message.id)
+
+    def followed(self, owner_id, author_id):
+        TimelineEntry.backfill(owner_id, author_id)
+
+    def unfollowed(self, owner_id, author_id):
+        TimelineEntry.retract(owner_id, author_id)
+
+    def user_deleted(self, user_id):
+        TimelineEntry.remove_user(user_id)
+
+
+class PullTimelines:
+    """Home timelines built on read, from each author's recent messages.
+
+    A page is a k-way heap merge of the id lists of the viewer and the
+    people they follow. Ids are time-ordered (see snowflake.py), so it
+    stops after a page's worth without sorting anyone's whole history.
+    The lists and who each user follows are kept in `storage` (anything
+    with get/set/delete, e.g. caching.LRUCache; with `weigh=len` it's
+    bounded by the ids it holds), so a warm page costs no queries until
+    its messages are loaded. Writes drop the affected
+    entries once they're committed; a TTL on `storage` bounds how stale
+    another process's copies get.
+
+    Each list keeps an author's `recent_size` newest ids. A list that's
+    full says nothing about that author's messages older than its last
+    id. Pages reaching past that are read with an IN over the authors
+    instead.
+    """
+
+    def __init__(self, storage=None, recent_size=RECENT_SIZE):
+        self.storage = storage
+        self.recent_size = recent_size
+
+    def versions(self, owner_id, older=None, newer=None, per_page=MESSAGES_PER_PAGE):
+        """As `PushTimelines.versions`."""
+
+        page = self.message_ids(owner_id, older, newer, per_page)
+        rows = (db.session
+                .query(Message.id, User.version, Message.like_count)
+                .join(User, User.id == Message.user_id))
+        return page._replace(items=self._load(rows, page.items))
+
+    def messages(self, owner_id, older=None, newer=None, per_page=MESSAGES_PER_PAGE):
+        """As `PushTimelines.messages`."""
+
+        page = self.message_ids(owner_id, older, newer, per_page)
+        return page._replace(items=self._load(Message.with_authors(), page.items))
+
+    def message_ids(self, owner_id, older=None, newer=None, per_page=MESSAGES_PER_PAGE):
+        """A page of `owner_id`'s timeline as message ids, newest first,
+        with the same cursors as pagination.paginate."""
+
+        older_than = decode_cursor(older)
+        newer_than = decode_cursor(newer)
+        authors = self.authors(owner_id)
+        exact = self.exact_ids(owner_id, older_than, newer_than, per_page + 1)
+        lists = list(self.recent(authors).values())
+
+        # Merged ids are only complete down to the highest last id of any
+        # full list.
+        floor = max((ids[-1] for ids in lists if len(ids) == self.recent_size),
+                    default=None)
+
+        page = merge(lists + exact, floor, older_than, newer_than, per_page)
+        if page is None:
+            query = db.session.query(Message.id).filter(Message.user_id.in_(authors))
+            lists = [window(query, Message.id, older_than, newer_than, per_page + 1)]
+            page = merge(lists + exact, None, older_than, newer_than, per_page)
+        return page
+
+    def sql_message_ids(self, author_ids, older=None, newer=None, per_page=MESSAGES_PER_PAGE):
+        """A page of the authors' messages as ids, straight from the
+        database: an IN over them, newest first."""
+
+        page = paginate(db.session.query(Message.id).filter(Message.user_id.in_(author_ids)),
+                        Message.id, older=older, newer=newer, per_page=per_page)
+        return page._replace(items=[id for (id,) in page.items])
+
+    def exact_ids(self, owner_id, older_than, newer_than, limit):
+        """Lists of ids to merge in besides the authors' recent messages,
+        each the `limit` ids next to the cursor (see `window`). None here;
+        see `HybridTimelines`."""
+
+        return []
+
+    def authors(self, owner_id):
+        """The ids of the users whose recent messages make up `owner_id`'s
+        timeline."""
+
+        key = f"authors:{owner_id}"
+        ids = self.storage.get(key) if self.storage is not None else None
+
+        if ids is None:
+            ids = self.load_authors(owner_id)
+            if self.storage is not None:
+                self.storage.set(key, ids)
+
+        return ids
+
+    def load_authors(self, owner_id):
+        """The users `owner_id` follows, and `owner_id`."""
+
+        return [id for (id,) in (db.session
+                                 .query(Follows.user_being_followed_id)
+                                 .filter(Follows.user_following_id == owner_id))] + [owner_id]
+
+    def recent(self, author_ids):
+        """{author id: their newest message ids, newest first}.
+
+        Authors missing from the cache are loaded with one query, a
+        LIMITed index scan per author.
+        """
+
+        lists = {}
+        if self.storage is not None:
+            for author_id in author_ids:
+                ids = self.storage.get(f"recent:{author_id}")
+                if ids is not None:
+                    lists[author_id] = ids
+
+        missing = [author_id for author_id in author_ids if author_id not in lists]
+        if missing:
+            newest = (db.select([Message.id])
+                      .where(Message.user_id == User.id)
+                      .order_by(Message.id.desc())
+                      .limit(self.recent_size)
+                      .lateral())
+            loaded = {author_id: [] for author_id in missing}
+            for author_id, id in (db.session
+                                  .query(User.id, newest.c.id)
+                                  .join(newest, db.true())
+                                  .filter(User.id.in_(missing))):
+                loaded[author_id].append(id)
+
+            for author_id, ids in loaded.items():
+                ids.sort(reverse=True)
+                if self.storage is not None:
+                    self.storage.set(f"recent:{author_id}", ids)
+            lists.update(loaded)
+
+        return lists
+
+    def posted(self, message):
+        self._forget_after_commit(f"recent:{message.user_id}")
+
+    def deleted(self, message):
+        self._forget_after_commit(f"recent:{message.user_id}")
+
+    def followed(self, owner_id, author_id):
+        self._forget_after_commit(f"authors:{owner_id}")
+
+    def unfollowed(self, owner_id, author_id):
+        self._forget_after_commit(f"authors:{owner_id}")
+
+    def user_deleted(self, user_id):
+        # Their followers' lists still name them, but their messages are
+        # gone, so they merge in nothing.
+        self._forget_after_commit(f"recent:{user_id}", f"authors:{user_id}")
+
+    def _forget_after_commit(self, *keys):
+        """Drop `keys` once the current transaction commits; earlier, a
+        concurrent read could cache the old data again."""
+
+        if self.storage is None:
+            return
+
+        def forget(session):
+            for key in keys:
+                self.storage.delete(key)
+
+        db.event.listen(db.session(), 'after_commit', forget, once=True)
+
+    @staticmethod
+    def _load(query, ids):
+        if not ids:
+            return []
+        return query.filter(Message.id.in_(ids)).order_by(Message.id.desc()).all()
+
+
+class HybridTimelines(PullTimelines):
+    """Home timelines pushed for most accounts, pulled for big ones.
+
+    Messages of users with `pull_delivery` set aren't copied into their
+    followers' timelines; a page merges the viewer's materialized
+    timeline with the recent messages of the pulled accounts they
+    follow, as `PullTimelines` does. Viewers who follow none read their
+    timeline as `PushTimelines` does. `reclassify` sets the flag from
+    follower counts.
+
+    Which pulled accounts someone follows is cached like `PullTimelines`
+    caches who they follow, so after `reclassify` runs in another
+    process, pages can miss a switched account's messages until those
+    entries expire.
+    """
+
+    def __init__(self, storage=None, recent_size=RECENT_SIZE):
+        super().__init__(storage, recent_size)
+        self.push = PushTimelines()
+
+    def versions(self, owner_id, older=None, newer=None, per_page=MESSAGES_PER_PAGE):
+        if not self.authors(owner_id):
+            return self.push.versions(owner_id, older, newer, per_page)
+        return super().versions(owner_id, older, newer, per_page)
+
+    def messages(self, owner_id, older=None, newer=None, per_page=MESSAGES_PER_PAGE):
+        if not self.authors(owner_id):
+            return self.push.messages(owner_id, older, newer, per_page)
+        return super().messages(owner_id, older, newer, per_page)
+
+    def exact_ids(self, owner_id, older_than, newer_than, limit):
+        """The owner's materialized timeline around the cursor."""
+
+        return [window(db.session
+                       .query(TimelineEntry.message_id)
+                       .filter(TimelineEntry.owner_id == owner_id),
+                       TimelineEntry.message_id, older_than, newer_than, limit)]
+
+    def load_authors(self, owner_id):
+        """The pulled users among those `owner_id` follows, and `owner_id`
+        if they're pulled too."""
+
+        following = (db.session
+                     .query(Follows.user_being_followed_id)
+                     .filter(Follows.user_following_id == owner_id))
+        return [id for (id,) in (db.session
+                                 .query(User.id)
+                                 .filter(User.pull_delivery,
+                                         db.or_(User.id == owner_id,
+                                                User.id.in_(following))))]
+
+    def posted(self, message):
+        if self._pulled(message.user_id):
+            super().posted(message)
+        else:
+            self.push.posted(message)
+
+    def deleted(self, message):
+        self.push.deleted(message)
+        super().deleted(message)
+
+    def followed(self, owner_id, author_id):
+        if not self._pulled(author_id):
+            self.push.followed(owner_id, author_id)
+        super().followed(owner_id, author_id)
+
+    def unfollowed(self, owner_id, author_id):
+        self.push.unfollowed(owner_id, author_id)
+        super().unfollowed(owner_id, author_id)
+
+    def user_deleted(self, user_id):
+        self.push.user_deleted(user_id)
+        super().user_deleted(user_id)
+
+    @staticmethod
+    def _pulled(user_id):
+        # FOR SHARE, so `reclassify` can't switch the user until this
+        # transaction is done, and its moving of their messages sees ours.
+        return (db.session
+                .query(User.pull_delivery)
+                .filter(User.id == user_id)
+                .with_for_update(read=True)
+                .scalar())
+
+
+def reclassify(threshold=PULL_THRESHOLD):
+    """Switch users with at least `threshold` followers to pull delivery,
+    and pulled ones who've dropped under PUSH_BACK_SHARE of it back to
+    push; None switches everyone back to push.
+
+    Their messages are taken out of their followers' timelines, or the
+    newest TIMELINE_BACKFILL put back. Returns the ids of the users
+    switched to pull and of those switched to push; the caller commits.
+    """
+
+    def switch(pull_delivery, condition):
+        ids = [id for (id,) in db.session.execute(
+            db.update(User.__table__)
+            .where(condition)
+            .values(pull_delivery=pull_delivery)
+            .returning(User.__table__.c.id))]
+        return sorted(ids)
+
+    if threshold is None:
+        to_pull = []
+        to_push = switch(False, User.pull_delivery)
+    else:
+        to_pull = switch(True, db.and_(~User.pull_delivery,
+                                       User.followers_count >= threshold))
+        to_push = switch(False, db.and_(User.pull_delivery,
+                                        User.followers_count < threshold * PUSH_BACK_SHARE))
+
+    for user_id in to_pull:
+        TimelineEntry.withdraw(user_id)
+    for user_id in to_push:
+        TimelineEntry.redeliver(user_id)
+
+    return to_pull, to_push
+
+
+def window(query, id_col, older_than, newer_than, limit):
+    """The `limit` ids of `query` next to the cursor, newest first: those
+    just older than `older_than`, or just newer than `newer_than`."""
+
+    query = query.order_by(None)
+    if newer_than is not None:
+        rows = query.filter(id_col > newer_than).order_by(id_col.asc()).limit(limit)
+        return [id for (id,) in rows][::-1]
+
+    if older_than is not None:
+        query = query.filter(id_col < older_than)
+    return [id for (id,) in query.order_by(id_col.desc()).limit(limit)]
+
+
+def merge(lists, floor, older_than, newer_than, per_page):
+    """Merge id lists, each newest first, into the page next to the
+    cursor. An id in several lists is on the page once.
+
+    The lists are taken to hold every id down to `floor` (None: every id
+    the page could need). Returns None if the page would reach below it.
+    """
+
+    if newer_than is not None:
+        if floor is not None and newer_than < floor:
+            return None
+
+        items = heapq.nsmallest(per_page + 1, {
+            id for ids in lists for id in takewhile(lambda id: id > newer_than, ids)})
+        if not items:
+            return empty_page(newer_than=newer_than)
+        return page_of(items[:per_page][::-1], True, len(items) > per_page)
+
+    merged = unique(heapq.merge(*lists, reverse=True))
+    if older_than is not None:
+        merged = dropwhile(lambda id: id >= older_than, merged)
+    items = list(islice(merged, per_page + 1))
+
+    if floor is not None and (len(items) <= per_page or items[per_page - 1] < floor):
+        return None
+
+    if not items:
+        return empty_page(older_than=older_than)
+    return page_of(items[:per_page], len(items) > per_page, older_than is not None)
+
+
+def unique(ids):
+    """`ids`, sorted, without repeats."""
+
+    last = None
+    for id in ids:
+        if id != last:
+            yield id
+            last = id
+
+
+def page_of(ids, has_older, has_newer):
+    return Page(ids,
+                encode_cursor(ids[-1]) if has_older else None,
+                encode_cursor(ids[0]) if has_newer else None)